@@ -3,25 +3,44 @@
 # Важно: бот добавлен админом в канале @toweringsale
 
 import asyncio
+import contextvars
+import csv
+import functools
+import gzip
+import heapq
+import html
+import json
 import logging
 import os
 import re
+import signal
 import sqlite3
 import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
 from contextlib import contextmanager
+from dataclasses import dataclass, field, fields, replace
 from datetime import datetime, timedelta
-from typing import Optional, List
+from typing import Callable, Optional, List
 
-from aiogram import Bot, Dispatcher, F, Router
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot, Dispatcher, F, Router
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.types import (
-    Message, CallbackQuery,
+    Message, CallbackQuery, FSInputFile,
     KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove,
+    InputMediaPhoto, InputMediaVideo,
 )
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
- the aiogram.fsm.state import StatesGroup, State
+from aiogram.fsm.state import StatesGroup, State
 from aiogram.enums import ParseMode, ChatType
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 # =======================
@@ -30,13 +49,15 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 BOT_TOKEN = os.getenv("BOT_TOKEN", "8052075709:AAGD7-tH2Yq7Ipixmw21y3D1B-oWWGrq03I")
 OWNER_ID = int(os.getenv("OWNER_ID", "6089346880"))
 CHANNEL = os.getenv("CHANNEL", "@toweringsale")
+BOT_API_URL = os.getenv("BOT_API_URL", "")   # свой Bot API сервер (локальный / фейковый из loadtest.py)
 PROJECT_NAME = "@toweringsale"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))   # 0 — не поднимать /metrics
+DB_PROFILE = os.getenv("DB_PROFILE", "0") == "1"         # профайлер запросов (можно включить из админки)
 FOLLOW_PREFIX = "follow_"
 SHOP_PREFIX = "shop_"
 PROFILE_PREFIX = "profile_"
 
-FREE_DAILY_POST_LIMIT = 30
-
 SUB_FREE = "free"
 SUB_VIP = "vip"
 SUB_PLAT = "platinum"
@@ -49,6 +70,14 @@ BADGE = {
     SUB_EXTRA: "🚀 Extra публикация",
 }
 
+# постов в сутки по тарифу (None — без лимита); считаются при отправке, а не при публикации
+DAILY_POST_LIMITS = {
+    SUB_FREE: 30,
+    SUB_VIP: None,
+    SUB_PLAT: None,
+    SUB_EXTRA: None,
+}
+
 CATEGORIES = [
     ("Продам", "sell"),
     ("Куплю", "buy"),
@@ -58,6 +87,61 @@ CATEGORIES = [
 
 PROFILE_THEMES = ["classic", "dark", "towering"]
 
+ALBUM_WINDOW = 1.0   # сек: ждём остальные части альбома (media_group)
+ALBUM_MAX = 10       # лимит Telegram на одну media group
+
+SCHEDULE_MAX_DAYS = 30            # отложенная публикация — не дальше месяца
+CHANNEL_RATE_PER_MIN = float(os.getenv("CHANNEL_RATE_PER_MIN", "20"))   # Telegram: ~20 сообщений/мин в один канал
+CHANNEL_EDIT_RATE_PER_MIN = 30    # правки/удаления старых постов — отдельная очередь
+BOT_RATE_PER_SEC = 25             # Telegram: ~30 сообщений/сек в личку суммарно, держим запас
+
+FANOUT_COALESCE_SEC = 120         # посты автора за это окно уходят подписчикам одним уведомлением
+FANOUT_CHUNK = 500                # подписчиков за один проход курсора (и чекпоинт после него)
+FANOUT_CONCURRENCY = 8            # одновременных sendMessage внутри чанка
+BROADCAST_CHUNK = 100             # получателей рассылки за проход курсора
+MAX_BG_JOBS = 4                   # разовых фоновых задач (выгрузки, рассылки) одновременно
+SCHEDULER_CONCURRENCY = 8         # задач планировщика в работе одновременно (ожидание limiter'а канала не держит остальных)
+SHUTDOWN_DEADLINE_SEC = float(os.getenv("SHUTDOWN_DEADLINE_SEC", "10"))   # на дренаж при остановке
+
+# срок жизни объявления по тарифу (дней)
+LISTING_TTL_DAYS = {
+    SUB_FREE: 7,
+    SUB_VIP: 14,
+    SUB_PLAT: 30,
+    SUB_EXTRA: 60,
+}
+BUMP_COOLDOWN_HOURS = 24
+
+SHOP_PAGE_SIZE = 10
+SHOP_CACHE_TTL = 60          # сек: витрины расшаривают, одни и те же страницы запрашивают пачками
+SHOP_CACHE_MAX_AUTHORS = 5000
+EXPIRE_EVERY_SEC = 600
+EXPIRE_BATCH = 500
+
+# доверие: пересчёт по истории постов и жалобам
+TRUST_EVERY_SEC = 300
+TRUST_BATCH = 1000
+TRUST_VERIFIED_MIN_POSTS = 5        # одобренных/проданных/истёкших
+TRUST_VERIFIED_MIN_RATIO = 0.9      # доля одобренных среди прошедших модерацию
+TRUST_VERIFIED_MIN_AGE_DAYS = 14
+TRUST_VERIFIED_MAX_COMPLAINTS = 1
+TRUST_SCAMMER_COMPLAINTS = 5
+TRUST_SCAMMER_MIN_POSTS = 5
+TRUST_SCAMMER_REJECT_RATIO = 0.7
+TRUST_AUTO_APPROVE = True           # Free-посты verified-авторов публикуются без модерации
+
+# очередь модерации
+MOD_CLAIM_TTL_SEC = 600             # взятый пост возвращается в общую очередь, если админ молчит
+MOD_PAGE_SIZE = 10
+MOD_TAKE_BATCH = 10
+MOD_NOTIFY_EVERY_SEC = 300          # напоминание админам о непустой очереди — не чаще
+
+# архив: закрытые посты старше ARCHIVE_AFTER_DAYS уезжают в data/archive.db
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_BATCH = 2000
+ARCHIVE_EVERY_SEC = 3600
+ARCHIVE_STATUSES = ("rejected", "sold", "expired", "failed")
+
 # =======================
 # ---- ЛОГИ -------------
 # =======================
@@ -68,24 +152,316 @@ logging.basicConfig(
 )
 log = logging.getLogger("toweringsale")
 
+# =======================
+# ---- МЕТРИКИ -----------
+# =======================
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum, self.count, self.max = 0.0, 0, 0.0
+
+    def observe(self, v: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, v)] += 1
+        self.sum += v; self.count += 1
+        if v > self.max: self.max = v
+
+    def quantile(self, q: float) -> float:
+        # верхняя граница корзины, в которую попал квантиль
+        need, acc = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            acc += n
+            if acc >= need and n:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else self.max
+        return 0.0
+
+class Metrics:
+    # Счётчики/гистограммы в памяти процесса, отдаются в текстовом формате Prometheus.
+    # Ключ серии — (имя, отсортированные метки); метки держим короткими (имя хендлера/метода).
+    def __init__(self, prefix: str = "toweringsale"):
+        self.prefix = prefix
+        self.counters: dict[tuple, float] = defaultdict(float)
+        self.hists: dict[tuple, Histogram] = {}
+        self.gauges: dict[str, Callable[[], float]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        h = self.hists.get(key)
+        if h is None:
+            h = self.hists[key] = Histogram()
+        h.observe(value)
+
+    def gauge(self, name: str, fn: Callable[[], float]):
+        self.gauges[name] = fn
+
+    def series(self, name: str) -> dict[str, Histogram]:
+        # гистограммы одного имени по значению первой метки — для сводки в админке
+        return {(lb[0][1] if lb else ""): h for (n, lb), h in self.hists.items() if n == name}
+
+    def render(self) -> str:
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items: return ""
+            return "{" + ",".join(f'{k}="{str(v).replace(chr(34), chr(39))}"' for k, v in items) + "}"
+        out, typed = [], set()
+        for (name, labels), v in sorted(self.counters.items()):
+            full = f"{self.prefix}_{name}"
+            if full not in typed:
+                out.append(f"# TYPE {full} counter"); typed.add(full)
+            out.append(f"{full}{fmt(labels)} {v:g}")
+        for (name, labels), h in sorted(self.hists.items(), key=lambda kv: kv[0]):
+            full = f"{self.prefix}_{name}"
+            if full not in typed:
+                out.append(f"# TYPE {full} histogram"); typed.add(full)
+            acc = 0
+            for le, n in zip(LATENCY_BUCKETS + ("+Inf",), h.counts):
+                acc += n
+                out.append(f"{full}_bucket{fmt(labels, [('le', le)])} {acc}")
+            out.append(f"{full}_sum{fmt(labels)} {h.sum:.6f}")
+            out.append(f"{full}_count{fmt(labels)} {h.count}")
+        for name, fn in sorted(self.gauges.items()):
+            full = f"{self.prefix}_{name}"
+            try: v = fn()
+            except Exception: continue
+            out.append(f"# TYPE {full} gauge")
+            out.append(f"{full} {v:g}")
+        return "\n".join(out) + "\n"
+
+metrics = Metrics()
+GAUGE_TTL_SEC = 5
+
+def ttl_cached(sec: float):
+    # для gauge из БД: запрос не чаще раза в sec, сколько бы scrape/серий ни читали значение
+    def deco(fn: Callable):
+        state = [float("-inf"), None]
+        def wrapper():
+            now = time.monotonic()
+            if now - state[0] >= sec:
+                state[1], state[0] = fn(), now
+            return state[1]
+        return wrapper
+    return deco
+# к какому хендлеру/хелперу относить запросы к БД (contextvar — у каждого апдейта своя задача)
+_db_scope: contextvars.ContextVar[str] = contextvars.ContextVar("db_scope", default="other")
+
+def db_scope(fn):
+    name = fn.__name__
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _db_scope.set(name)
+        try: return fn(*args, **kwargs)
+        finally: _db_scope.reset(token)
+    return wrapper
+
+def _count_query(stmt: str):
+    if not stmt.startswith(("BEGIN", "COMMIT", "ROLLBACK")):
+        metrics.counters[("db_queries_total", (("scope", _db_scope.get()),))] += 1
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    inflight = 0
+
+    async def __call__(self, handler, event, data):
+        h = data.get("handler")
+        name = h.callback.__name__ if h is not None else "unknown"
+        token = _db_scope.set(name)
+        HandlerMetricsMiddleware.inflight += 1
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.inc("handler_errors_total", handler=name)
+            raise
+        finally:
+            metrics.observe("handler_seconds", time.perf_counter() - t0, handler=name)
+            HandlerMetricsMiddleware.inflight -= 1
+            _db_scope.reset(token)
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, "__api_method__", type(method).__name__)
+        t0 = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            metrics.inc("tg_api_errors_total", method=name, error=type(e).__name__)
+            raise
+        finally:
+            metrics.observe("tg_api_seconds", time.perf_counter() - t0, method=name)
+
+async def metrics_http(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server() -> Optional[web.AppRunner]:
+    if not METRICS_PORT:
+        return None
+    mapp = web.Application()
+    mapp.router.add_get("/metrics", metrics_http)
+    runner = web.AppRunner(mapp, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    log.info("Metrics on http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+    return runner
+
 # =======================
 # ---- БОТ --------------
 # =======================
-bot = Bot(BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+bot = Bot(BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+          session=AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)) if BOT_API_URL else None)
 dp = Dispatcher()
-r_public, r_admin, r_owner = Router(), Router(), Router()
-dp.include_routers(r_public, r_admin, r_owner)
+r_public, r_admin, r_owner, r_fallback = Router(), Router(), Router(), Router()
+# r_fallback — последним: его «поймать всё» не должен перекрывать админские хендлеры
+dp.include_routers(r_public, r_admin, r_owner, r_fallback)
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
+bot.session.middleware(ApiMetricsMiddleware())
 
 # =======================
 # ---- БАЗА ДАННЫХ ------
 # =======================
 DB_PATH = os.path.join("data", "bot.db")
+ARCHIVE_PATH = os.path.join("data", "archive.db")   # закрытые старые посты, ATTACH по требованию
 os.makedirs("data", exist_ok=True)
 os.makedirs("backups", exist_ok=True)
 
+# ---- профайлер запросов (опционально) ----
+class QueryStat:
+    __slots__ = ("calls", "total", "max", "rows", "scan")
+
+    def __init__(self):
+        self.calls, self.total, self.max, self.rows, self.scan = 0, 0.0, 0.0, 0, ""
+
+class QueryProfiler:
+    # Агрегирует запросы по нормализованному тексту: литералы -> ?, списки IN (?,?,..) -> (?…).
+    # План (EXPLAIN QUERY PLAN) снимается один раз на каждый новый текст; полный SCAN таблицы помечается.
+    _RE_STR = re.compile(r"'(?:[^']|'')*'")
+    _RE_NUM = re.compile(r"\b\d+(?:\.\d+)?\b")
+    _RE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+    _RE_WS = re.compile(r"\s+")
+    _RE_FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$")
+    # SQLite ≥ 3.36 пишет в плане алиас («SCAN p»): восстанавливаем таблицу по FROM/JOIN запроса
+    _RE_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+(?:\w+\.)?(\w+)\s+(?:AS\s+)?(\w+)", re.I)
+    _NOT_ALIAS = {"WHERE", "JOIN", "LEFT", "INNER", "CROSS", "NATURAL", "ON", "USING", "ORDER", "GROUP",
+                  "LIMIT", "UNION", "HAVING", "WINDOW", "SET", "INDEXED", "NOT", "VALUES"}
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.stats: dict[str, QueryStat] = {}
+        self.since = datetime.now()
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def normalize(sql: str) -> str:
+        q = QueryProfiler._RE_STR.sub("?", sql)
+        q = QueryProfiler._RE_NUM.sub("?", q)
+        q = QueryProfiler._RE_LIST.sub("(?…)", q)
+        return QueryProfiler._RE_WS.sub(" ", q).strip()
+
+    def stat(self, conn: sqlite3.Connection, sql: str, params) -> QueryStat:
+        key = self.normalize(sql)
+        st = self.stats.get(key)
+        if st is None:
+            st = self.stats[key] = QueryStat()
+            if key.split(" ", 1)[0].upper() in ("SELECT", "UPDATE", "DELETE", "INSERT", "WITH", "REPLACE"):
+                aliases = {a: t for t, a in self._RE_ALIAS.findall(sql) if a.upper() not in self._NOT_ALIAS}
+                conn.set_trace_callback(None)   # служебный EXPLAIN не считаем в db_queries_total
+                try:
+                    plan = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params).fetchall()
+                    scans = [m.group(1) for m in (self._RE_FULL_SCAN.match(r[3]) for r in plan) if m]
+                    st.scan = ",".join(f"{aliases[s]} {s}" if s in aliases and aliases[s] != s else s for s in scans)
+                except sqlite3.Error:
+                    pass
+                finally:
+                    conn.set_trace_callback(_count_query)
+        return st
+
+    def reset(self):
+        self.stats.clear(); self.since = datetime.now()
+
+    def report(self, n: int = 10, markup: bool = False, limit: int = 0) -> str:
+        # limit — предел длины текста (сообщение в Telegram — до 4096 символов), 0 — без предела
+        rows = sorted(self.stats.items(), key=lambda kv: kv[1].total, reverse=True)[:n]
+        if not rows:
+            return "Запросов не записано."
+        out = [f"Топ-{len(rows)} запросов по суммарному времени (с {self.since.strftime('%d.%m %H:%M')}):"]
+        size = len(out[0])
+        for i, (sql, st) in enumerate(rows, start=1):
+            scan = f" ⚠️ SCAN {st.scan}" if st.scan else ""
+            entry = (f"{i}. {st.total*1000:.1f} мс · {st.calls} выз · сред {st.total/st.calls*1000:.2f} · "
+                     f"макс {st.max*1000:.1f} · строк {st.rows}{scan}\n"
+                     + (f"<code>{html.escape(sql[:300])}</code>" if markup else "   " + sql))
+            if limit and size + len(entry) + 40 > limit:
+                out.append(f"… и ещё {len(rows) - i + 1}")
+                break
+            out.append(entry); size += len(entry) + 1
+        return "\n".join(out)
+
+TG_TEXT_LIMIT = 4096
+profiler = QueryProfiler(DB_PROFILE)
+
+class ProfiledCursor:
+    # прокси курсора: время выборки и число строк дописываются к статистике запроса
+    __slots__ = ("_cur", "_st", "_dt")
+
+    def __init__(self, cur: sqlite3.Cursor, st: QueryStat, dt: float):
+        self._cur, self._st, self._dt = cur, st, dt
+
+    def _fetched(self, t0: float, n: int):
+        dt = time.perf_counter() - t0
+        self._dt += dt
+        self._st.total += dt; self._st.rows += n
+        if self._dt > self._st.max: self._st.max = self._dt
+
+    def fetchone(self):
+        t0 = time.perf_counter(); r = self._cur.fetchone(); self._fetched(t0, r is not None)
+        return r
+
+    def fetchall(self):
+        t0 = time.perf_counter(); r = self._cur.fetchall(); self._fetched(t0, len(r))
+        return r
+
+    def fetchmany(self, size: int = 1):
+        t0 = time.perf_counter(); r = self._cur.fetchmany(size); self._fetched(t0, len(r))
+        return r
+
+    def __iter__(self):
+        while True:
+            r = self.fetchone()
+            if r is None: return
+            yield r
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+class ProfiledConnection(sqlite3.Connection):
+    def execute(self, sql, params=()):
+        st = profiler.stat(self, sql, params)
+        t0 = time.perf_counter()
+        cur = super().execute(sql, params)
+        dt = time.perf_counter() - t0
+        st.calls += 1; st.total += dt
+        if dt > st.max: st.max = dt
+        return ProfiledCursor(cur, st, dt)
+
+    def executemany(self, sql, seq):
+        st = profiler.stat(self, sql, ())
+        t0 = time.perf_counter()
+        cur = super().executemany(sql, seq)
+        dt = time.perf_counter() - t0
+        st.calls += 1; st.total += dt
+        if dt > st.max: st.max = dt
+        return cur
+
 def _connect():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False,
+                           factory=ProfiledConnection if profiler.enabled else sqlite3.Connection)
     conn.row_factory = sqlite3.Row
+    conn.set_trace_callback(_count_query)
     return conn
 
 def _pragmas(conn: sqlite3.Connection):
@@ -132,7 +508,11 @@ def init_db():
         -- NEW: закреп профиля
         last_profile_pin_at TEXT,
         daily_pin_count INTEGER DEFAULT 0,
-        daily_pin_date TEXT
+        daily_pin_date TEXT,
+        followers_count INTEGER DEFAULT 0,
+        trust_score INTEGER DEFAULT 0,
+        trust_dirty INTEGER DEFAULT 1,               -- история менялась, доверие пересчитать
+        trust_locked INTEGER DEFAULT 0               -- статус выставлен модератором вручную
     );
     """)
     # posts
@@ -142,9 +522,9 @@ def init_db():
         author_tg INTEGER NOT NULL,
         category TEXT,
         text TEXT,
-        media_type TEXT,        -- photo/video/voice/none
+        media_type TEXT,        -- photo/video/voice/album/none
         media_file_id TEXT,
-        status TEXT,            -- pending/approved/rejected
+        status TEXT,            -- pending/publishing/scheduled/approved/rejected/sold/expired/failed
         moderator_tg INTEGER,
         reject_reason TEXT,
         published_msg_id INTEGER,
@@ -152,7 +532,12 @@ def init_db():
         views INTEGER DEFAULT 0,
         complaints INTEGER DEFAULT 0,
         price INTEGER,
-        channel TEXT DEFAULT ''
+        channel TEXT DEFAULT '',
+        expires_at TEXT,
+        bumped_at TEXT,
+        created_at TEXT,
+        claimed_by INTEGER,     -- админ, взявший пост из очереди модерации
+        claimed_at TEXT
     );
     """)
     # follows
@@ -196,12 +581,73 @@ def init_db():
         created_at TEXT
     );
     """)
+    # настройки, изменённые из админки (поверх значений по умолчанию из кода/env)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS settings(
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,     -- JSON
+        updated_by INTEGER,
+        updated_at TEXT
+    );
+    """)
+    # суточная квота постов
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS post_quota(
+        user_tg INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(user_tg, day)
+    ) WITHOUT ROWID;
+    """)
+    # медиа альбомов: несколько file_id на пост
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS post_media(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        post_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        media_type TEXT,        -- photo/video
+        file_id TEXT
+    );
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_post_media_post ON post_media(post_id, position);")
+    # отложенные задачи (публикация по времени и т.п.)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS scheduled_jobs(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,     -- publish
+        ref_id INTEGER,
+        run_at TEXT NOT NULL,
+        status TEXT DEFAULT 'pending',   -- pending/running/done/failed
+        error TEXT,
+        created_at TEXT
+    );
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_pending ON scheduled_jobs(run_at) WHERE status='pending';")
+    # рассылка подписчикам автора: курсор по follows.id, чтобы продолжить после рестарта
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS fanout_jobs(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        author_tg INTEGER NOT NULL,
+        post_ids TEXT NOT NULL,          -- через запятую: копятся, пока задача ждёт окна
+        cursor INTEGER DEFAULT 0,        -- follows.id последнего обработанного подписчика
+        status TEXT DEFAULT 'pending',   -- pending/running/done
+        sent INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        run_at TEXT NOT NULL,
+        created_at TEXT
+    );
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_fanout_active ON fanout_jobs(run_at) WHERE status IN ('pending','running');")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_follows_author ON follows(author_tg);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_follows_follower ON follows(follower_tg, id);")
     # совместимость со старыми базами (без падений)
     def ensure(table: str, col: str, ddl: str):
         try:
             c.execute(f"SELECT {col} FROM {table} LIMIT 1;")
         except sqlite3.OperationalError:
             c.execute(f"ALTER TABLE {table} ADD COLUMN {ddl};")
+            return True
+        return False
     ensure("posts", "reject_reason", "reject_reason TEXT")
     ensure("posts", "price", "price INTEGER")
     ensure("users", "profile_theme", "profile_theme TEXT DEFAULT 'classic'")
@@ -211,17 +657,379 @@ def init_db():
     ensure("users", "last_profile_pin_at", "last_profile_pin_at TEXT")
     ensure("users", "daily_pin_count", "daily_pin_count INTEGER DEFAULT 0")
     ensure("users", "daily_pin_date", "daily_pin_date TEXT")
+    if ensure("posts", "expires_at", "expires_at TEXT"):
+        # старые объявления получают максимальный срок от даты публикации
+        c.execute("UPDATE posts SET expires_at=strftime('%Y-%m-%dT%H:%M:%S', published_at, ?) "
+                  "WHERE status='approved' AND published_at IS NOT NULL",
+                  (f"+{max(LISTING_TTL_DAYS.values())} days",))
+    ensure("posts", "bumped_at", "bumped_at TEXT")
+    if ensure("users", "followers_count", "followers_count INTEGER DEFAULT 0"):
+        # счётчик дальше ведётся при подписке/отписке; один раз досчитываем по истории
+        c.execute("UPDATE users SET followers_count=(SELECT COUNT(*) FROM follows WHERE author_tg=users.tg_id)")
+    ensure("users", "trust_score", "trust_score INTEGER DEFAULT 0")
+    ensure("users", "trust_dirty", "trust_dirty INTEGER DEFAULT 1")   # все существующие — в первый пересчёт
+    ensure("users", "trust_locked", "trust_locked INTEGER DEFAULT 0")
+    ensure("posts", "created_at", "created_at TEXT")
+    ensure("posts", "claimed_by", "claimed_by INTEGER")
+    ensure("posts", "claimed_at", "claimed_at TEXT")
+    ensure("posts", "publishing_from", "publishing_from TEXT")   # куда вернуть пост, если публикация оборвалась
+    # частичные индексы только по активным объявлениям: не растут вместе с историей
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_active_author ON posts(author_tg) WHERE status='approved';")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_active_exp ON posts(expires_at) WHERE status='approved';")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_active_author_cat ON posts(author_tg, category) WHERE status='approved';")
+    # справочник пользователей в админке: поиск по префиксу ника без учёта регистра, фильтры, карточка
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users(username COLLATE NOCASE);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_sub ON users(subscription);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_trust ON users(trust_status);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_author ON posts(author_tg);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_complaints_post ON complaints(post_id);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_admin_logs_target ON admin_logs(target_id);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_joined ON users(joined_at);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_trust_dirty ON users(tg_id) WHERE trust_dirty=1;")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_pending ON posts(id) WHERE status='pending';")
+    # гистограммы цен по категории и ISO-неделе: корзина — номер в PRICE_BUCKETS
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS price_stats(
+        category TEXT NOT NULL,
+        week TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(category, week, bucket)
+    ) WITHOUT ROWID;
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_published ON posts(published_at) WHERE published_at IS NOT NULL;")
+    # готовые доски почёта: tier/category "" — без фильтра
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS leaderboards(
+        days INTEGER NOT NULL,
+        tier TEXT NOT NULL,
+        category TEXT NOT NULL,
+        rank INTEGER NOT NULL,
+        author_tg INTEGER,
+        username TEXT,
+        posts INTEGER,
+        computed_at TEXT,
+        PRIMARY KEY(days, tier, category, rank)
+    ) WITHOUT ROWID;
+    """)
+    # рассылки админов: курсор по tg_id переживает рестарт
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS broadcasts(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        admin_tg INTEGER,
+        target TEXT,           -- all/vip/platinum/extra/active7
+        since TEXT,            -- для active7: срез на момент запуска
+        text TEXT,
+        cursor INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'running',   -- running/done
+        created_at TEXT,
+        finished_at TEXT
+    );
+    """)
+    # журнал событий: seq только растёт, потребители помнят, докуда дочитали
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS events(
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        ref_id INTEGER,
+        actor_tg INTEGER,
+        data TEXT,             -- JSON
+        created_at TEXT
+    );
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS journal_consumers(
+        name TEXT PRIMARY KEY,
+        last_seq INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT
+    );
+    """)
+    # события, которые потребитель не смог разобрать/применить: пропущены, лежат для разбора
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS journal_dead(
+        consumer TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        kind TEXT,
+        data TEXT,
+        error TEXT,
+        created_at TEXT,
+        PRIMARY KEY(consumer, seq)
+    );
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_posts_closed ON posts(id) WHERE status IN ('rejected','sold','expired');")
     conn.commit(); conn.close()
 
 @contextmanager
 def db():
+    t0 = time.perf_counter()
     conn = _connect()
     try:
         yield conn
         conn.commit()
     finally:
         conn.close()
+        metrics.observe("db_seconds", time.perf_counter() - t0, scope=_db_scope.get())
 
+# =======================
+# ---- ЖУРНАЛ СОБЫТИЙ ----
+# =======================
+# Каждое изменение состояния пишет строку в events той же транзакцией, что и само изменение.
+# Производные данные (кэши, счётчики, индексы, сводки) — потребители: читают хвост после своего
+# last_seq и сдвигают его в одной транзакции со своими записями, после рестарта просто догоняют.
+JOURNAL_BATCH = 500
+JOURNAL_IDLE_SEC = 5
+JOURNAL_KEEP_DAYS = 30          # старше — удаляем, если все потребители уже прочли
+_journal_wake = asyncio.Event()
+_consumers: dict[str, tuple[tuple, Callable]] = {}
+
+def journal(conn: sqlite3.Connection, kind: str, ref_id: Optional[int] = None,
+            actor_tg: Optional[int] = None, **data) -> int:
+    seq = conn.execute("INSERT INTO events(kind, ref_id, actor_tg, data, created_at) VALUES(?,?,?,?,?)",
+                       (kind, ref_id, actor_tg, json.dumps(data, ensure_ascii=False) if data else None,
+                        datetime.now().isoformat())).lastrowid
+    _journal_wake.set()
+    return seq
+
+def journal_consumer(name: str, kinds: tuple):
+    # fn(conn, event, data) — вызывается в транзакции, которая сдвигает last_seq. Состояние в памяти
+    # fn не трогает, а возвращает callable: его вызовут после коммита (откат не оставит памяти «вперёд» БД).
+    def deco(fn):
+        _consumers[name] = (kinds, fn)
+        return fn
+    return deco
+
+def journal_head(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM events").fetchone()[0]
+
+def set_consumer_seq(conn: sqlite3.Connection, name: str, seq: int):
+    conn.execute("INSERT INTO journal_consumers(name, last_seq, updated_at) VALUES(?,?,?) "
+                 "ON CONFLICT(name) DO UPDATE SET last_seq=excluded.last_seq, updated_at=excluded.updated_at",
+                 (name, seq, datetime.now().isoformat()))
+
+@db_scope
+def consume_journal(name: str) -> int:
+    kinds, fn = _consumers[name]
+    with db() as conn:
+        row = conn.execute("SELECT last_seq FROM journal_consumers WHERE name=?", (name,)).fetchone()
+        events = conn.execute("SELECT * FROM events WHERE seq>? ORDER BY seq LIMIT ?",
+                              (row["last_seq"] if row else 0, JOURNAL_BATCH)).fetchall()
+        if not events: return 0
+        # сначала сдвиг last_seq: открывает транзакцию, внутри неё у каждого события свой SAVEPOINT
+        set_consumer_seq(conn, name, events[-1]["seq"])
+        after, dead = [], 0
+        for e in events:
+            if e["kind"] not in kinds: continue
+            conn.execute("SAVEPOINT ev")
+            try:
+                if (apply := fn(conn, e, json.loads(e["data"]) if e["data"] else {})): after.append(apply)
+            except Exception as err:
+                # битое событие не должно стопорить потребителя навсегда: откатываем его записи и пропускаем
+                conn.execute("ROLLBACK TO ev")
+                conn.execute("INSERT OR REPLACE INTO journal_dead(consumer, seq, kind, data, error, created_at) "
+                             "VALUES(?,?,?,?,?,?)", (name, e["seq"], e["kind"], e["data"],
+                                                     f"{type(err).__name__}: {err}", datetime.now().isoformat()))
+                log.warning("journal consumer %s: event #%s skipped: %s", name, e["seq"], err)
+                dead += 1
+            conn.execute("RELEASE ev")
+    for apply in after: apply()
+    metrics.inc("journal_consumed_total", len(events), consumer=name)
+    if dead: metrics.inc("journal_dead_total", dead, consumer=name)
+    return len(events)
+
+@db_scope
+def journal_lag() -> dict[str, int]:
+    with db() as conn:
+        head = journal_head(conn)
+        seqs = {r["name"]: r["last_seq"] for r in conn.execute("SELECT name, last_seq FROM journal_consumers")}
+    return {name: head - seqs.get(name, 0) for name in _consumers}
+
+@db_scope
+def prune_journal() -> int:
+    cutoff = (datetime.now() - timedelta(days=JOURNAL_KEEP_DAYS)).isoformat()
+    with db() as conn:
+        seqs = [conn.execute("SELECT COALESCE(MAX(last_seq), 0) FROM journal_consumers WHERE name=?", (n,)).fetchone()[0]
+                for n in _consumers]
+        upto = min(seqs, default=journal_head(conn))
+        return conn.execute("DELETE FROM events WHERE seq<=? AND created_at<?", (upto, cutoff)).rowcount
+
+metrics.gauge("journal_lag_events", lambda: max(journal_lag().values(), default=0))
+
+async def journal_loop():
+    pruned_at = 0.0
+    while True:
+        _journal_wake.clear()
+        behind = False
+        for name in _consumers:
+            try: behind |= consume_journal(name) == JOURNAL_BATCH
+            except Exception as e: log.warning("journal consumer %s error: %s", name, e)
+        if time.monotonic() - pruned_at > 3600:
+            pruned_at = time.monotonic()
+            try: prune_journal()
+            except Exception as e: log.warning("journal prune error: %s", e)
+        if behind:
+            await asyncio.sleep(0)   # догоняем пачками, не занимая цикл целиком
+            continue
+        try: await asyncio.wait_for(_journal_wake.wait(), JOURNAL_IDLE_SEC)
+        except asyncio.TimeoutError: pass
+
+# =======================
+# ---- НАСТРОЙКИ В БД ----
+# =======================
+# Константы выше — значения по умолчанию. Переопределения лежат в таблице settings и собираются
+# в неизменяемый снимок; читатели берут cfg() без блокировок, смена — подмена одной ссылки.
+@dataclass(frozen=True)
+class Settings:
+    channel: str = CHANNEL                     # пусто — публикации уходят владельцу в ЛС
+    # маршрутизация: тариф важнее категории, "" — основной канал
+    category_channels: dict = field(default_factory=lambda: {code: "" for _, code in CATEGORIES})
+    tier_channels: dict = field(default_factory=lambda: {tier: "" for tier in BADGE})
+    gate_all_channels: bool = False            # требовать подписку на все каналы, а не только на основной
+    categories: tuple = tuple(CATEGORIES)      # ((название, код), ...)
+    badges: dict = field(default_factory=lambda: dict(BADGE))
+    daily_post_limits: dict = field(default_factory=lambda: dict(DAILY_POST_LIMITS))
+    listing_ttl_days: dict = field(default_factory=lambda: dict(LISTING_TTL_DAYS))
+    bump_cooldown_hours: int = BUMP_COOLDOWN_HOURS
+    pin_daily_plat: int = 1                    # закрепов профиля в сутки на Platinum
+    pin_cooldown_extra_sec: int = 3600         # КД закрепа на Extra
+    recs_window: int = 120                     # сколько свежих постов перебирают рекомендации
+    trust_auto_approve: bool = TRUST_AUTO_APPROVE
+    mod_claim_ttl_sec: int = MOD_CLAIM_TTL_SEC
+    hof_autopost: str = ""                     # "mon 10:00" — еженедельная доска в канал, пусто — выкл.
+    # производные, считаются один раз на снимок
+    category_titles: dict = field(init=False, repr=False, compare=False)
+    category_codes: dict = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        cats = tuple((str(t), str(c)) for t, c in self.categories)
+        object.__setattr__(self, "categories", cats)
+        object.__setattr__(self, "category_titles", {c: t for t, c in cats})
+        object.__setattr__(self, "category_codes", {t: c for t, c in cats})
+
+SETTINGS_DEFAULT = Settings()
+# нижние границы числовых настроек, где 0 ломает логику (остальные — ≥ 0); для словарей — на каждое значение
+SETTING_MIN = {"mod_claim_ttl_sec": 60, "recs_window": 1, "listing_ttl_days": 1}
+SETTING_KEYS = [f.name for f in fields(Settings) if f.init]
+_settings = SETTINGS_DEFAULT
+_settings_hooks: list[Callable[[], None]] = []   # сброс кэшей, зависящих от настроек
+
+def cfg() -> Settings:
+    return _settings
+
+def on_settings_change(fn: Callable[[], None]):
+    _settings_hooks.append(fn)
+    return fn
+
+def coerce_setting(key: str, value):
+    # проверка типа по значению по умолчанию; ValueError с понятным текстом для админки
+    if key not in SETTING_KEYS:
+        raise ValueError(f"нет такой настройки: {key}")
+    default = getattr(SETTINGS_DEFAULT, key)
+    if isinstance(default, bool):
+        if not isinstance(value, bool): raise ValueError("нужно true или false")
+    elif isinstance(default, int):
+        lo = SETTING_MIN.get(key, 0)
+        if isinstance(value, bool) or not isinstance(value, int) or value < lo:
+            raise ValueError(f"нужно целое число ≥ {lo}")
+    elif isinstance(default, str):
+        if not isinstance(value, str): raise ValueError("нужна строка")
+        value = value.strip()
+        if key == "channel" and not valid_channel(value): raise ValueError("нужен @username или -100…")
+        if key == "hof_autopost" and value and not parse_weekly(value):
+            raise ValueError("нужно «день ЧЧ:ММ», например «mon 10:00» (пусто — выкл.)")
+    elif isinstance(default, dict):
+        if not isinstance(value, dict): raise ValueError("нужен объект {ключ: значение}")
+        nullable = any(v is None for v in default.values())
+        kind = type(next(v for v in default.values() if v is not None))
+        lo = SETTING_MIN.get(key, 0)
+        allowed = set(default)
+        if key == "category_channels": allowed |= set(cfg().category_titles)   # и новые категории
+        for k, v in value.items():
+            if k not in allowed: raise ValueError(f"неизвестный ключ {k} (есть: {', '.join(sorted(allowed))})")
+            if not (v is None and nullable) and (not isinstance(v, kind) or isinstance(v, bool)):
+                raise ValueError(f"{k}: неверный тип значения")
+            if kind is int and v is not None and v < lo:
+                raise ValueError(f"{k}: нужно целое число ≥ {lo}")
+            if key.endswith("_channels") and not valid_channel(v.strip()):
+                raise ValueError(f"{k}: нужен @username или -100… (пусто — основной канал)")
+        value = {**default, **{k: v.strip() if isinstance(v, str) else v for k, v in value.items()}}
+    elif isinstance(default, tuple):
+        if (not isinstance(value, list) or not value
+                or not all(isinstance(x, list) and len(x) == 2 and all(isinstance(y, str) and y for y in x) for x in value)):
+            raise ValueError('нужен список пар [["Название", "код"], ...]')
+        if len({c for _, c in value}) != len(value): raise ValueError("коды категорий повторяются")
+        value = tuple(tuple(x) for x in value)
+    return value
+
+@db_scope
+def load_settings() -> Settings:
+    global _settings
+    with db() as conn:
+        rows = conn.execute("SELECT key, value FROM settings").fetchall()
+    overrides = {}
+    for r in rows:
+        try: overrides[r["key"]] = coerce_setting(r["key"], json.loads(r["value"]))
+        except (ValueError, json.JSONDecodeError) as e:
+            log.warning("setting %s ignored: %s", r["key"], e)
+    new = replace(SETTINGS_DEFAULT, **overrides)
+    changed = new != _settings
+    _settings = new
+    if changed:
+        for hook in _settings_hooks: hook()
+    return new
+
+@db_scope
+def save_setting(key: str, value, admin_tg: int):
+    # value=None — вернуть значение по умолчанию
+    with db() as conn:
+        if value is None:
+            conn.execute("DELETE FROM settings WHERE key=?", (key,))
+        else:
+            conn.execute("INSERT INTO settings(key,value,updated_by,updated_at) VALUES(?,?,?,?) "
+                         "ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_by=excluded.updated_by, "
+                         "updated_at=excluded.updated_at",
+                         (key, json.dumps(value, ensure_ascii=False), admin_tg, datetime.now().isoformat()))
+        conn.execute("INSERT INTO admin_logs(admin_tg,action,target_id,extra,created_at) VALUES(?,?,?,?,?)",
+                     (admin_tg, "setting", 0, f"{key}={'default' if value is None else json.dumps(value, ensure_ascii=False)}",
+                      datetime.now().isoformat()))
+        journal(conn, "setting_changed", None, admin_tg, key=key, value=value)
+    load_settings()
+
+def valid_channel(ch: str) -> bool:
+    return not ch or bool(re.fullmatch(r"@\w{4,}|-100\d+", ch))
+
+def route_chat(category: Optional[str], tier: str):
+    # куда публиковать новый пост: канал тарифа → канал категории → основной
+    c = cfg()
+    return channel_chat(c.tier_channels.get(tier) or c.category_channels.get(category or "") or c.channel)
+
+def all_channels() -> list[str]:
+    c = cfg()
+    chans = [c.channel, *c.tier_channels.values(), *c.category_channels.values()]
+    return list(dict.fromkeys(ch for ch in chans if ch))
+
+def required_channels() -> list[str]:
+    if cfg().gate_all_channels:
+        return all_channels()
+    return [cfg().channel] if cfg().channel else []
+
+def channel_chat(channel: Optional[str] = None):
+    # куда слать: канал поста/текущий канал, без канала — владельцу в ЛС
+    ch = cfg().channel if channel is None else channel
+    return ch or OWNER_ID
+
+def post_chat(p) -> object:
+    # старые посты без сохранённого канала публиковались в CHANNEL из env
+    return channel_chat(p["channel"] or CHANNEL)
+
+def post_link(channel, msg_id: int) -> str:
+    ch = str(channel or "")
+    if ch.startswith("@"): return f"https://t.me/{ch[1:]}/{msg_id}"
+    if ch.startswith("-100"): return f"https://t.me/c/{ch[4:]}/{msg_id}"
+    return f"сообщение #{msg_id}"
+
+@db_scope
 def upsert_user(tg_id: int, username: Optional[str]):
     with db() as conn:
         r = conn.execute("SELECT id FROM users WHERE tg_id=?", (tg_id,)).fetchone()
@@ -234,6 +1042,7 @@ def upsert_user(tg_id: int, username: Optional[str]):
             """, (tg_id, username, 1 if tg_id == OWNER_ID else 0, 1 if tg_id == OWNER_ID else 0,
                   datetime.now().isoformat(), SUB_FREE))
 
+@db_scope
 def get_user(tg_id: int) -> Optional[sqlite3.Row]:
     with db() as conn:
         return conn.execute("SELECT * FROM users WHERE tg_id=?", (tg_id,)).fetchone()
@@ -245,23 +1054,44 @@ def is_admin(uid: int) -> bool:
 def is_owner(uid: int) -> bool:
     return uid == OWNER_ID
 
+@db_scope
 def set_admin(uid: int, v: int):
     with db() as conn:
         conn.execute("UPDATE users SET is_admin=? WHERE tg_id=?", (v, uid))
         conn.execute("INSERT INTO admin_logs(admin_tg,action,target_id,extra,created_at) VALUES(?,?,?,?,?)",
                      (OWNER_ID, "set_admin" if v else "unset_admin", uid, "", datetime.now().isoformat()))
+        journal(conn, "admin_set", uid, OWNER_ID, is_admin=bool(v))
 
+@db_scope
 def list_admins() -> List[sqlite3.Row]:
     with db() as conn:
         return conn.execute("SELECT * FROM users WHERE is_admin=1 ORDER BY (tg_id=? ) DESC, username",
                             (OWNER_ID,)).fetchall()
 
-async def is_channel_subscribed_async(user_id: int) -> bool:
+# кэш членства: getChatMember на каждый /start для каждого канала — лишние запросы к API
+MEMBER_CACHE_TTL = 600        # сек для «подписан»
+MEMBER_CACHE_NEG_TTL = 30     # «не подписан» проверяем чаще: человек как раз идёт подписываться
+MEMBER_CACHE_MAX = 50_000
+_member_cache: dict[tuple[str, int], tuple[float, bool]] = {}
+
+async def is_channel_member(chat: str, user_id: int) -> bool:
+    hit = _member_cache.get((chat, user_id))
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
     try:
-        member = await bot.get_chat_member(CHANNEL, user_id)
-        return member.status in ("member", "administrator", "creator")
+        member = await bot.get_chat_member(chat, user_id)
+        ok = member.status in ("member", "administrator", "creator")
     except Exception:
-        return True
+        return True   # канал недоступен боту — не блокируем пользователя
+    if len(_member_cache) >= MEMBER_CACHE_MAX:
+        _member_cache.clear()
+    _member_cache[(chat, user_id)] = (time.monotonic() + (MEMBER_CACHE_TTL if ok else MEMBER_CACHE_NEG_TTL), ok)
+    return ok
+
+async def is_channel_subscribed_async(user_id: int) -> bool:
+    chans = required_channels()
+    if not chans: return True
+    return all(await asyncio.gather(*(is_channel_member(ch, user_id) for ch in chans)))
 
 def parse_price(text: str) -> Optional[int]:
     m = re.search(r"(\d[\d\s]{0,12})\s*(?:₽|руб|руб\.|RUB|stars|⭐)", text, flags=re.IGNORECASE)
@@ -274,11 +1104,72 @@ def parse_price(text: str) -> Optional[int]:
     try: return int(val)
     except: return None
 
-def user_daily_posts_count(tg_id: int) -> int:
-    start = datetime.now().replace(hour=0,minute=0,second=0,microsecond=0).isoformat()
+# суточная квота: строка (user, день) в post_quota + зеркало в памяти за сегодня.
+# Списание — один UPSERT с условием count<limit, так что пачка отправок до модерации лимит не обходит.
+_quota_day = ""
+_quota: dict[int, int] = {}
+
+def _quota_today() -> str:
+    global _quota_day
+    day = datetime.now().date().isoformat()
+    if day != _quota_day:
+        _quota_day = day; _quota.clear()
+    return day
+
+def user_tier(u: sqlite3.Row) -> str:
+    # «навсегда» без тарифа приравнивается к Extra
+    if u["sub_forever"] and (u["subscription"] or SUB_FREE) == SUB_FREE:
+        return SUB_EXTRA
+    return u["subscription"] or SUB_FREE
+
+def daily_post_limit(u: sqlite3.Row) -> Optional[int]:
+    limits = cfg().daily_post_limits
+    return limits.get(user_tier(u), limits[SUB_FREE])
+
+@db_scope
+def posts_today(tg_id: int) -> int:
+    day = _quota_today()
+    if tg_id not in _quota:
+        with db() as conn:
+            r = conn.execute("SELECT count FROM post_quota WHERE user_tg=? AND day=?", (tg_id, day)).fetchone()
+        _quota[tg_id] = r["count"] if r else 0
+    return _quota[tg_id]
+
+@db_scope
+def take_post_quota(tg_id: int, limit: Optional[int]) -> bool:
+    day = _quota_today()
+    if limit is None: return True
+    if _quota.get(tg_id, 0) >= limit: return False
+    with db() as conn:
+        ok = conn.execute("""
+            INSERT INTO post_quota(user_tg, day, count) VALUES(?, ?, 1)
+            ON CONFLICT(user_tg, day) DO UPDATE SET count=count+1 WHERE count<?
+        """, (tg_id, day, limit)).rowcount
+        r = conn.execute("SELECT count FROM post_quota WHERE user_tg=? AND day=?", (tg_id, day)).fetchone()
+    _quota[tg_id] = r["count"] if r else 0
+    return bool(ok)
+
+@db_scope
+def refund_post_quota(tg_id: int, day: Optional[str] = None):
+    # пост списан с квоты, но в канал не ушёл — возвращаем (квота за прошедший день уже не важна)
+    today = _quota_today()
+    if (day or today) != today: return
+    with db() as conn:
+        conn.execute("UPDATE post_quota SET count=count-1 WHERE user_tg=? AND day=? AND count>0", (tg_id, today))
+        r = conn.execute("SELECT count FROM post_quota WHERE user_tg=? AND day=?", (tg_id, today)).fetchone()
+    _quota[tg_id] = r["count"] if r else 0
+
+@db_scope
+def prune_post_quota():
+    with db() as conn:
+        conn.execute("DELETE FROM post_quota WHERE day<?", (_quota_today(),))
+
+@db_scope
+def post_media_list(pid: int) -> list[list[str]]:
     with db() as conn:
-        return conn.execute("SELECT COUNT(*) FROM posts WHERE author_tg=? AND published_at>=?",
-                            (tg_id, start)).fetchone()[0]
+        rows = conn.execute("SELECT media_type, file_id FROM post_media WHERE post_id=? ORDER BY position",
+                            (pid,)).fetchall()
+    return [[r["media_type"], r["file_id"]] for r in rows]
 
 # =======================
 # ---- FSM ---------------
@@ -287,6 +1178,7 @@ class PostSG(StatesGroup):
     cat = State()
     content = State()
     confirm = State()
+    when = State()
 
 class RejectSG(StatesGroup):
     reason = State()
@@ -295,12 +1187,16 @@ class AlertsSG(StatesGroup):
     type = State()
     value = State()
 
+class SettingsSG(StatesGroup):
+    channel = State()
+
 class AdminSG(StatesGroup):
     bc_target = State()
     bc_text = State()
     grant_user = State()
     grant_level = State()
     grant_term = State()
+    user_search = State()
 
 class StoreSG(StatesGroup):
     title = State()
@@ -320,12 +1216,13 @@ def main_kb(is_admin_flag: bool):
     return ReplyKeyboardMarkup(keyboard=rows, resize_keyboard=True)
 
 def categories_kb():
-    kb = [[KeyboardButton(text=title)] for title,_ in CATEGORIES]
+    kb = [[KeyboardButton(text=title)] for title,_ in cfg().categories]
     kb.append([KeyboardButton(text="⬅️ Назад")])
     return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
 
 def profile_kb(u: sqlite3.Row):
-    rows = [[KeyboardButton(text="🎨 Тема профиля"), KeyboardButton(text="🕶 Инкогнито")]]
+    rows = [[KeyboardButton(text="🎨 Тема профиля"), KeyboardButton(text="🕶 Инкогнито")],
+            [KeyboardButton(text="📋 Мои объявления")]]
     # NEW: магазин Extra + закреп профиля
     if u["subscription"] == SUB_EXTRA:
         rows.append([KeyboardButton(text="🛒 Моя витрина")])
@@ -339,6 +1236,7 @@ def alerts_menu_kb():
         keyboard=[
             [KeyboardButton(text="➕ Создать фильтр")],
             [KeyboardButton(text="📃 Мои фильтры")],
+            [KeyboardButton(text="👥 Мои подписки")],
             [KeyboardButton(text="⬅️ Назад")],
         ], resize_keyboard=True
     )
@@ -347,10 +1245,15 @@ def admin_kb(owner: bool):
     kb = [
         [KeyboardButton(text="📨 Рассылка"), KeyboardButton(text="📊 Глобальная статистика")],
         [KeyboardButton(text="🔥 Heatmap"), KeyboardButton(text="🏆 Доска почёта")],   # NEW
+        [KeyboardButton(text="💹 Цены")],
+        [KeyboardButton(text="🗂 Очередь модерации"), KeyboardButton(text="📤 Экспорт")],
         [KeyboardButton(text="👥 Пользователи"), KeyboardButton(text="🧑‍💻 Админы")],
+        [KeyboardButton(text="📈 Метрики"), KeyboardButton(text="🐢 Запросы БД")],
+        [KeyboardButton(text="🩺 Задачи")],
     ]
     if owner:
         kb.insert(0, [KeyboardButton(text="➕ Выдать подписку"), KeyboardButton(text="🗝 Выдать/Снять админа")])
+        kb.insert(1, [KeyboardButton(text="⚙️ Настройки"), KeyboardButton(text="📡 Канал: установить")])
     kb.append([KeyboardButton(text="⬅️ Назад")])
     return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
 
@@ -378,12 +1281,19 @@ def render_profile_card(u: sqlite3.Row) -> str:
         f"💳 Подписка: {sub_string(u)}\n"
         f"🛡 Доверие: {u['trust_status']}\n"
         f"🎭 Инкогнито: {inc}\n"
-        f"📊 Постов: {u['posts_total']} (за 30д: {u['posts_30d']})"
+        f"📊 Постов: {u['posts_total']} (за 30д: {u['posts_30d']})\n"
+        f"👥 Подписчиков: {u['followers_count'] or 0}"
     )
 
+_bot_username: Optional[str] = None
+
 async def bot_username() -> str:
-    me = await bot.get_me()
-    return me.username
+    # username бота не меняется за время жизни процесса — getMe один раз
+    global _bot_username
+    if _bot_username is None:
+        me = await bot.get_me()
+        _bot_username = me.username
+    return _bot_username
 
 def follow_link_for(author_tg: int, uname: str) -> str:
     return f"https://t.me/{uname}?start={FOLLOW_PREFIX}{author_tg}"
@@ -400,7 +1310,7 @@ async def deep_link(m: Message, command: CommandStart):
     # проверим подписку на канал
     ok = await is_channel_subscribed_async(m.from_user.id)
     if not ok:
-        await m.answer(f"Подпишись на канал {PROJECT_NAME}, затем вернись и нажми /start")
+        await m.answer(f"Подпишись на {', '.join(required_channels())}, затем вернись и нажми /start")
         return
     payload = command.args or ""
     if payload.startswith(FOLLOW_PREFIX):
@@ -409,9 +1319,8 @@ async def deep_link(m: Message, command: CommandStart):
             if author == m.from_user.id:
                 await m.answer("Нельзя подписаться на самого себя.")
                 return
-            with db() as conn:
-                conn.execute("INSERT OR IGNORE INTO follows(follower_tg,author_tg,created_at) VALUES(?,?,?)",
-                             (m.from_user.id, author, datetime.now().isoformat()))
+            if not follow_author(m.from_user.id, author):
+                await m.answer("Вы уже подписаны на этого автора."); return
             await m.answer("✅ Подписка на автора оформлена.")
             return
         except: pass
@@ -434,12 +1343,12 @@ async def deep_link(m: Message, command: CommandStart):
 async def start(m: Message):
     upsert_user(m.from_user.id, m.from_user.username)
     if not await is_channel_subscribed_async(m.from_user.id):
-        await m.answer(f"Чтобы пользоваться ботом — подпишись на {PROJECT_NAME}\nПосле — /start")
+        await m.answer(f"Чтобы пользоваться ботом — подпишись на {', '.join(required_channels())}\nПосле — /start")
         return
     u = get_user(m.from_user.id)
     await m.answer(
         f"Добро пожаловать в {PROJECT_NAME}!\nБиржа объявлений с модерацией и подписками (VIP/Platinum/Extra).",
-        reply_markup=main_kb(is_admin(u["is_admin"]) if u else False)
+        reply_markup=main_kb(bool(u["is_admin"]) if u else False)
     )
 
 # =======================
@@ -483,6 +1392,7 @@ async def incognito_toggle(m: Message):
     new = 0 if u["incognito"] else 1
     with db() as conn:
         conn.execute("UPDATE users SET incognito=? WHERE tg_id=?", (new, m.from_user.id))
+    invalidate_author_render(m.from_user.id)
     await m.answer(f"Инкогнито: {'ON' if new else 'OFF'}")
 
 # =======================
@@ -505,7 +1415,7 @@ async def my_storefront(m: Message, state: FSMContext):
            f"🔗 Ссылка для клиентов: {link}\n\n"
            f"• «✏️ Название» — задать заголовок\n"
            f"• «📄 Описание» — задать описание\n"
-           f"• «📤 Поделиться в канале» — опубликовать карточку витрины в @{CHANNEL[1:]}")
+           f"• «📤 Поделиться в канале» — опубликовать карточку витрины в {cfg().channel or 'ЛС владельца'}")
     kb = InlineKeyboardBuilder()
     kb.button(text="✏️ Название", callback_data="store:title")
     kb.button(text="📄 Описание", callback_data="store:bio")
@@ -524,6 +1434,7 @@ async def store_title_set(m: Message, state: FSMContext):
     title = (m.text or "").strip()[:80]
     with db() as conn:
         conn.execute("UPDATE users SET storefront_title=? WHERE tg_id=?", (title, m.from_user.id))
+    invalidate_shop(m.from_user.id)
     await state.clear()
     await my_storefront(m, state)
 
@@ -538,6 +1449,7 @@ async def store_bio_set(m: Message, state: FSMContext):
     bio = (m.text or "").strip()[:500]
     with db() as conn:
         conn.execute("UPDATE users SET storefront_bio=? WHERE tg_id=?", (bio, m.from_user.id))
+    invalidate_shop(m.from_user.id)
     await state.clear()
     await my_storefront(m, state)
 
@@ -556,26 +1468,82 @@ async def store_post_channel(c: CallbackQuery):
         f"— опубликовано через {PROJECT_NAME}"
     )
     try:
-        await bot.send_message(CHANNEL, card, disable_web_page_preview=True)
+        await bot.send_message(channel_chat(), card, disable_web_page_preview=True)
         await c.answer("Витрина опубликована в канал.")
     except Exception as e:
         await c.answer("Не удалось опубликовать (бот должен быть админом в канале).", show_alert=True)
 
-async def show_storefront(m: Message, author_tg: int):
+# Страницы витрины: keyset по (author_tg, id), курсор — id последнего поста на странице.
+# Готовые страницы живут SHOP_CACHE_TTL сек и сбрасываются при любой публикации/снятии поста автора.
+_shop_pages: dict[int, dict[tuple, tuple[float, str, object]]] = {}
+
+def invalidate_shop(author_tg: int):
+    _shop_pages.pop(author_tg, None)
+
+on_settings_change(_shop_pages.clear)   # категории и ссылки на канал зашиты в страницы
+
+@db_scope
+def shop_page(author_tg: int, cat: Optional[str], cursor: int):
+    pages = _shop_pages.get(author_tg)
+    hit = pages.get((cat, cursor)) if pages else None
+    if hit and hit[0] > time.monotonic():
+        return hit[1], hit[2]
+    q, params = "SELECT id, published_msg_id, text, channel FROM posts WHERE author_tg=? AND status='approved'", [author_tg]
+    if cat:
+        q += " AND category=?"; params.append(cat)
+    if cursor:
+        q += " AND id<?"; params.append(cursor)
     with db() as conn:
         u = conn.execute("SELECT * FROM users WHERE tg_id=?", (author_tg,)).fetchone()
-        posts = conn.execute(
-            "SELECT published_msg_id FROM posts WHERE author_tg=? AND status='approved' ORDER BY id DESC LIMIT 20",
-            (author_tg,)
-        ).fetchall()
-    if not u:
-        await m.answer("Витрина не найдена."); return
-    links = [f"• https://t.me/{CHANNEL[1:]}/{p['published_msg_id']}" for p in posts if p["published_msg_id"]]
+        if not u:
+            return None
+        posts = conn.execute(q + " ORDER BY id DESC LIMIT ?", (*params, SHOP_PAGE_SIZE + 1)).fetchall()
+    more, posts = len(posts) > SHOP_PAGE_SIZE, posts[:SHOP_PAGE_SIZE]
+    links = [f"• {html.escape((p['text'] or '').strip()[:40])} — {post_link(p['channel'] or CHANNEL, p['published_msg_id'])}"
+             for p in posts if p["published_msg_id"]]
     header = f"🛒 Витрина @{u['username'] or 'ID'+str(u['tg_id'])}\n"
     if u["storefront_title"]: header += f"<b>{u['storefront_title']}</b>\n"
     if u["storefront_bio"]: header += f"{u['storefront_bio']}\n"
-    txt = header + ("\n".join(links) if links else "\nПока нет опубликованных постов.")
-    await m.answer(txt, disable_web_page_preview=True)
+    if cat: header += f"📂 {cfg().category_titles.get(cat, cat)}\n"
+    empty = "\nВ этой категории пока пусто." if cat else "\nПока нет опубликованных постов."
+    txt = header + ("\n".join(links) if links else empty)
+    kb = InlineKeyboardBuilder()
+    kb.button(text=("• " if not cat else "") + "Все", callback_data=f"shop:{author_tg}:-:0")
+    for title, code in cfg().categories:
+        kb.button(text=("• " if cat == code else "") + title, callback_data=f"shop:{author_tg}:{code}:0")
+    nav = 0
+    if cursor:
+        kb.button(text="⏮ В начало", callback_data=f"shop:{author_tg}:{cat or '-'}:0"); nav += 1
+    if more:
+        kb.button(text="➡️ Дальше", callback_data=f"shop:{author_tg}:{cat or '-'}:{posts[-1]['id']}"); nav += 1
+    kb.adjust(len(cfg().categories) + 1, *([nav] if nav else []))
+    markup = kb.as_markup()
+    if len(_shop_pages) >= SHOP_CACHE_MAX_AUTHORS and author_tg not in _shop_pages:
+        _shop_pages.clear()
+    _shop_pages.setdefault(author_tg, {})[(cat, cursor)] = (time.monotonic() + SHOP_CACHE_TTL, txt, markup)
+    return txt, markup
+
+async def show_storefront(m: Message, author_tg: int):
+    page = shop_page(author_tg, None, 0)
+    if not page:
+        await m.answer("Витрина не найдена."); return
+    txt, markup = page
+    await m.answer(txt, reply_markup=markup, disable_web_page_preview=True)
+
+@r_public.callback_query(F.data.startswith("shop:"))
+async def shop_nav(c: CallbackQuery):
+    try:
+        _, author, cat, cursor = c.data.split(":")
+        author_tg, cursor = int(author), int(cursor)
+    except ValueError:
+        return await c.answer()
+    page = shop_page(author_tg, None if cat == "-" else cat, cursor)
+    if not page:
+        await c.answer("Витрина не найдена.", show_alert=True); return
+    txt, markup = page
+    try: await c.message.edit_text(txt, reply_markup=markup, disable_web_page_preview=True)
+    except TelegramBadRequest: pass  # та же страница — «message is not modified»
+    await c.answer()
 
 async def show_public_profile(m: Message, author_tg: int):
     u = get_user(author_tg)
@@ -599,15 +1567,16 @@ def can_pin_profile(u: sqlite3.Row) -> tuple[bool, str]:
         day = (u["daily_pin_date"] or "")
         if day != datetime.now().date().isoformat():
             return True, ""  # сброс счётчика на новый день
-        if (u["daily_pin_count"] or 0) >= 1:
-            return False, "Доступно 1 закреп профиля в сутки на Platinum."
+        if (u["daily_pin_count"] or 0) >= cfg().pin_daily_plat:
+            return False, f"Доступно {cfg().pin_daily_plat} закреп(а) профиля в сутки на Platinum."
         if last and (now - last).total_seconds() < 5:  # защита от дабл-тапа
             return False, "Подождите немного."
         return True, ""
     # Extra
-    if last and (now - last).total_seconds() < 3600:
-        left = 3600 - int((now - last).total_seconds())
-        return False, f"Кулдаун 1 час. Осталось {left//60} мин."
+    cooldown = cfg().pin_cooldown_extra_sec
+    if last and (now - last).total_seconds() < cooldown:
+        left = cooldown - int((now - last).total_seconds())
+        return False, f"Кулдаун {cooldown // 60} мин. Осталось {left//60} мин."
     return True, ""
 
 @r_public.message(F.text == "📌 Закрепить профиль")
@@ -623,9 +1592,10 @@ async def pin_profile(m: Message):
         return
     card = render_profile_card(u) + "\n\n" + "— закреп профиля автора"
     try:
-        msg = await bot.send_message(CHANNEL, card)
+        chat = channel_chat()
+        msg = await bot.send_message(chat, card)
         # Пин в канале
-        await bot.pin_chat_message(CHANNEL, msg.message_id, disable_notification=True)
+        await bot.pin_chat_message(chat, msg.message_id, disable_notification=True)
         # учёт квоты
         with db() as conn:
             if u["subscription"] == SUB_PLAT and not u["sub_forever"]:
@@ -638,6 +1608,7 @@ async def pin_profile(m: Message):
                                  (datetime.now().isoformat(), m.from_user.id))
             else:
                 conn.execute("UPDATE users SET last_profile_pin_at=? WHERE tg_id=?", (datetime.now().isoformat(), m.from_user.id))
+            journal(conn, "profile_pinned", m.from_user.id, m.from_user.id, chat=str(chat), msg_id=msg.message_id)
         await m.answer("Профиль закреплён в канале ✅")
     except Exception as e:
         await m.answer("Не удалось закрепить (бот должен быть админом в канале).")
@@ -645,31 +1616,28 @@ async def pin_profile(m: Message):
 # =======================
 # ---- РЕКОМЕНДАЦИИ ------
 # =======================
+@db_scope
 def user_alerts(uid: int) -> list[sqlite3.Row]:
     with db() as conn:
         return conn.execute("SELECT type,value FROM alerts WHERE user_tg=?", (uid,)).fetchall()
 
-def user_followed_authors(uid: int) -> list[int]:
-    with db() as conn:
-        rows = conn.execute("SELECT author_tg FROM follows WHERE follower_tg=?", (uid,)).fetchall()
-        return [r["author_tg"] for r in rows]
-
 @r_public.message(F.text == "🔮 Рекомендации")
 async def recommendations(m: Message):
-    # Соберём последние 120 одобренных постов и отранжируем
+    # Соберём последние cfg().recs_window одобренных постов и отранжируем
     alerts = user_alerts(m.from_user.id)
-    follows = set(user_followed_authors(m.from_user.id))
     with db() as conn:
+        # подписка на автора — точечный lookup по UNIQUE(follower_tg, author_tg) на каждый пост
         posts = conn.execute("""
-            SELECT id, author_tg, text, category, published_msg_id
-            FROM posts WHERE status='approved' AND published_msg_id IS NOT NULL
-            ORDER BY id DESC LIMIT 120
-        """).fetchall()
+            SELECT p.id, p.author_tg, p.text, p.category, p.published_msg_id, p.channel,
+                   EXISTS(SELECT 1 FROM follows f WHERE f.follower_tg=? AND f.author_tg=p.author_tg) AS followed
+            FROM posts p WHERE p.status='approved' AND p.published_msg_id IS NOT NULL
+            ORDER BY p.id DESC LIMIT ?
+        """, (m.from_user.id, cfg().recs_window)).fetchall()
     scored = []
     for p in posts:
         score = 0
         # сигнал от подписок на автора
-        if p["author_tg"] in follows: score += 3
+        if p["followed"]: score += 3
         # сигнал от фильтров
         txt = (p["text"] or "").lower()
         for a in alerts:
@@ -688,55 +1656,9 @@ async def recommendations(m: Message):
     if not top:
         await m.answer("Пока нечего рекомендовать.")
         return
-    links = [f"• https://t.me/{CHANNEL[1:]}/{p['published_msg_id']}" for p in top]
+    links = [f"• {post_link(p['channel'] or CHANNEL, p['published_msg_id'])}" for p in top]
     await m.answer("Рекомендации для вас:\n" + "\n".join(links), disable_web_page_preview=True)
 
-# =======================
-# ---- Доска почёта -------
-# =======================
-def top_extra_authors(days: int = 30, limit: int = 5) -> List[sqlite3.Row]:
-    since = (datetime.now() - timedelta(days=days)).isoformat()
-    with db() as conn:
-        return conn.execute("""
-        SELECT u.tg_id, u.username, COUNT(p.id) as cnt
-        FROM users u
-        JOIN posts p ON p.author_tg=u.tg_id AND p.status='approved' AND p.published_at>=?
-        WHERE u.subscription='extra' OR u.sub_forever=1
-        GROUP BY u.tg_id, u.username
-        ORDER BY cnt DESC, u.tg_id ASC
-        LIMIT ?
-        """, (since, limit)).fetchall()
-
-@r_admin.message(F.text == "🏆 Доска почёта")
-async def hall_of_fame(m: Message):
-    if not is_admin(m.from_user.id): return
-    rows = top_extra_authors()
-    if not rows:
-        await m.answer("Нет данных за последние 30 дней.")
-        return
-    lines = ["🥇 Топ Extra авторов за 30 дней:"]
-    for i,r in enumerate(rows, start=1):
-        lines.append(f"{i}. @{r['username'] or 'ID'+str(r['tg_id'])} — {r['cnt']} пост(ов)")
-    txt = "\n".join(lines)
-    kb = InlineKeyboardBuilder()
-    kb.button(text="📤 Опубликовать в канал", callback_data="hof:post")
-    kb.adjust(1)
-    await m.answer(txt, reply_markup=kb.as_markup())
-
-@r_admin.callback_query(F.data == "hof:post")
-async def hof_post(c: CallbackQuery):
-    rows = top_extra_authors()
-    if not rows:
-        await c.answer("Нет данных", show_alert=True); return
-    lines = ["🥇 Топ Extra авторов (30 дней):"]
-    for i,r in enumerate(rows, start=1):
-        lines.append(f"{i}. @{r['username'] or 'ID'+str(r['tg_id'])} — {r['cnt']} пост(ов)")
-    try:
-        await bot.send_message(CHANNEL, "\n".join(lines))
-        await c.answer("Опубликовано в канал.")
-    except:
-        await c.answer("Не удалось опубликовать (бот должен быть админом в канале).", show_alert=True)
-
 # =======================
 # ---- ПОДПИСКИ/ФИЛЬТРЫ ---
 # =======================
@@ -759,7 +1681,7 @@ async def alert_type(c: CallbackQuery, state: FSMContext):
     code = c.data.split(":")[1]
     await state.update_data(kind=code)
     if code == "cat":
-        cats = ", ".join([c for _,c in CATEGORIES])
+        cats = ", ".join([c for _,c in cfg().categories])
         await c.message.edit_text(f"Введите код категории ({cats})")
     elif code == "kw":
         await c.message.edit_text("Введите ключевое слово:")
@@ -773,7 +1695,7 @@ async def alert_save(m: Message, state: FSMContext):
     data = await state.get_data(); kind = data.get("kind")
     val = (m.text or "").strip().lower()
     if kind == "cat":
-        codes = [c for _,c in CATEGORIES]
+        codes = [c for _,c in cfg().categories]
         if val not in codes:
             await m.answer("Нет такой категории."); return
         typ = "category"
@@ -811,15 +1733,673 @@ async def alerts_delete(c: CallbackQuery):
     await c.answer("Удалено")
     await c.message.delete()
 
+# =======================
+# ---- ПЛАНИРОВЩИК -------
+# =======================
+_bg_tasks: set[asyncio.Task] = set()
+
+def spawn_bg(coro) -> asyncio.Task:
+    # держим ссылку, иначе GC может прибить задачу на лету
+    t = asyncio.create_task(coro)
+    _bg_tasks.add(t); t.add_done_callback(_bg_tasks.discard)
+    return t
+
+@dataclass
+class TaskInfo:
+    name: str
+    factory: Callable
+    restart: str = "always"                  # always | on_failure | never
+    stop: Optional[Callable[[], None]] = None   # есть — при остановке дренируем, нет — отменяем
+    task: Optional[asyncio.Task] = None
+    state: str = "new"                       # running | backoff | done | failed | stopped
+    restarts: int = 0
+    started_at: float = 0.0
+    last_error: str = ""
+    last_error_at: float = 0.0
+
+class Supervisor:
+    # Долгоживущие фоновые задачи по именам: упала — перезапуск с backoff (1..60 с) по политике.
+    # Разовые (выгрузки, рассылки) — через submit, не больше max_jobs одновременно.
+    # shutdown: останавливает приём, ждёт дренажа до дедлайна, остальное отменяет.
+    def __init__(self, max_jobs: int):
+        self.tasks: dict[str, TaskInfo] = {}
+        self.jobs: dict[str, asyncio.Task] = {}
+        self.jobs_running: set[str] = set()
+        self.max_jobs = max_jobs
+        self._jobs_sem = asyncio.Semaphore(max_jobs)
+        self.stopping = False
+
+    def register(self, name: str, factory: Callable, restart: str = "always",
+                 stop: Optional[Callable[[], None]] = None):
+        self.tasks[name] = TaskInfo(name, factory, restart, stop)
+
+    def start(self):
+        for info in self.tasks.values():
+            info.task = spawn_bg(self._keep(info))
+
+    async def _keep(self, info: TaskInfo):
+        backoff = 1.0
+        while True:
+            info.state, info.started_at = "running", time.time()
+            try:
+                await info.factory()
+                if self.stopping or info.restart != "always":
+                    info.state = "stopped" if self.stopping else "done"
+                    return
+            except asyncio.CancelledError:
+                info.state = "stopped"
+                raise
+            except Exception as e:
+                info.state, info.last_error, info.last_error_at = "failed", f"{type(e).__name__}: {e}", time.time()
+                log.exception("task %s crashed", info.name)
+                metrics.inc("task_crashes_total", task=info.name)
+                if info.restart == "never" or self.stopping: return
+            if time.time() - info.started_at > 60: backoff = 1.0   # долго жила — падение не считаем петлёй
+            info.restarts += 1; info.state = "backoff"
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+    def submit(self, name: str, coro) -> Optional[asyncio.Task]:
+        if self.stopping or name in self.jobs:
+            coro.close()
+            return None
+        async def _run():
+            async with self._jobs_sem:
+                self.jobs_running.add(name)
+                try: return await coro
+                finally: self.jobs_running.discard(name)
+        t = self.jobs[name] = spawn_bg(_run())
+        t.add_done_callback(lambda _: self.jobs.pop(name, None))
+        return t
+
+    async def shutdown(self, deadline: float, drained: Callable[[], bool]) -> list[str]:
+        self.stopping = True
+        until = time.monotonic() + deadline
+        for info in self.tasks.values():
+            if not info.task: continue
+            if info.stop: info.stop()
+            else: info.task.cancel()   # периодические циклы: всё, что сделано, уже в БД
+        draining = [i.task for i in self.tasks.values() if i.stop and i.task]
+        while time.monotonic() < until:
+            if drained() and not self.jobs and all(t.done() for t in draining): break
+            await asyncio.sleep(0.1)
+        left = [i.name for i in self.tasks.values() if i.task and not i.task.done()] + list(self.jobs)
+        rest = [t for t in _bg_tasks if t is not asyncio.current_task() and not t.done()]
+        for t in rest: t.cancel()
+        await asyncio.gather(*rest, return_exceptions=True)
+        return left
+
+supervisor = Supervisor(max_jobs=MAX_BG_JOBS)
+
+class RateLimiter:
+    # token bucket: в среднем rate событий/сек, всплеск до burst
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate, self.burst = rate, burst
+        self._tokens = float(burst)
+        self._ts = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._ts) * self.rate)
+                self._ts = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class Scheduler:
+    # Задачи живут в scheduled_jobs (переживают рестарт), в памяти — только куча (run_at, job_id).
+    # Выдача идёт через limiter, чтобы пачка задач на одно время не упёрлась в лимиты бота
+    # (лимиты конкретного канала держит channel_limiter_for при отправке). Каждая задача — отдельная
+    # asyncio-задача, не больше concurrency сразу: пост, ждущий лимита своего канала, не держит остальные.
+    def __init__(self, limiter: RateLimiter, concurrency: int):
+        self.limiter = limiter
+        self.handlers = {}
+        self._heap: list[tuple[float, int]] = []
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._sem = asyncio.Semaphore(concurrency)
+        self._running: set[asyncio.Task] = set()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def handler(self, kind: str):
+        def deco(fn):
+            self.handlers[kind] = fn
+            return fn
+        return deco
+
+    def load(self):
+        with db() as conn:
+            # упали посреди выполнения — повторим
+            conn.execute("UPDATE scheduled_jobs SET status='pending' WHERE status='running'")
+            rows = conn.execute("SELECT id, run_at FROM scheduled_jobs WHERE status='pending'").fetchall()
+        self._heap = [(datetime.fromisoformat(r["run_at"]).timestamp(), r["id"]) for r in rows]
+        heapq.heapify(self._heap)
+        self._wake.set()
+
+    def push(self, job_id: int, run_at: float):
+        heapq.heappush(self._heap, (run_at, job_id))
+        if self._heap[0][1] == job_id:
+            self._wake.set()
+
+    def schedule(self, kind: str, ref_id: int, run_at: datetime) -> int:
+        with db() as conn:
+            cur = conn.execute(
+                "INSERT INTO scheduled_jobs(kind,ref_id,run_at,status,created_at) VALUES(?,?,?,'pending',?)",
+                (kind, ref_id, run_at.isoformat(), datetime.now().isoformat()))
+            job_id = cur.lastrowid
+        self.push(job_id, run_at.timestamp())
+        return job_id
+
+    def stop(self):
+        # начатые задачи доработают, новые не берём (pending останутся в БД)
+        self._stopping = True
+        self._wake.set()
+
+    async def run(self):
+        await self._loop()
+        # дренаж: run вернётся, когда начатые задачи закончатся (или shutdown их отменит)
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def _loop(self):
+        while not self._stopping:
+            self._wake.clear()
+            if not self._heap:
+                await self._wake.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try: await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError: pass
+                continue
+            _, job_id = heapq.heappop(self._heap)
+            await self.limiter.acquire()
+            await self._sem.acquire()
+            t = spawn_bg(self._dispatch(job_id))
+            self._running.add(t)
+            t.add_done_callback(lambda t: (self._running.discard(t), self._sem.release()))
+
+    async def _dispatch(self, job_id: int):
+        with db() as conn:
+            cur = conn.execute("UPDATE scheduled_jobs SET status='running' WHERE id=? AND status='pending'", (job_id,))
+            if not cur.rowcount:
+                return  # отменена или уже выполнена
+            job = conn.execute("SELECT kind, ref_id FROM scheduled_jobs WHERE id=?", (job_id,)).fetchone()
+        status, err = "done", None
+        try:
+            await self.handlers[job["kind"]](job["ref_id"])
+        except Exception as e:
+            status, err = "failed", str(e)
+            log.warning("job #%s (%s) failed: %s", job_id, job["kind"], e)
+        with db() as conn:
+            conn.execute("UPDATE scheduled_jobs SET status=?, error=? WHERE id=?", (status, err, job_id))
+
+class ChannelQueue:
+    # Правки/удаления уже опубликованных постов: по одной через limiter, чтобы массовое
+    # истечение срока не съело лимиты канала. У каждого канала своя очередь и свой limiter —
+    # затор в одном не держит остальные. Пост и автор читаются только в момент отправки.
+    def __init__(self, rate: float, burst: int = 3):
+        self.rate, self.burst = rate, burst
+        self._qs: dict[str, asyncio.Queue] = {}
+        self._started = False
+
+    def __len__(self):
+        return sum(q.qsize() for q in self._qs.values())
+
+    def _put(self, item: tuple):
+        q = self._qs.get(str(item[1]))
+        if q is None:
+            q = self._qs[str(item[1])] = asyncio.Queue()
+            if self._started: spawn_bg(self._worker(q))
+        q.put_nowait(item)
+
+    def mark(self, chat, msg_id: int, pid: int, banner: str):
+        self._put(("mark", chat, msg_id, pid, banner))
+
+    def delete(self, chat, msg_id: int):
+        self._put(("delete", chat, msg_id, None, ""))
+
+    async def run(self):
+        self._started = True
+        for q in list(self._qs.values()):
+            spawn_bg(self._worker(q))
+
+    async def _worker(self, q: asyncio.Queue):
+        limiter = RateLimiter(rate=self.rate, burst=self.burst)
+        while True:
+            item = await q.get()
+            await limiter.acquire()
+            try:
+                await self._apply(*item)
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                q.put_nowait(item)
+            except Exception as e:
+                log.warning("channel %s #%s failed: %s", item[0], item[2], e)
+            finally:
+                q.task_done()
+
+    async def _apply(self, op: str, chat, msg_id: int, pid: Optional[int], banner: str):
+        if op == "delete":
+            await bot.delete_message(chat, msg_id)
+            return
+        with db() as conn:
+            p = conn.execute("SELECT * FROM posts WHERE id=?", (pid,)).fetchone()
+            u = conn.execute("SELECT * FROM users WHERE tg_id=?", (p["author_tg"],)).fetchone() if p else None
+        if not p or not u:
+            return
+        body = banner + "\n\n" + await publish_text_for(u, p["category"], p["text"])
+        if p["media_type"] in ("photo", "video", "voice", "album") and p["media_file_id"]:
+            await bot.edit_message_caption(chat_id=chat, message_id=msg_id, caption=body)
+        else:
+            await bot.edit_message_text(body, chat_id=chat, message_id=msg_id, disable_web_page_preview=True)
+
+# публикации в канал: свой limiter на каждый канал, создаётся при первой отправке
+_channel_limiters: dict[str, RateLimiter] = {}
+
+def channel_limiter_for(chat) -> RateLimiter:
+    lim = _channel_limiters.get(str(chat))
+    if lim is None:
+        lim = _channel_limiters[str(chat)] = RateLimiter(rate=CHANNEL_RATE_PER_MIN / 60, burst=3)
+    return lim
+
+scheduler = Scheduler(RateLimiter(rate=BOT_RATE_PER_SEC, burst=BOT_RATE_PER_SEC), SCHEDULER_CONCURRENCY)
+channel_queue = ChannelQueue(rate=CHANNEL_EDIT_RATE_PER_MIN / 60)
+metrics.gauge("scheduler_jobs", lambda: len(scheduler))
+metrics.gauge("channel_queue_depth", lambda: len(channel_queue))
+metrics.gauge("handlers_inflight", lambda: HandlerMetricsMiddleware.inflight)
+
+def parse_when(text: str, now: datetime) -> Optional[datetime]:
+    t = text.strip()
+    m = re.fullmatch(r"(\d{1,2}):(\d{2})", t)
+    try:
+        if m:
+            dt = now.replace(hour=int(m.group(1)), minute=int(m.group(2)), second=0, microsecond=0)
+            return dt if dt > now else dt + timedelta(days=1)
+        m = re.fullmatch(r"(\d{1,2})\.(\d{1,2})(?:\.(\d{4}))?\s+(\d{1,2}):(\d{2})", t)
+        if m:
+            year = int(m.group(3)) if m.group(3) else now.year
+            dt = datetime(year, int(m.group(2)), int(m.group(1)), int(m.group(4)), int(m.group(5)))
+            if dt <= now and not m.group(3):
+                dt = dt.replace(year=year + 1)  # «01.01 10:00» в декабре — это следующий год
+            return dt
+    except ValueError:
+        return None
+    return None
+
+# =======================
+# ---- Доска почёта -------
+# =======================
+# Доски за 1/7/30 дней в разрезе тарифа и категории ("" — все) пересчитывает фоновая задача
+# одним GROUP BY по постам за 30 дней и кладёт топ в leaderboards; кнопки читают готовые строки.
+HOF_WINDOWS = (1, 7, 30)
+HOF_SIZE = 10
+HOF_EVERY_SEC = 600
+HOF_WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+HOF_TIERS = ("", SUB_FREE, SUB_VIP, SUB_PLAT, SUB_EXTRA)
+
+@db_scope
+def refresh_leaderboards() -> int:
+    now = datetime.now()
+    since = {w: (now - timedelta(days=w)).isoformat() for w in HOF_WINDOWS}
+    boards: dict[tuple, dict[int, int]] = defaultdict(lambda: defaultdict(int))
+    names: dict[int, Optional[str]] = {}
+    with db() as conn:
+        rows = conn.execute(f"""
+            SELECT p.author_tg, p.category, u.username, u.subscription, u.sub_forever,
+                   {", ".join(f"SUM(p.published_at>=:d{w}) AS d{w}" for w in HOF_WINDOWS)}
+            FROM posts p JOIN users u ON u.tg_id=p.author_tg
+            WHERE p.status IN ('approved','sold','expired') AND p.published_at>=:d{max(HOF_WINDOWS)}
+            GROUP BY p.author_tg, p.category
+        """, {f"d{w}": v for w, v in since.items()}).fetchall()
+        for r in rows:
+            names[r["author_tg"]] = r["username"]
+            tier, cat = user_tier(r), r["category"] or ""
+            for w in HOF_WINDOWS:
+                if not r[f"d{w}"]: continue
+                for key in ((w, "", ""), (w, tier, ""), (w, "", cat), (w, tier, cat)):
+                    boards[key][r["author_tg"]] += r[f"d{w}"]
+        out = []
+        for (w, tier, cat), counts in boards.items():
+            top = heapq.nsmallest(HOF_SIZE, counts.items(), key=lambda kv: (-kv[1], kv[0]))
+            out += [(w, tier, cat, i, tg, names[tg], n, now.isoformat()) for i, (tg, n) in enumerate(top, start=1)]
+        conn.execute("DELETE FROM leaderboards")
+        conn.executemany("INSERT INTO leaderboards(days, tier, category, rank, author_tg, username, posts, computed_at) "
+                         "VALUES(?,?,?,?,?,?,?,?)", out)
+    return len(out)
+
+def leaderboard(window: int, tier: str = "", category: str = "") -> List[sqlite3.Row]:
+    with db() as conn:
+        return conn.execute("SELECT * FROM leaderboards WHERE days=? AND tier=? AND category=? ORDER BY rank",
+                            (window, tier, category)).fetchall()
+
+def leaderboard_title(window: int, tier: str, category: str) -> str:
+    who = f"{tier.capitalize()} авторов" if tier else "авторов"
+    where = f" в «{cfg().category_titles.get(category, category)}»" if category else ""
+    return f"🥇 Топ {who}{where} за {window} дн."
+
+def leaderboard_text(window: int, tier: str = "", category: str = "") -> Optional[str]:
+    rows = leaderboard(window, tier, category)
+    if not rows: return None
+    lines = [leaderboard_title(window, tier, category) + ":"]
+    for r in rows:
+        lines.append(f"{r['rank']}. @{r['username'] or 'ID'+str(r['author_tg'])} — {r['posts']} пост(ов)")
+    return "\n".join(lines)
+
+async def leaderboard_loop():
+    while True:
+        try: refresh_leaderboards()
+        except Exception as e: log.warning("leaderboards error: %s", e)
+        await asyncio.sleep(HOF_EVERY_SEC)
+
+def parse_weekly(spec: str) -> Optional[tuple[int, int, int]]:
+    # "mon 10:00" -> (0, 10, 0)
+    m = re.fullmatch(r"(\w{3})\s+(\d{1,2}):(\d{2})", spec.strip().lower())
+    if not m or m.group(1) not in HOF_WEEKDAYS: return None
+    h, mi = int(m.group(2)), int(m.group(3))
+    if h > 23 or mi > 59: return None
+    return HOF_WEEKDAYS.index(m.group(1)), h, mi
+
+def next_weekly(spec: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    parsed = parse_weekly(spec) if spec else None
+    if not parsed: return None
+    wd, h, mi = parsed
+    now = now or datetime.now()
+    at = (now + timedelta(days=(wd - now.weekday()) % 7)).replace(hour=h, minute=mi, second=0, microsecond=0)
+    return at if at > now else at + timedelta(days=7)
+
+_hof_spec: Optional[str] = None
+
+def schedule_hof_post(force: bool = False):
+    # держим ровно одну pending-задачу hof_post на ближайшее время из настройки hof_autopost
+    global _hof_spec
+    spec = cfg().hof_autopost
+    if spec == _hof_spec and not force: return
+    _hof_spec = spec
+    with db() as conn:
+        conn.execute("UPDATE scheduled_jobs SET status='cancelled' WHERE kind='hof_post' AND status='pending'")
+    when = next_weekly(spec)
+    if when: scheduler.schedule("hof_post", 7, when)
+
+on_settings_change(schedule_hof_post)
+
+def hof_kb(window: int, tier: str, category: str):
+    kb = InlineKeyboardBuilder()
+    def btn(text: str, w: int, t: str, c: str, active: bool):
+        kb.button(text=("• " if active else "") + text, callback_data=f"hof:v:{w}:{t}:{c}")
+    for w in HOF_WINDOWS: btn(f"{w} дн.", w, tier, category, w == window)
+    for t in HOF_TIERS: btn(t.capitalize() if t else "Все", window, t, category, t == tier)
+    btn("Все категории", window, tier, "", not category)
+    for title, code in cfg().categories: btn(title, window, tier, code, code == category)
+    kb.button(text="📤 Опубликовать в канал", callback_data=f"hof:post:{window}:{tier}:{category}")
+    n_cats = len(cfg().categories) + 1
+    kb.adjust(len(HOF_WINDOWS), len(HOF_TIERS), *([3] * (n_cats // 3)), *([n_cats % 3] if n_cats % 3 else []), 1)
+    return kb.as_markup()
+
+def hof_view(window: int, tier: str, category: str) -> str:
+    rows = leaderboard(window, tier, category)
+    when = f"\n\n<i>обновлено {rows[0]['computed_at'][11:16]}</i>" if rows else ""
+    return (leaderboard_text(window, tier, category) or leaderboard_title(window, tier, category) + ": нет данных.") + when
+
+@r_admin.message(F.text == "🏆 Доска почёта")
+async def hall_of_fame(m: Message):
+    if not is_admin(m.from_user.id): return
+    await m.answer(hof_view(30, SUB_EXTRA, ""), reply_markup=hof_kb(30, SUB_EXTRA, ""))
+
+@r_admin.callback_query(F.data.startswith("hof:"))
+async def hof_action(c: CallbackQuery):
+    if not is_admin(c.from_user.id): return
+    try:
+        _, action, w, tier, category = c.data.split(":", 4)
+        window = int(w)
+    except ValueError:
+        return await c.answer()
+    if action == "v":
+        try: await c.message.edit_text(hof_view(window, tier, category), reply_markup=hof_kb(window, tier, category))
+        except TelegramBadRequest: pass   # та же доска
+        return await c.answer()
+    text = leaderboard_text(window, tier, category)
+    if not text:
+        return await c.answer("Нет данных", show_alert=True)
+    try:
+        await bot.send_message(channel_chat(), text)
+        await c.answer("Опубликовано в канал.")
+    except Exception:
+        await c.answer("Не удалось опубликовать (бот должен быть админом в канале).", show_alert=True)
+
+@scheduler.handler("hof_post")
+async def hof_autopost(window: int):
+    try:
+        if not cfg().hof_autopost: return
+        refresh_leaderboards()
+        text = leaderboard_text(window)
+        if text: await bot.send_message(channel_chat(), text)
+    finally:
+        schedule_hof_post(force=True)
+
+# =======================
+# ---- FAN-OUT ПОДПИСЧИКАМ
+# =======================
+class FanoutService:
+    # Публикация автора -> задача в fanout_jobs (посты за FANOUT_COALESCE_SEC склеиваются в одну).
+    # Подписчики читаются курсором по индексу follows(author_tg) чанками, после каждого чанка —
+    # чекпоинт курсора, так что после рестарта рассылка продолжается с того же места.
+    def __init__(self, limiter: RateLimiter, send=None):
+        self.limiter = limiter
+        self.send = send or (lambda chat_id, text: bot.send_message(chat_id, text, disable_web_page_preview=True))
+        self._wake = asyncio.Event()
+        self._stopping = False
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+
+    def notify(self, author_tg: int, pid: int, delay: float = FANOUT_COALESCE_SEC):
+        now = datetime.now()
+        with db() as conn:
+            row = conn.execute("SELECT id FROM fanout_jobs WHERE author_tg=? AND status='pending'", (author_tg,)).fetchone()
+            if row:
+                conn.execute("UPDATE fanout_jobs SET post_ids=post_ids || ',' || ? WHERE id=?", (str(pid), row["id"]))
+            else:
+                conn.execute("INSERT INTO fanout_jobs(author_tg,post_ids,status,run_at,created_at) VALUES(?,?,'pending',?,?)",
+                             (author_tg, str(pid), (now + timedelta(seconds=delay)).isoformat(), now.isoformat()))
+        self._wake.set()
+
+    def active(self) -> int:
+        with db() as conn:
+            return conn.execute("SELECT COUNT(*) FROM fanout_jobs WHERE status IN ('pending','running')").fetchone()[0]
+
+    def _next_job(self) -> tuple[Optional[sqlite3.Row], float]:
+        with db() as conn:
+            job = conn.execute(
+                "SELECT * FROM fanout_jobs WHERE status IN ('pending','running') ORDER BY status='pending', run_at LIMIT 1"
+            ).fetchone()
+            if not job:
+                return None, 3600.0
+            wait = (datetime.fromisoformat(job["run_at"]) - datetime.now()).total_seconds()
+            if job["status"] == "pending" and wait > 0:
+                return None, wait
+            conn.execute("UPDATE fanout_jobs SET status='running' WHERE id=?", (job["id"],))
+        return job, 0.0
+
+    async def run(self):
+        while not self._stopping:
+            self._wake.clear()
+            try:
+                job, wait = self._next_job()
+                if job:
+                    await self.deliver(job)
+                    continue
+            except Exception as e:
+                log.warning("fanout error: %s", e)
+                wait = 30.0
+            try: await asyncio.wait_for(self._wake.wait(), wait)
+            except asyncio.TimeoutError: pass
+
+    def _message(self, job: sqlite3.Row) -> Optional[str]:
+        ids = [int(x) for x in job["post_ids"].split(",") if x]
+        with db() as conn:
+            u = conn.execute("SELECT username, incognito, subscription, sub_forever FROM users WHERE tg_id=?",
+                             (job["author_tg"],)).fetchone()
+            posts = conn.execute(
+                f"SELECT published_msg_id, channel FROM posts WHERE id IN ({','.join('?'*len(ids))}) "
+                f"AND status='approved' AND published_msg_id IS NOT NULL ORDER BY id", ids).fetchall()
+        if not u or not posts:
+            return None
+        # инкогнито-пост не должен раскрывать автора через уведомление подписчикам
+        if u["incognito"] and (u["subscription"] in (SUB_VIP, SUB_PLAT, SUB_EXTRA) or u["sub_forever"]):
+            return None
+        name = f"@{u['username']}" if u["username"] else f"ID{job['author_tg']}"
+        links = "\n".join(f"• {post_link(p['channel'] or CHANNEL, p['published_msg_id'])}" for p in posts)
+        return f"🔔 Новое от автора {name}:\n{links}"
+
+    async def _send_one(self, sem: asyncio.Semaphore, chat_id: int, text: str) -> bool:
+        async with sem:
+            for _ in range(3):
+                await self.limiter.acquire()
+                try:
+                    await self.send(chat_id, text)
+                    return True
+                except TelegramRetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                except TelegramForbiddenError:
+                    return False  # бот заблокирован подписчиком
+                except Exception as e:
+                    log.debug("fanout send %s failed: %s", chat_id, e)
+                    return False
+            return False
+
+    async def deliver(self, job: sqlite3.Row):
+        text = self._message(job)
+        cursor, sem = job["cursor"], asyncio.Semaphore(FANOUT_CONCURRENCY)
+        while text:
+            with db() as conn:
+                rows = conn.execute(
+                    "SELECT id, follower_tg FROM follows WHERE author_tg=? AND id>? ORDER BY id LIMIT ?",
+                    (job["author_tg"], cursor, FANOUT_CHUNK)).fetchall()
+            if not rows:
+                break
+            ok = done = 0
+            # срезами по 4×concurrency: при остановке курсор сохраняется по последнему отправленному срезу
+            for i in range(0, len(rows), FANOUT_CONCURRENCY * 4):
+                part = rows[i:i + FANOUT_CONCURRENCY * 4]
+                ok += sum(await asyncio.gather(*(self._send_one(sem, r["follower_tg"], text) for r in part)))
+                done, cursor = done + len(part), part[-1]["id"]
+                if self._stopping: break
+            with db() as conn:
+                conn.execute("UPDATE fanout_jobs SET cursor=?, sent=sent+?, failed=failed+? WHERE id=?",
+                             (cursor, ok, done - ok, job["id"]))
+            if self._stopping:
+                return   # задача остаётся running — после рестарта продолжится с курсора
+        with db() as conn:
+            conn.execute("UPDATE fanout_jobs SET status='done' WHERE id=?", (job["id"],))
+
+bot_limiter = RateLimiter(rate=BOT_RATE_PER_SEC, burst=BOT_RATE_PER_SEC)
+fanout = FanoutService(bot_limiter)
+metrics.gauge("fanout_jobs_active", ttl_cached(GAUGE_TTL_SEC)(lambda: fanout.active()))
+
+# =======================
+# ---- ПОДПИСКИ НА АВТОРОВ
+# =======================
+FOLLOWS_PAGE_SIZE = 10
+
+@db_scope
+def follow_author(follower_tg: int, author_tg: int) -> bool:
+    with db() as conn:
+        cur = conn.execute("INSERT OR IGNORE INTO follows(follower_tg,author_tg,created_at) VALUES(?,?,?)",
+                           (follower_tg, author_tg, datetime.now().isoformat()))
+        if cur.rowcount:
+            conn.execute("UPDATE users SET followers_count=followers_count+1 WHERE tg_id=?", (author_tg,))
+            journal(conn, "followed", author_tg, follower_tg)
+    return bool(cur.rowcount)
+
+@db_scope
+def unfollow_author(follower_tg: int, author_tg: int) -> bool:
+    with db() as conn:
+        cur = conn.execute("DELETE FROM follows WHERE follower_tg=? AND author_tg=?", (follower_tg, author_tg))
+        if cur.rowcount:
+            conn.execute("UPDATE users SET followers_count=MAX(followers_count-1, 0) WHERE tg_id=?", (author_tg,))
+            journal(conn, "unfollowed", author_tg, follower_tg)
+    return bool(cur.rowcount)
+
+@db_scope
+def follows_page(uid: int, cursor: int):
+    with db() as conn:
+        # первая страница — отдельным запросом: условие «cursor=0 OR id<cursor» не даёт взять индекс
+        page = "AND f.id<?" if cursor else ""
+        rows = conn.execute(f"""
+            SELECT f.id, f.author_tg, u.username FROM follows f LEFT JOIN users u ON u.tg_id=f.author_tg
+            WHERE f.follower_tg=? {page} ORDER BY f.id DESC LIMIT ?
+        """, (uid, *([cursor] if cursor else []), FOLLOWS_PAGE_SIZE + 1)).fetchall()
+    more, rows = len(rows) > FOLLOWS_PAGE_SIZE, rows[:FOLLOWS_PAGE_SIZE]
+    if not rows:
+        return ("Вы ни на кого не подписаны.\nПодписаться можно по ссылке «📩 Подписаться на автора» в посте."
+                if not cursor else "Больше подписок нет."), None
+    kb = InlineKeyboardBuilder()
+    lines = ["Ваши подписки на авторов:"]
+    for r in rows:
+        name = f"@{r['username']}" if r["username"] else f"ID{r['author_tg']}"
+        lines.append(f"• {name}")
+        kb.button(text=f"❌ {name}", callback_data=f"unf:{r['author_tg']}:{cursor}")
+    nav = []
+    if cursor:
+        kb.button(text="⏮ В начало", callback_data="fl:0"); nav.append(1)
+    if more:
+        kb.button(text="➡️ Дальше", callback_data=f"fl:{rows[-1]['id']}"); nav.append(1)
+    kb.adjust(*([2] * ((len(rows) + 1) // 2)), *([len(nav)] if nav else []))
+    return "\n".join(lines) + "\n\n❌ — отписаться", kb.as_markup()
+
+@r_public.message(F.text == "👥 Мои подписки")
+async def follows_list(m: Message):
+    txt, markup = follows_page(m.from_user.id, 0)
+    await m.answer(txt, reply_markup=markup)
+
+@r_public.callback_query(F.data.startswith("fl:"))
+async def follows_nav(c: CallbackQuery):
+    txt, markup = follows_page(c.from_user.id, int(c.data.split(":", 1)[1]))
+    try: await c.message.edit_text(txt, reply_markup=markup)
+    except TelegramBadRequest: pass
+    await c.answer()
+
+@r_public.callback_query(F.data.startswith("unf:"))
+async def follows_remove(c: CallbackQuery):
+    _, author, cursor = c.data.split(":")
+    ok = unfollow_author(c.from_user.id, int(author))
+    txt, markup = follows_page(c.from_user.id, int(cursor))
+    try: await c.message.edit_text(txt, reply_markup=markup)
+    except TelegramBadRequest: pass
+    await c.answer("Отписка оформлена." if ok else "Уже отписаны.")
+
 # =======================
 # ---- ПУБЛИКАЦИЯ --------
 # =======================
+def can_schedule(u: sqlite3.Row) -> bool:
+    return u["subscription"] in (SUB_PLAT, SUB_EXTRA) or bool(u["sub_forever"])
+
+def listing_ttl_days(u: sqlite3.Row) -> int:
+    ttl = cfg().listing_ttl_days
+    return ttl.get(user_tier(u), ttl[SUB_FREE])
+
+def post_actions_kb(pid: int):
+    kb = InlineKeyboardBuilder()
+    kb.button(text="✅ Продано", callback_data=f"sold:{pid}")
+    kb.button(text="⬆️ Поднять", callback_data=f"bump:{pid}")
+    kb.adjust(2)
+    return kb.as_markup()
+
 @r_public.message(F.text == "➕ Разместить объявление")
 async def post_start(m: Message, state: FSMContext):
     u = get_user(m.from_user.id)
     if not u: return
-    if u["subscription"] == SUB_FREE and user_daily_posts_count(m.from_user.id) >= FREE_DAILY_POST_LIMIT:
-        await m.answer("Лимит 30 постов/день на Free. Оформите VIP для безлимита.")
+    limit = daily_post_limit(u)
+    if limit is not None and posts_today(m.from_user.id) >= limit:
+        await m.answer(f"Лимит {limit} постов/день на вашем тарифе. Оформите VIP для безлимита.")
         return
     await m.answer("Выберите категорию:", reply_markup=categories_kb())
     await state.set_state(PostSG.cat)
@@ -829,19 +2409,36 @@ async def post_cat(m: Message, state: FSMContext):
     if m.text == "⬅️ Назад":
         await state.clear()
         u = get_user(m.from_user.id); await m.answer("Отменено.", reply_markup=main_kb(bool(u["is_admin"]) if u else False)); return
-    code = None
-    for title,c in CATEGORIES:
-        if m.text == title: code = c; break
+    code = cfg().category_codes.get(m.text)
     if not code:
         await m.answer("Выберите категорию кнопкой.")
         return
     await state.update_data(cat=code)
-    await m.answer("Отправьте текст объявления (можно одно фото/видео/voice с подписью).", reply_markup=ReplyKeyboardRemove())
+    await m.answer("Отправьте текст объявления (можно фото/видео/voice или альбом до 10 фото/видео, с подписью).", reply_markup=ReplyKeyboardRemove())
     await state.set_state(PostSG.content)
 
+# альбом приходит пачкой сообщений с общим media_group_id — копим их ALBUM_WINDOW сек
+_albums: dict[tuple[int, str], list[tuple[int, str, str, str]]] = {}
+
+@r_public.message(PostSG.content, F.media_group_id, F.content_type.in_({"photo","video"}))
+async def post_collect_album(m: Message, state: FSMContext):
+    key = (m.from_user.id, m.media_group_id)
+    item = (m.message_id, "photo", m.photo[-1].file_id, m.caption or "") if m.photo \
+        else (m.message_id, "video", m.video.file_id, m.caption or "")
+    parts = _albums.get(key)
+    if parts is not None:
+        parts.append(item)
+        return
+    _albums[key] = parts = [item]
+    await asyncio.sleep(ALBUM_WINDOW)
+    _albums.pop(key, None)
+    parts.sort()
+    media = [[t, fid] for _, t, fid, _ in parts][:ALBUM_MAX]
+    text = next((cap for *_, cap in parts if cap), "")
+    await preview_post(m, state, text, "album", media[0][1], media)
+
 @r_public.message(PostSG.content, F.content_type.in_({"text","photo","video","voice"}))
 async def post_collect(m: Message, state: FSMContext):
-    data = await state.get_data(); cat = data.get("cat")
     media_type, media_id, text = "none", None, ""
     if m.content_type == "text":
         text = m.text or ""
@@ -851,40 +2448,87 @@ async def post_collect(m: Message, state: FSMContext):
         media_type, media_id, text = "video", m.video.file_id, m.caption or ""
     elif m.content_type == "voice":
         media_type, media_id, text = "voice", m.voice.file_id, m.caption or ""
+    await preview_post(m, state, text, media_type, media_id)
+
+async def preview_post(m: Message, state: FSMContext, text: str, media_type: str, media_id: Optional[str],
+                       media: Optional[list] = None):
+    data = await state.get_data(); cat = data.get("cat")
     hints = []
     if not re.search(r"@\w{5,}", text): hints.append("⚠️ Нет контакта (@username).")
-    if parse_price(text) is None: hints.append("⚠️ Нет цены.")
+    price = parse_price(text)
+    if price is None: hints.append("⚠️ Нет цены.")
+    if (market := price_hint(cat, price)): hints.append(market)
     hint = ("\n".join(hints)+"\n\n") if hints else ""
-    await state.update_data(text=text, media_type=media_type, media_id=media_id)
+    album = f"Альбом: {len(media)} шт.\n" if media else ""
+    await state.update_data(text=text, media_type=media_type, media_id=media_id, media=media or [])
     kb = InlineKeyboardBuilder()
     kb.button(text="✅ Отправить", callback_data="post:ok")
     kb.button(text="✏️ Изменить", callback_data="post:edit")
     kb.button(text="❌ Отмена", callback_data="post:cancel")
-    kb.adjust(3)
-    await m.answer(f"{hint}<b>Превью</b>\nКатегория: {cat}\n\n{text[:2000]}", reply_markup=kb.as_markup())
+    u = get_user(m.from_user.id)
+    if u and can_schedule(u):
+        kb.button(text="🕒 Отложить", callback_data="post:later")
+    kb.adjust(3, 1)
+    await m.answer(f"{hint}<b>Превью</b>\nКатегория: {cat}\n{album}\n{text[:2000]}", reply_markup=kb.as_markup())
     await state.set_state(PostSG.confirm)
 
-async def publish_text_for(author: sqlite3.Row, cat: str, text: str) -> str:
-    badge = BADGE.get(author["subscription"] or SUB_FREE, "")
+# Хвост поста (бейдж, автор, статус, ссылки) зависит только от автора — кэшируем его по tg_id.
+# Ключ — поля, из которых он собран: смена username/подписки/инкогнито/статуса сама делает запись невалидной.
+AUTHOR_RENDER_CACHE_MAX = 10_000
+_author_render: dict[int, tuple[tuple, str]] = {}
+
+def author_render_tail(author: sqlite3.Row, uname: str) -> str:
+    key = (author["username"], author["subscription"], author["sub_forever"], author["incognito"],
+           author["trust_status"], uname)
+    hit = _author_render.get(author["tg_id"])
+    if hit is not None and hit[0] == key:
+        return hit[1]
+    badge = cfg().badges.get(author["subscription"] or SUB_FREE, "")
     inc = bool(author["incognito"]) and (author["subscription"] in (SUB_VIP, SUB_PLAT, SUB_EXTRA) or author["sub_forever"])
-    uname = await bot_username()
-    follow = follow_link_for(author["tg_id"], uname)
-    shop = shop_link_for(author["tg_id"], uname)
     author_line = f"👤 Автор: {'Аноним ID'+str(author['tg_id']) if inc else ('@'+author['username'] if author['username'] else 'ID'+str(author['tg_id']))}"
-    cat_title = next((t for t,c in CATEGORIES if c==cat), cat)
-    lines = [
-        f"🏷 Категория: {cat_title}",
-        text.strip(),
-        "",
-    ]
+    lines = []
     if badge: lines.append(badge)
     lines.append(author_line)
     lines.append(f"🛡 Статус: {author['trust_status']}")
     if not inc:
-        lines.append(f"📩 Подписаться на автора: {follow}")
-        lines.append(f"🛒 Магазин автора: {shop}")
+        lines.append(f"📩 Подписаться на автора: {follow_link_for(author['tg_id'], uname)}")
+        lines.append(f"🛒 Магазин автора: {shop_link_for(author['tg_id'], uname)}")
     lines.append(f"— опубликовано через {PROJECT_NAME}")
-    return "\n".join(lines)
+    tail = "\n".join(lines)
+    if len(_author_render) >= AUTHOR_RENDER_CACHE_MAX:
+        _author_render.clear()
+    _author_render[author["tg_id"]] = (key, tail)
+    return tail
+
+def invalidate_author_render(tg_id: int):
+    _author_render.pop(tg_id, None)
+
+on_settings_change(_author_render.clear)   # бейджи тарифов
+
+async def publish_text_for(author: sqlite3.Row, cat: str, text: str) -> str:
+    uname = await bot_username()
+    return f"🏷 Категория: {cfg().category_titles.get(cat, cat)}\n{text.strip()}\n\n{author_render_tail(author, uname)}"
+
+async def send_post(chat_id, mtype: str, mid: Optional[str], body: str,
+                    media: Optional[list] = None, reply_markup=None) -> Message:
+    # альбом уходит одним sendMediaGroup; подпись — на первом элементе
+    if mtype == "album" and media:
+        group = [
+            (InputMediaPhoto if t == "photo" else InputMediaVideo)(media=fid, caption=body if i == 0 else None)
+            for i, (t, fid) in enumerate(media)
+        ]
+        msgs = await bot.send_media_group(chat_id, group)
+        # у media group не бывает кнопок — шлём их отдельным сообщением
+        if reply_markup is not None:
+            await bot.send_message(chat_id, "⬆️ Действия для альбома выше", reply_markup=reply_markup)
+        return msgs[0]
+    if mtype == "photo" and mid:
+        return await bot.send_photo(chat_id, mid, caption=body, reply_markup=reply_markup)
+    if mtype == "video" and mid:
+        return await bot.send_video(chat_id, mid, caption=body, reply_markup=reply_markup)
+    if mtype == "voice" and mid:
+        return await bot.send_voice(chat_id, mid, caption=body, reply_markup=reply_markup)
+    return await bot.send_message(chat_id, body, reply_markup=reply_markup)
 
 @r_public.callback_query(PostSG.confirm, F.data == "post:edit")
 async def post_edit(c: CallbackQuery, state: FSMContext):
@@ -900,122 +2544,889 @@ async def post_cancel(c: CallbackQuery, state: FSMContext):
     await c.message.edit_text("Отменено.")
     await c.message.answer("Главное меню", reply_markup=main_kb(bool(u["is_admin"]) if u else False))
 
+@db_scope
+def create_post(author_tg: int, data: dict, status: str) -> int:
+    text = data["text"]; media = data.get("media") or []
+    with db() as conn:
+        cur = conn.execute("""
+        INSERT INTO posts(author_tg,category,text,media_type,media_file_id,status,price,channel,created_at)
+        VALUES(?,?,?,?,?,?,?,?,?)
+        """, (author_tg, data["cat"], text, data["media_type"], data["media_id"], status,
+              parse_price(text) or None, cfg().channel, datetime.now().isoformat()))
+        pid = cur.lastrowid
+        journal(conn, "post_created", pid, author_tg, category=data["cat"], status=status)
+        if media:
+            conn.executemany("INSERT INTO post_media(post_id,position,media_type,file_id) VALUES(?,?,?,?)",
+                             [(pid, i, t, fid) for i, (t, fid) in enumerate(media)])
+    return pid
+
+async def send_to_channel(p: sqlite3.Row, u: sqlite3.Row, chat) -> Message:
+    body = await publish_text_for(u, p["category"], p["text"])
+    media = post_media_list(p["id"]) if p["media_type"] == "album" else None
+    await channel_limiter_for(chat).acquire()
+    msg = await send_post(chat, p["media_type"], p["media_file_id"], body, media)
+    metrics.inc("channel_posts_total", chat=str(chat))
+    return msg
+
+async def publish_post(pid: int, moderator_tg: Optional[int] = None,
+                       from_status: str = "pending", fail_status: Optional[str] = None) -> Optional[Message]:
+    # единый путь публикации в канал: мгновенно, после модерации и по расписанию.
+    # Переход в 'publishing' — условный UPDATE: из двух одновременных одобрений в канал уйдёт одно,
+    # второе получит None. Одобрение модератором проходит, только если пост не взят другим админом.
+    # Не ушёл в канал (ошибка, отмена, падение процесса) — статус fail_status, без него — обратно в from_status.
+    claim = "AND (claimed_by IS NULL OR claimed_by=?)" if moderator_tg else ""
+    with db() as conn:
+        if not conn.execute(f"UPDATE posts SET status='publishing', publishing_from=? WHERE id=? AND status=? {claim}",
+                            (fail_status or from_status, pid, from_status)
+                            + ((moderator_tg,) if moderator_tg else ())).rowcount:
+            return None
+        p = conn.execute("SELECT * FROM posts WHERE id=?", (pid,)).fetchone()
+        u = conn.execute("SELECT * FROM users WHERE tg_id=?", (p["author_tg"],)).fetchone()
+    chat = route_chat(p["category"], user_tier(u))
+    try:
+        msg = await send_to_channel(p, u, chat)
+    except BaseException:
+        # в т.ч. CancelledError при остановке, пока ждали limiter канала
+        with db() as conn:
+            conn.execute("UPDATE posts SET status=?, publishing_from=NULL WHERE id=? AND status='publishing'",
+                         (fail_status or from_status, pid))
+        raise
+    now = datetime.now()
+    with db() as conn:
+        conn.execute("""
+        UPDATE posts SET status='approved', moderator_tg=?, published_msg_id=?, channel=?, published_at=?, expires_at=?,
+                         claimed_by=NULL, claimed_at=NULL, publishing_from=NULL
+        WHERE id=?
+        """, (moderator_tg, msg.message_id, str(chat), now.isoformat(),
+              (now + timedelta(days=listing_ttl_days(u))).isoformat(), pid))
+        journal(conn, "post_approved", pid, moderator_tg, author=p["author_tg"], category=p["category"],
+                price=p["price"], channel=str(chat), published_at=now.isoformat())
+        conn.execute("UPDATE users SET posts_total=posts_total+1, posts_30d=posts_30d+1, trust_dirty=1 WHERE tg_id=?",
+                     (p["author_tg"],))
+    invalidate_shop(p["author_tg"])
+    fanout.notify(p["author_tg"], pid)
+    return msg
+
 @r_public.callback_query(PostSG.confirm, F.data == "post:ok")
 async def post_submit(c: CallbackQuery, state: FSMContext):
     await c.answer()
     data = await state.get_data(); await state.clear()
     u = get_user(c.from_user.id)
-    cat = data["cat"]; text = data["text"]; mtype = data["media_type"]; mid = data["media_id"]
-    price = parse_price(text) or None
-    with db() as conn:
-        conn.execute("""
-        INSERT INTO posts(author_tg,category,text,media_type,media_file_id,status,price,channel)
-        VALUES(?,?,?,?,?,'pending',?,?)
-        """, (c.from_user.id, cat, text, mtype, mid, price, CHANNEL))
-        pid = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
-    if u["subscription"] in (SUB_VIP, SUB_PLAT, SUB_EXTRA) or u["sub_forever"]:
-        body = await publish_text_for(u, cat, text)
+    if not take_post_quota(c.from_user.id, daily_post_limit(u)):
+        await c.message.edit_text("Дневной лимит постов исчерпан. Попробуйте завтра или оформите VIP."); return
+    pid = create_post(c.from_user.id, data, "pending")
+    trusted = cfg().trust_auto_approve and u["trust_status"] == "verified"
+    if u["subscription"] in (SUB_VIP, SUB_PLAT, SUB_EXTRA) or u["sub_forever"] or trusted:
         try:
-            if mtype == "photo" and mid:
-                msg = await bot.send_photo(CHANNEL, mid, caption=body)
-            elif mtype == "video" and mid:
-                msg = await bot.send_video(CHANNEL, mid, caption=body)
-            elif mtype == "voice" and mid:
-                msg = await bot.send_voice(CHANNEL, mid, caption=body)
-            else:
-                msg = await bot.send_message(CHANNEL, body)
-            with db() as conn:
-                conn.execute("UPDATE posts SET status='approved', published_msg_id=?, published_at=? WHERE id=?",
-                             (msg.message_id, datetime.now().isoformat(), pid))
-                conn.execute("UPDATE users SET posts_total=posts_total+1, posts_30d=posts_30d+1 WHERE tg_id=?",
-                             (c.from_user.id,))
-            await c.message.edit_text("✅ Пост опубликован.")
+            # мгновенная публикация не удалась — пост закрыт ('failed'), в очередь модерации он не попадает
+            await publish_post(pid, fail_status="failed")
+            if trusted and u["subscription"] == SUB_FREE: metrics.inc("trust_auto_approved_total")
+            await c.message.edit_text("✅ Пост опубликован.", reply_markup=post_actions_kb(pid))
         except Exception as e:
             log.error("publish error: %s", e)
+            refund_post_quota(c.from_user.id)
             await c.message.edit_text("Ошибка публикации. Бот должен быть админом в канале.")
     else:
         # модерация
         await c.message.edit_text("✅ Пост отправлен на модерацию. Админы проверят.")
-        await send_to_admins_for_moderation(pid)
+        await notify_moderators()
 
-async def send_to_admins_for_moderation(pid: int):
+@r_public.callback_query(PostSG.confirm, F.data == "post:later")
+async def post_later(c: CallbackQuery, state: FSMContext):
+    u = get_user(c.from_user.id)
+    if not u or not can_schedule(u):
+        await c.answer("Отложенная публикация доступна на Platinum и Extra.", show_alert=True); return
+    await c.answer()
+    await c.message.edit_text(
+        "Когда опубликовать?\n"
+        "• <code>ЧЧ:ММ</code> — ближайшее такое время\n"
+        "• <code>ДД.ММ ЧЧ:ММ</code> — конкретная дата"
+    )
+    await state.set_state(PostSG.when)
+
+@r_public.message(PostSG.when)
+async def post_when(m: Message, state: FSMContext):
+    now = datetime.now()
+    when = parse_when(m.text or "", now)
+    if not when or when <= now:
+        await m.answer("Не понял время. Пример: <code>19:30</code> или <code>25.12 10:00</code>"); return
+    if when - now > timedelta(days=SCHEDULE_MAX_DAYS):
+        await m.answer(f"Можно запланировать не дальше чем на {SCHEDULE_MAX_DAYS} дней."); return
+    data = await state.get_data(); await state.clear()
+    u = get_user(m.from_user.id)
+    if not take_post_quota(m.from_user.id, daily_post_limit(u)):
+        await m.answer("Дневной лимит постов исчерпан."); return
+    pid = create_post(m.from_user.id, data, "scheduled")
+    scheduler.schedule("publish", pid, when)
+    await m.answer(f"🕒 Пост #{pid} будет опубликован {when.strftime('%d.%m.%Y %H:%M')}.",
+                   reply_markup=main_kb(bool(u["is_admin"]) if u else False))
+
+@scheduler.handler("publish")
+async def publish_scheduled(pid: int):
+    with db() as conn:
+        p = conn.execute("SELECT author_tg, status, created_at FROM posts WHERE id=?", (pid,)).fetchone()
+    if not p or p["status"] != "scheduled":
+        return
+    try:
+        if not await publish_post(pid, from_status="scheduled"): return
+    except Exception:
+        # задача уже не повторится — закрываем пост. Отмену (остановка бота) сюда не ловим:
+        # пост остаётся 'scheduled', задача в 'running' и планировщик повторит её после рестарта
+        with db() as conn:
+            conn.execute("UPDATE posts SET status='failed' WHERE id=? AND status='scheduled'", (pid,))
+        refund_post_quota(p["author_tg"], (p["created_at"] or "")[:10])
+        try: await bot.send_message(p["author_tg"], f"❌ Отложенный пост #{pid} не удалось опубликовать.")
+        except Exception: pass
+        raise
+    try: await bot.send_message(p["author_tg"], f"✅ Отложенный пост #{pid} опубликован.",
+                                reply_markup=post_actions_kb(pid))
+    except Exception: pass
+
+async def send_moderation_preview(chat_id: int, pid: int):
     with db() as conn:
         p = conn.execute("SELECT * FROM posts WHERE id=?", (pid,)).fetchone()
         u = conn.execute("SELECT * FROM users WHERE tg_id=?", (p["author_tg"],)).fetchone()
     text = (
-        f"📝 Новое объявление #{p['id']} (категория: {p['category']})\n"
-        f"Автор: @{u['username'] or 'ID'+str(u['tg_id'])}\n\n{p['text'] or ''}"
+        f"📝 Объявление #{p['id']} (категория: {p['category']})\n"
+        f"Автор: @{u['username'] or 'ID'+str(u['tg_id'])} · 🛡 {u['trust_status']}\n\n{p['text'] or ''}"
     )
     kb = InlineKeyboardBuilder()
     kb.button(text="✅ Одобрить", callback_data=f"approve:{p['id']}")
     kb.button(text="❌ Отклонить", callback_data=f"reject:{p['id']}")
     kb.adjust(2)
-    admins = list_admins()
-    for a in admins:
-        try:
-            if p["media_type"] == "photo" and p["media_file_id"]:
-                await bot.send_photo(a["tg_id"], p["media_file_id"], caption=text, reply_markup=kb.as_markup())
-            elif p["media_type"] == "video" and p["media_file_id"]:
-                await bot.send_video(a["tg_id"], p["media_file_id"], caption=text, reply_markup=kb.as_markup())
-            elif p["media_type"] == "voice" and p["media_file_id"]:
-                await bot.send_voice(a["tg_id"], p["media_file_id"], caption=text, reply_markup=kb.as_markup())
-            else:
-                await bot.send_message(a["tg_id"], text, reply_markup=kb.as_markup())
-        except Exception as e:
-            log.warning("send preview error: %s", e)
+    media = post_media_list(pid) if p["media_type"] == "album" else None
+    await send_post(chat_id, p["media_type"], p["media_file_id"], text, media, reply_markup=kb.as_markup())
+
+async def approve_and_notify(pid: int, admin_tg: int) -> bool:
+    if not await publish_post(pid, admin_tg):
+        return False
+    with db() as conn:
+        p = conn.execute("SELECT author_tg FROM posts WHERE id=?", (pid,)).fetchone()
+    try: await bot.send_message(p["author_tg"], "✅ Ваш пост одобрен и опубликован.",
+                                reply_markup=post_actions_kb(pid))
+    except Exception: pass
+    return True
 
 @r_admin.callback_query(F.data.startswith("approve:"))
 async def cb_approve(c: CallbackQuery):
+    if not is_admin(c.from_user.id): return
     pid = int(c.data.split(":",1)[1])
-    with db() as conn:
-        p = conn.execute("SELECT * FROM posts WHERE id=?", (pid,)).fetchone()
-        if not p or p["status"] != "pending":
-            await c.answer("Уже обработано.", show_alert=True); return
-        u = conn.execute("SELECT * FROM users WHERE tg_id=?", (p["author_tg"],)).fetchone()
-    body = await publish_text_for(u, p["category"], p["text"])
+    if not claim_post(pid, c.from_user.id):
+        await c.answer("Уже обработано или взято другим админом.", show_alert=True); return
+    # отвечаем сразу: публикация может ждать limiter канала дольше, чем Telegram ждёт ответа на callback
+    await c.answer("Публикую…")
     try:
-        if p["media_type"] == "photo" and p["media_file_id"]:
-            msg = await bot.send_photo(CHANNEL, p["media_file_id"], caption=body)
-        elif p["media_type"] == "video" and p["media_file_id"]:
-            msg = await bot.send_video(CHANNEL, p["media_file_id"], caption=body)
-        elif p["media_type"] == "voice" and p["media_file_id"]:
-            msg = await bot.send_voice(CHANNEL, p["media_file_id"], caption=body)
-        else:
-            msg = await bot.send_message(CHANNEL, body)
-        with db() as conn:
-            conn.execute("UPDATE posts SET status='approved', moderator_tg=?, published_msg_id=?, published_at=? WHERE id=?",
-                         (c.from_user.id, msg.message_id, datetime.now().isoformat(), pid))
-        await c.message.edit_text(f"✅ Опубликовано (#{pid})")
-        try: await bot.send_message(p["author_tg"], "✅ Ваш пост одобрен и опубликован.")
-        except: pass
+        ok = await approve_and_notify(pid, c.from_user.id)
     except Exception as e:
-        await c.answer("Публикация не удалась (права бота?).", show_alert=True)
+        log.warning("approve #%s failed: %s", pid, e)
+        await c.message.answer(f"Публикация #{pid} не удалась (права бота?)."); return
+    if not ok:
+        await c.message.answer(f"#{pid} уже обработан."); return
+    try: await c.message.edit_text(f"✅ Опубликовано (#{pid})")
+    except TelegramBadRequest:   # превью с медиа — текст не редактируется
+        await c.message.answer(f"✅ Опубликовано (#{pid})")
 
 @r_admin.callback_query(F.data.startswith("reject:"))
 async def cb_reject(c: CallbackQuery, state: FSMContext):
+    if not is_admin(c.from_user.id): return
     pid = int(c.data.split(":",1)[1])
-    with db() as conn:
-        p = conn.execute("SELECT status FROM posts WHERE id=?", (pid,)).fetchone()
-    if not p or p["status"] != "pending":
-        await c.answer("Уже обработано.", show_alert=True); return
+    if not claim_post(pid, c.from_user.id):
+        await c.answer("Уже обработано или взято другим админом.", show_alert=True); return
     await state.set_state(RejectSG.reason)
-    await state.update_data(pid=pid)
+    await state.update_data(pids=[pid])
     await c.message.answer("Укажите причину отклонения (одним сообщением):")
     await c.answer()
 
 @r_admin.message(RejectSG.reason)
 async def reject_reason(m: Message, state: FSMContext):
-    data = await state.get_data(); pid = int(data.get("pid"))
+    data = await state.get_data(); await state.clear()
     reason = (m.text or "").strip()
+    done = reject_posts(data.get("pids") or [], m.from_user.id, reason)
+    for pid, author in done:
+        try: await bot.send_message(author, f"❌ Ваш пост отклонён.\nПричина: {reason}")
+        except Exception: pass
+    await m.answer(f"Отклонено ✅ ({len(done)})" if done else "Пост уже обработан.")
+
+# =======================
+# ---- ОЧЕРЕДЬ МОДЕРАЦИИ -
+# =======================
+# Посты не рассылаются каждому админу: админ сам берёт их из очереди (старые первыми).
+# Взятие — условный UPDATE по claimed_by/claimed_at, протухший захват перехватывается.
+def _claim_cutoff() -> str:
+    return (datetime.now() - timedelta(seconds=cfg().mod_claim_ttl_sec)).isoformat()
+
+@db_scope
+def claim_post(pid: int, admin_tg: int) -> bool:
     with db() as conn:
-        row = conn.execute("SELECT author_tg,status FROM posts WHERE id=?", (pid,)).fetchone()
-        if not row or row["status"] != "pending":
-            await m.answer("Пост уже обработан."); await state.clear(); return
-        conn.execute("UPDATE posts SET status='rejected', moderator_tg=?, reject_reason=? WHERE id=?",
-                     (m.from_user.id, reason, pid))
-    try: await bot.send_message(row["author_tg"], f"❌ Ваш пост отклонён.\nПричина: {reason}")
-    except: pass
-    await m.answer("Отклонено ✅"); await state.clear()
+        return bool(conn.execute("""
+            UPDATE posts SET claimed_by=?, claimed_at=?
+            WHERE id=? AND status='pending' AND (claimed_by IS NULL OR claimed_by=? OR claimed_at<?)
+        """, (admin_tg, datetime.now().isoformat(), pid, admin_tg, _claim_cutoff())).rowcount)
+
+@db_scope
+def claim_batch(admin_tg: int, n: int) -> list[int]:
+    cutoff = _claim_cutoff()
+    with db() as conn:
+        conn.execute("""
+            UPDATE posts SET claimed_by=?, claimed_at=? WHERE id IN (
+                SELECT id FROM posts WHERE status='pending' AND (claimed_by IS NULL OR claimed_by=? OR claimed_at<?)
+                ORDER BY id LIMIT ?)
+        """, (admin_tg, datetime.now().isoformat(), admin_tg, cutoff, n))
+    return my_claims(admin_tg)
+
+@db_scope
+def my_claims(admin_tg: int) -> list[int]:
+    with db() as conn:
+        rows = conn.execute("SELECT id FROM posts WHERE status='pending' AND claimed_by=? AND claimed_at>=? ORDER BY id",
+                            (admin_tg, _claim_cutoff())).fetchall()
+    return [r["id"] for r in rows]
+
+@db_scope
+def release_claims(admin_tg: int):
+    with db() as conn:
+        conn.execute("UPDATE posts SET claimed_by=NULL, claimed_at=NULL WHERE status='pending' AND claimed_by=?",
+                     (admin_tg,))
+
+@db_scope
+def reject_posts(pids: list[int], admin_tg: int, reason: str) -> list[tuple[int, int]]:
+    done = []
+    with db() as conn:
+        for pid in pids:
+            if not conn.execute("""
+                UPDATE posts SET status='rejected', moderator_tg=?, reject_reason=?, claimed_by=NULL, claimed_at=NULL
+                WHERE id=? AND status='pending' AND (claimed_by IS NULL OR claimed_by=? OR claimed_at<?)
+            """, (admin_tg, reason, pid, admin_tg, _claim_cutoff())).rowcount:
+                continue
+            author = conn.execute("SELECT author_tg FROM posts WHERE id=?", (pid,)).fetchone()["author_tg"]
+            conn.execute("UPDATE users SET trust_dirty=1 WHERE tg_id=?", (author,))
+            journal(conn, "post_rejected", pid, admin_tg, author=author, reason=reason)
+            done.append((pid, author))
+    return done
+
+@db_scope
+def moderation_queue_stats() -> tuple[int, float]:
+    # (длина очереди, сколько секунд ждёт самый старый пост)
+    with db() as conn:
+        n = conn.execute("SELECT COUNT(*) FROM posts WHERE status='pending'").fetchone()[0]
+        r = conn.execute("SELECT created_at FROM posts WHERE status='pending' ORDER BY id LIMIT 1").fetchone()
+    if not r or not r["created_at"]:
+        return n, 0.0
+    return n, max(0.0, (datetime.now() - datetime.fromisoformat(r["created_at"])).total_seconds())
+
+_mq_stats_cached = ttl_cached(GAUGE_TTL_SEC)(moderation_queue_stats)   # один запрос на обе серии
+metrics.gauge("moderation_queue_depth", lambda: _mq_stats_cached()[0])
+metrics.gauge("moderation_queue_oldest_seconds", lambda: _mq_stats_cached()[1])
+
+def fmt_age(sec: float) -> str:
+    if sec < 3600: return f"{int(sec // 60)} мин"
+    if sec < 86400: return f"{sec / 3600:.1f} ч"
+    return f"{sec / 86400:.1f} дн"
+
+@db_scope
+def unclaimed_count() -> int:
+    with db() as conn:
+        return conn.execute("SELECT COUNT(*) FROM posts WHERE status='pending' AND (claimed_by IS NULL OR claimed_at<?)",
+                            (_claim_cutoff(),)).fetchone()[0]
+
+_mod_notified_at = 0.0
+
+async def notify_moderators():
+    # не чаще MOD_NOTIFY_EVERY_SEC; пропущенное напоминание досылает moderation_notify_loop
+    global _mod_notified_at
+    if time.time() - _mod_notified_at < MOD_NOTIFY_EVERY_SEC: return
+    if not unclaimed_count(): return
+    _mod_notified_at = time.time()
+    n, _ = moderation_queue_stats()
+    kb = InlineKeyboardBuilder()
+    kb.button(text="🗂 Открыть", callback_data="mq:p:0")
+    kb.button(text=f"📥 Взять {MOD_TAKE_BATCH}", callback_data="mq:take:0")
+    for a in list_admins():
+        try: await bot.send_message(a["tg_id"], f"🔔 Ждут модерации: {n}", reply_markup=kb.as_markup())
+        except Exception as e: log.warning("moderation notify error: %s", e)
+
+async def moderation_notify_loop():
+    # очередь не разобрана (есть никем не взятые посты) — напоминаем раз в окно
+    while True:
+        await asyncio.sleep(MOD_NOTIFY_EVERY_SEC)
+        try: await notify_moderators()
+        except Exception as e: log.warning("moderation notify error: %s", e)
+
+def moderation_queue_view(admin_tg: int, cursor: int):
+    now = datetime.now()
+    n, oldest = moderation_queue_stats()
+    with db() as conn:
+        rows = conn.execute("""
+            SELECT p.id, p.category, p.created_at, p.claimed_by, p.claimed_at, u.username AS author, a.username AS admin
+            FROM posts p LEFT JOIN users u ON u.tg_id=p.author_tg LEFT JOIN users a ON a.tg_id=p.claimed_by
+            WHERE p.status='pending' AND p.id>? ORDER BY p.id LIMIT ?
+        """, (cursor, MOD_PAGE_SIZE + 1)).fetchall()
+    more, rows = len(rows) > MOD_PAGE_SIZE, rows[:MOD_PAGE_SIZE]
+    mine, cutoff = my_claims(admin_tg), _claim_cutoff()
+    lines = [f"🗂 Очередь модерации: {n}" + (f", самый старый ждёт {fmt_age(oldest)}" if n else "")]
+    kb = InlineKeyboardBuilder()
+    for r in rows:
+        age = fmt_age((now - datetime.fromisoformat(r["created_at"])).total_seconds()) if r["created_at"] else "?"
+        lock = ""
+        if r["claimed_by"] and r["claimed_at"] >= cutoff:
+            lock = " · 🔒 " + ("вы" if r["claimed_by"] == admin_tg else f"@{r['admin'] or r['claimed_by']}")
+        lines.append(f"#{r['id']} · {age} · {cfg().category_titles.get(r['category'], r['category'])} · "
+                     f"@{r['author'] or '—'}{lock}")
+        kb.button(text=f"👁 #{r['id']}", callback_data=f"mq:o:{r['id']}")
+    sizes = [5] * ((len(rows) + 4) // 5)
+    if n:
+        kb.button(text=f"📥 Взять {MOD_TAKE_BATCH}", callback_data="mq:take:0"); sizes.append(1)
+    if mine:
+        kb.button(text=f"✅ Одобрить мои ({len(mine)})", callback_data="mq:ba:0")
+        kb.button(text=f"❌ Отклонить мои ({len(mine)})", callback_data="mq:br:0")
+        kb.button(text="↩️ Вернуть в очередь", callback_data="mq:rel:0")
+        sizes += [2, 1]
+    nav = 0
+    if cursor: kb.button(text="⏮ В начало", callback_data="mq:p:0"); nav += 1
+    if more: kb.button(text="➡️ Дальше", callback_data=f"mq:p:{rows[-1]['id']}"); nav += 1
+    kb.button(text="🔄", callback_data=f"mq:p:{cursor}"); nav += 1
+    kb.adjust(*sizes, nav)
+    return "\n".join(lines), kb.as_markup()
+
+@r_admin.message(F.text == "🗂 Очередь модерации")
+async def moderation_queue(m: Message):
+    if not is_admin(m.from_user.id): return
+    txt, markup = moderation_queue_view(m.from_user.id, 0)
+    await m.answer(txt, reply_markup=markup)
+
+@r_admin.callback_query(F.data.startswith("mq:"))
+async def moderation_queue_action(c: CallbackQuery, state: FSMContext):
+    if not is_admin(c.from_user.id): return
+    _, action, arg = c.data.split(":")
+    admin = c.from_user.id
+    if action == "o":
+        if not claim_post(int(arg), admin):
+            await c.answer("Уже обработано или взято другим админом.", show_alert=True); return
+        await send_moderation_preview(admin, int(arg))
+        await c.answer(); return
+    if action == "take":
+        pids = claim_batch(admin, MOD_TAKE_BATCH)
+        if not pids:
+            await c.answer("Очередь пуста.", show_alert=True); return
+        with db() as conn:
+            rows = conn.execute(f"SELECT id, text FROM posts WHERE id IN ({','.join('?'*len(pids))}) ORDER BY id",
+                                pids).fetchall()
+        _, markup = moderation_queue_view(admin, 0)
+        await c.message.answer(f"📥 Взято: {len(pids)} (на {cfg().mod_claim_ttl_sec // 60} мин)\n\n" + "\n".join(
+            f"#{r['id']}: {html.escape((r['text'] or '')[:80])}" for r in rows), reply_markup=markup)
+        await c.answer(); return
+    if action == "ba":
+        pids, ok = my_claims(admin), 0
+        await c.answer(f"Публикую {len(pids)}…")
+        for pid in pids:
+            try: ok += await approve_and_notify(pid, admin)
+            except Exception as e: log.warning("bulk approve #%s failed: %s", pid, e)
+        await c.message.answer(f"✅ Одобрено: {ok} из {len(pids)}"); return
+    if action == "br":
+        pids = my_claims(admin)
+        if not pids:
+            await c.answer("Нет взятых постов.", show_alert=True); return
+        await state.set_state(RejectSG.reason)
+        await state.update_data(pids=pids)
+        await c.message.answer(f"Причина отклонения для {len(pids)} постов (одним сообщением):")
+        await c.answer(); return
+    if action == "rel":
+        release_claims(admin)
+    txt, markup = moderation_queue_view(admin, int(arg) if action == "p" else 0)
+    try: await c.message.edit_text(txt, reply_markup=markup)
+    except TelegramBadRequest: pass
+    await c.answer()
+
+@db_scope
+def recover_publishing() -> int:
+    # пост, застрявший в 'publishing' после падения, переводим в сохранённый publishing_from: мог уйти в канал,
+    # мог нет. Одобряемый модератором — снова в очередь, мгновенный — 'failed', отложенный снова станет
+    # 'scheduled' — его задачу планировщик повторит после load().
+    with db() as conn:
+        return conn.execute("""
+            UPDATE posts SET status=COALESCE(publishing_from, 'pending'), publishing_from=NULL
+            WHERE status='publishing'
+        """).rowcount
+
+# =======================
+# ---- СРОК ЖИЗНИ --------
+# =======================
+BANNER_SOLD = "✅ ПРОДАНО"
+BANNER_EXPIRED = "⌛ Объявление снято: истёк срок"
+
+@r_public.message(F.text == "📋 Мои объявления")
+async def my_posts(m: Message):
+    with db() as conn:
+        rows = conn.execute(
+            "SELECT id, text, expires_at FROM posts WHERE author_tg=? AND status='approved' ORDER BY id DESC LIMIT 10",
+            (m.from_user.id,)).fetchall()
+    if not rows:
+        await m.answer("Активных объявлений нет.")
+        return
+    kb = InlineKeyboardBuilder()
+    lines = ["Активные объявления:"]
+    for r in rows:
+        till = datetime.fromisoformat(r["expires_at"]).strftime("%d.%m") if r["expires_at"] else "—"
+        lines.append(f"#{r['id']} (до {till}): {(r['text'] or '').strip()[:40]}")
+        kb.button(text=f"✅ #{r['id']}", callback_data=f"sold:{r['id']}")
+        kb.button(text=f"⬆️ #{r['id']}", callback_data=f"bump:{r['id']}")
+    kb.adjust(2)
+    await m.answer("\n".join(lines) + "\n\n✅ — продано, ⬆️ — поднять", reply_markup=kb.as_markup())
+
+@r_public.callback_query(F.data.startswith("sold:"))
+async def post_sold(c: CallbackQuery):
+    pid = int(c.data.split(":",1)[1])
+    with db() as conn:
+        p = conn.execute("SELECT published_msg_id, channel FROM posts WHERE id=? AND author_tg=?", (pid, c.from_user.id)).fetchone()
+        cur = conn.execute("UPDATE posts SET status='sold' WHERE id=? AND author_tg=? AND status='approved'",
+                           (pid, c.from_user.id))
+        if cur.rowcount: journal(conn, "post_sold", pid, c.from_user.id)
+    if not cur.rowcount:
+        await c.answer("Объявление уже не активно.", show_alert=True); return
+    invalidate_shop(c.from_user.id)
+    if p["published_msg_id"]:
+        channel_queue.mark(post_chat(p), p["published_msg_id"], pid, BANNER_SOLD)
+    await c.answer(f"#{pid} отмечено как проданное.")
+
+@r_public.callback_query(F.data.startswith("bump:"))
+async def post_bump(c: CallbackQuery):
+    pid = int(c.data.split(":",1)[1])
+    with db() as conn:
+        p = conn.execute("SELECT * FROM posts WHERE id=? AND author_tg=?", (pid, c.from_user.id)).fetchone()
+    if not p or p["status"] != "approved":
+        await c.answer("Объявление уже не активно.", show_alert=True); return
+    last = p["bumped_at"] or p["published_at"]
+    hours = cfg().bump_cooldown_hours
+    if last and datetime.now() - datetime.fromisoformat(last) < timedelta(hours=hours):
+        await c.answer(f"Поднимать можно раз в {hours} ч.", show_alert=True); return
+    # подъём занимаем условным UPDATE по прежнему bumped_at: двойное нажатие второй раз не пройдёт
+    now = datetime.now()
+    with db() as conn:
+        if not conn.execute("UPDATE posts SET bumped_at=? WHERE id=? AND status='approved' AND bumped_at IS ?",
+                            (now.isoformat(), pid, p["bumped_at"])).rowcount:
+            await c.answer("Объявление уже поднимается.", show_alert=True); return
+    u = get_user(c.from_user.id)
+    chat = route_chat(p["category"], user_tier(u))
+    try:
+        msg = await send_to_channel(p, u, chat)
+    except BaseException as e:
+        with db() as conn:
+            conn.execute("UPDATE posts SET bumped_at=? WHERE id=? AND bumped_at=?", (p["bumped_at"], pid, now.isoformat()))
+        if not isinstance(e, Exception): raise
+        log.warning("bump error: %s", e)
+        await c.answer("Не удалось поднять (бот должен быть админом в канале).", show_alert=True); return
+    with db() as conn:
+        conn.execute("UPDATE posts SET published_msg_id=?, channel=?, expires_at=? WHERE id=?",
+                     (msg.message_id, str(chat), (now + timedelta(days=listing_ttl_days(u))).isoformat(), pid))
+        journal(conn, "post_bumped", pid, c.from_user.id, channel=str(chat))
+    invalidate_shop(c.from_user.id)
+    if p["published_msg_id"]:
+        channel_queue.delete(post_chat(p), p["published_msg_id"])
+    await c.answer(f"#{pid} поднято ⬆️")
+
+@db_scope
+def expire_posts_batch(now: str) -> list[sqlite3.Row]:
+    with db() as conn:
+        rows = conn.execute(
+            "SELECT id, author_tg, published_msg_id, channel FROM posts WHERE status='approved' AND expires_at<=? "
+            "ORDER BY expires_at LIMIT ?",
+            (now, EXPIRE_BATCH)).fetchall()
+        if rows:
+            conn.execute(f"UPDATE posts SET status='expired' WHERE id IN ({','.join('?'*len(rows))})",
+                         [r["id"] for r in rows])
+            for r in rows: journal(conn, "post_expired", r["id"], None, author=r["author_tg"])
+    return rows
+
+async def expire_posts_loop():
+    while True:
+        try:
+            now, total = datetime.now().isoformat(), 0
+            while True:
+                rows = expire_posts_batch(now)
+                for r in rows:
+                    invalidate_shop(r["author_tg"])
+                    if r["published_msg_id"]:
+                        channel_queue.mark(post_chat(r), r["published_msg_id"], r["id"], BANNER_EXPIRED)
+                total += len(rows)
+                if len(rows) < EXPIRE_BATCH: break
+                await asyncio.sleep(0)
+            if total:
+                log.info("expired %s posts", total)
+            prune_post_quota()
+        except Exception as e:
+            log.warning("expire job error: %s", e)
+        await asyncio.sleep(EXPIRE_EVERY_SEC)
+
+# =======================
+# ---- АРХИВ -------------
+# =======================
+# Живая таблица posts держит только то, что ещё может измениться; закрытые старые посты вместе
+# с жалобами и медиа переезжают в archive.db. Горячие запросы архив не видят, история
+# (досье, heatmap, доверие) читает через history_db() временные view all_posts/all_complaints.
+ARCHIVE_TABLES = {"posts": "id", "complaints": "post_id", "post_media": "post_id"}   # таблица -> ссылка на пост
+_archive_cols: dict[str, str] = {}
+
+def init_archive():
+    # схема архива повторяет живые таблицы; новые колонки (ensure в init_db) доезжают сюда же
+    conn = _connect()
+    try:
+        conn.execute("ATTACH DATABASE ? AS arch", (ARCHIVE_PATH,))
+        conn.execute("PRAGMA arch.journal_mode=WAL;")
+        for table in ARCHIVE_TABLES:
+            cols = [(r["name"], r["type"]) for r in conn.execute(f"PRAGMA main.table_info({table})")]
+            conn.execute(f"CREATE TABLE IF NOT EXISTS arch.{table} AS SELECT * FROM main.{table} WHERE 0")
+            have = {r["name"] for r in conn.execute(f"PRAGMA arch.table_info({table})")}
+            for name, typ in cols:
+                if name not in have:
+                    conn.execute(f"ALTER TABLE arch.{table} ADD COLUMN {name} {typ}")
+            conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS arch.idx_{table}_id ON {table}(id)")
+            _archive_cols[table] = ", ".join(name for name, _ in cols)
+        conn.execute("CREATE INDEX IF NOT EXISTS arch.idx_posts_author ON posts(author_tg)")
+        conn.execute("CREATE INDEX IF NOT EXISTS arch.idx_complaints_post ON complaints(post_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS arch.idx_post_media_post ON post_media(post_id)")
+        conn.commit()
+    finally:
+        conn.close()
+
+@contextmanager
+def history_db():
+    with db() as conn:
+        arch = bool(_archive_cols)
+        if arch:
+            conn.execute("ATTACH DATABASE ? AS arch", (ARCHIVE_PATH,))
+        for view, table in (("all_posts", "posts"), ("all_complaints", "complaints")):
+            if arch:
+                cols = _archive_cols[table]
+                conn.execute(f"CREATE TEMP VIEW {view} AS SELECT {cols} FROM main.{table} "
+                             f"UNION ALL SELECT {cols} FROM arch.{table}")
+            else:
+                conn.execute(f"CREATE TEMP VIEW {view} AS SELECT * FROM main.{table}")
+        yield conn
+
+@db_scope
+def archive_batch(cutoff: str) -> int:
+    # Две транзакции: в WAL коммит через ATTACH не атомарен между файлами. Сначала фиксируем копию
+    # в архиве (OR IGNORE — повтор после падения безопасен), потом удаляем из живой только то, что
+    # в архиве точно есть. Упали между ними — строки временно в обеих базах, следующий проход доудалит.
+    with db() as conn:
+        conn.execute("ATTACH DATABASE ? AS arch", (ARCHIVE_PATH,))
+        conn.execute(f"""
+            CREATE TEMP TABLE arch_ids AS SELECT id FROM main.posts
+            WHERE status IN ({','.join('?' * len(ARCHIVE_STATUSES))}) AND COALESCE(published_at, created_at, '') < ?
+            ORDER BY id LIMIT ?
+        """, (*ARCHIVE_STATUSES, cutoff, ARCHIVE_BATCH))
+        n = conn.execute("SELECT COUNT(*) FROM arch_ids").fetchone()[0]
+        if n:
+            for table, ref in ARCHIVE_TABLES.items():
+                cols = _archive_cols[table]
+                conn.execute(f"INSERT OR IGNORE INTO arch.{table}({cols}) SELECT {cols} FROM main.{table} "
+                             f"WHERE {ref} IN (SELECT id FROM arch_ids)")
+            conn.commit()
+            conn.execute("DELETE FROM arch_ids WHERE id NOT IN (SELECT id FROM arch.posts)")
+            n = conn.execute("SELECT COUNT(*) FROM arch_ids").fetchone()[0]
+            for table, ref in reversed(ARCHIVE_TABLES.items()):
+                conn.execute(f"DELETE FROM main.{table} WHERE {ref} IN (SELECT id FROM arch_ids)")
+    metrics.inc("archived_posts_total", n)
+    return n
+
+async def archive_loop():
+    while True:
+        try:
+            cutoff = (datetime.now() - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+            total = 0
+            while (n := archive_batch(cutoff)):
+                total += n
+                await asyncio.sleep(0.05)   # между пачками пропускаем живые записи
+            if total:
+                log.info("archived %s posts", total)
+        except Exception as e:
+            log.warning("archive job error: %s", e)
+        await asyncio.sleep(ARCHIVE_EVERY_SEC)
+
+# =======================
+# ---- ЦЕНЫ --------------
+# =======================
+# Лог-шкала 10 ₽ .. 10M ₽, 16 корзин на порядок (~15% ширина): медиана и разброс с точностью
+# до корзины. Счётчики (категория, неделя) живут в памяти и в price_stats; потребитель журнала
+# на каждое post_approved добавляет +1 в одну корзину, подсказки и тренды посты не сканируют.
+PRICE_BUCKETS = tuple(10 ** (1 + i / 16) for i in range(6 * 16 + 1))
+PRICE_WINDOW_WEEKS = 8          # подсказка в превью — по последним неделям
+PRICE_KEEP_WEEKS = 26           # столько недель держим в памяти для трендов
+PRICE_MIN_SAMPLES = 10
+
+def price_week(dt: datetime) -> str:
+    y, w, _ = dt.isocalendar()
+    return f"{y}-W{w:02d}"
+
+def round_price(v: float) -> int:
+    # две значащие цифры: 12 345 -> 12 000
+    if v < 100: return int(round(v))
+    k = 10 ** (len(str(int(v))) - 2)
+    return int(round(v / k) * k)
+
+def fmt_price(v: float) -> str:
+    return f"{round_price(v):_}".replace("_", " ") + " ₽"
+
+class PriceStats:
+    def __init__(self):
+        self.hist: dict[tuple[str, str], list[int]] = {}
+
+    def load(self):
+        since = price_week(datetime.now() - timedelta(weeks=PRICE_KEEP_WEEKS))
+        self.hist.clear()
+        with history_db() as conn:
+            if not conn.execute("SELECT 1 FROM journal_consumers WHERE name='price_stats'").fetchone():
+                # первый запуск потребителя: сводка из постов, журнал — с текущей головы
+                conn.execute("DELETE FROM price_stats")
+                self._backfill(conn)
+                set_consumer_seq(conn, "price_stats", journal_head(conn))
+            for r in conn.execute("SELECT category, week, bucket, count FROM price_stats WHERE week>=?", (since,)):
+                self._counts(r["category"], r["week"])[r["bucket"]] = r["count"]
+
+    def _backfill(self, conn: sqlite3.Connection):
+        # один раз при появлении таблицы — из уже опубликованных постов, включая ушедшие в архив
+        acc: dict[tuple, int] = defaultdict(int)
+        for r in conn.execute("SELECT category, price, published_at FROM all_posts "
+                              "WHERE published_at IS NOT NULL AND price > 0"):
+            try: week = price_week(datetime.fromisoformat(r["published_at"]))
+            except ValueError: continue
+            acc[(r["category"] or "", week, self.bucket(r["price"]))] += 1
+        conn.executemany("INSERT INTO price_stats(category, week, bucket, count) VALUES(?,?,?,?)",
+                         [(*k, n) for k, n in acc.items()])
+
+    def _counts(self, cat: str, week: str) -> list[int]:
+        h = self.hist.get((cat, week))
+        if h is None:
+            h = self.hist[(cat, week)] = [0] * (len(PRICE_BUCKETS) + 1)
+        return h
+
+    @staticmethod
+    def bucket(price: float) -> int:
+        return bisect_left(PRICE_BUCKETS, price)
+
+    def record(self, conn: sqlite3.Connection, cat: Optional[str], price: Optional[int],
+               when: datetime) -> Optional[Callable[[], None]]:
+        # пишет в БД и возвращает применение к памяти — звать после коммита
+        if not price or price <= 0: return None
+        cat, week, b = cat or "", price_week(when), self.bucket(price)
+        conn.execute("""
+            INSERT INTO price_stats(category, week, bucket, count) VALUES(?,?,?,1)
+            ON CONFLICT(category, week, bucket) DO UPDATE SET count=count+1
+        """, (cat, week, b))
+        return functools.partial(self._bump, cat, week, b)
+
+    def _bump(self, cat: str, week: str, b: int):
+        self._counts(cat, week)[b] += 1
+
+    def merged(self, cat: str, weeks: list[str]) -> list[int]:
+        out = [0] * (len(PRICE_BUCKETS) + 1)
+        for w in weeks:
+            h = self.hist.get((cat, w))
+            if h:
+                for i, n in enumerate(h):
+                    if n: out[i] += n
+        return out
+
+    @staticmethod
+    def quantile(h: list[int], q: float) -> Optional[float]:
+        # внутри корзины — геометрическая интерполяция между её границами
+        total = sum(h)
+        if not total: return None
+        need, acc = q * total, 0
+        for i, n in enumerate(h):
+            if n and acc + n >= need:
+                lo = PRICE_BUCKETS[i - 1] if i else PRICE_BUCKETS[0] / 10 ** (1 / 16)
+                hi = PRICE_BUCKETS[i] if i < len(PRICE_BUCKETS) else PRICE_BUCKETS[-1]
+                return lo * (hi / lo) ** ((need - acc) / n)
+            acc += n
+        return None
+
+    def summary(self, cat: str, weeks: int = PRICE_WINDOW_WEEKS, until: Optional[datetime] = None) -> Optional[dict]:
+        until = until or datetime.now()
+        h = self.merged(cat, [price_week(until - timedelta(weeks=i)) for i in range(weeks)])
+        n = sum(h)
+        if n < PRICE_MIN_SAMPLES: return None
+        return {"n": n, "p25": self.quantile(h, .25), "p50": self.quantile(h, .5), "p75": self.quantile(h, .75)}
+
+price_stats = PriceStats()
+
+@journal_consumer("price_stats", ("post_approved",))
+def _price_stats_apply(conn: sqlite3.Connection, e: sqlite3.Row, data: dict):
+    return price_stats.record(conn, data.get("category"), data.get("price"), datetime.fromisoformat(data["published_at"]))
+
+def price_hint(cat: Optional[str], price: Optional[int]) -> Optional[str]:
+    st = price_stats.summary(cat or "")
+    if not st: return None
+    line = (f"💹 Похожие объявления ({st['n']} за {PRICE_WINDOW_WEEKS} нед.): медиана {fmt_price(st['p50'])}, "
+            f"обычно {fmt_price(st['p25'])} – {fmt_price(st['p75'])}.")
+    if price and price < st["p25"] / 2: line += "\n⚠️ Цена заметно ниже рынка — проверьте, нет ли опечатки."
+    elif price and price > st["p75"] * 2: line += "\n⚠️ Цена заметно выше рынка."
+    return line
+
+# =======================
+# ---- ЭКСПОРТ -----------
+# =======================
+# Выгрузка таблиц админам: курсор fetchmany -> генератор пачек -> gzip-поток на диск, в памяти
+# не больше одной пачки. Файл пишет поток (gzip и csv не держат цикл событий), прогресс — счётчиком.
+EXPORT_DIR = "exports"
+EXPORT_CHUNK = 5000
+EXPORT_PROGRESS_SEC = 3
+EXPORT_MAX_BYTES = 50 * 2**20                      # лимит Bot API на отправку документа
+EXPORT_SOURCES = {"posts": "all_posts", "users": "users", "admin_logs": "admin_logs"}   # посты — вместе с архивом
+EXPORT_FORMATS = ("csv", "jsonl")
+# поток выгрузки не отменить через asyncio: shutdown ставит флаг, поток сам выходит между пачками
+# (иначе asyncio.run ждёт его на выходе сколько угодно)
+export_stop = threading.Event()
+
+def export_count(table: str) -> int:
+    with history_db() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {EXPORT_SOURCES[table]}").fetchone()[0]
+
+def export_chunks(table: str, chunk: int = EXPORT_CHUNK):
+    # первая выдача — имена колонок, дальше пачки строк
+    with history_db() as conn:
+        cur = conn.execute(f"SELECT * FROM {EXPORT_SOURCES[table]}")
+        yield tuple(d[0] for d in cur.description)
+        while rows := cur.fetchmany(chunk):
+            yield rows
+
+def write_export(table: str, fmt: str, path: str, progress: dict) -> int:
+    chunks = export_chunks(table)
+    cols = next(chunks)
+    try:
+        with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            if fmt == "csv": w.writerow(cols)
+            for rows in chunks:
+                if export_stop.is_set():
+                    raise RuntimeError("бот останавливается")
+                if fmt == "csv":
+                    w.writerows(rows)
+                else:
+                    f.writelines(json.dumps(dict(zip(cols, r)), ensure_ascii=False) + "\n" for r in rows)
+                progress["rows"] += len(rows)
+    except BaseException:
+        chunks.close()
+        if os.path.exists(path): os.remove(path)
+        raise
+    return progress["rows"]
+
+async def run_export(chat_id: int, admin_tg: int, table: str, fmt: str):
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    name = f"{table}_{datetime.now():%Y%m%d_%H%M%S}.{fmt}.gz"
+    path = os.path.join(EXPORT_DIR, f"{admin_tg}_{name}")
+    progress = {"rows": 0}
+    keep = False   # на сервере оставляем только целый файл сверх лимита, недописанный — всегда удаляем
+    msg = await bot.send_message(chat_id, f"⏳ Экспорт {table}: считаю строки…")
+    try:
+        total = await asyncio.to_thread(export_count, table)
+        work = asyncio.ensure_future(asyncio.to_thread(write_export, table, fmt, path, progress))
+        while not work.done():
+            await asyncio.wait({work}, timeout=EXPORT_PROGRESS_SEC)
+            if not work.done():
+                try: await msg.edit_text(f"⏳ Экспорт {table}: {progress['rows']:_} / {total:_} строк".replace("_", " "))
+                except TelegramBadRequest: pass
+        rows, size = work.result(), os.path.getsize(path)
+        if size > EXPORT_MAX_BYTES:
+            keep = True
+            await msg.edit_text(f"❌ Экспорт {table}: {size / 2**20:.0f} МБ — больше лимита Telegram, заберите файл с сервера.")
+            return
+        await msg.edit_text(f"✅ Экспорт {table}: {rows:_} строк, {size / 2**20:.1f} МБ".replace("_", " "))
+        await bot.send_document(chat_id, FSInputFile(path, filename=name))
+        with db() as conn:
+            conn.execute("INSERT INTO admin_logs(admin_tg,action,target_id,extra,created_at) VALUES(?,?,?,?,?)",
+                         (admin_tg, "export", None, f"{table}.{fmt} rows={rows}", datetime.now().isoformat()))
+    except Exception as e:
+        log.warning("export %s failed: %s", table, e)
+        await bot.send_message(chat_id, f"❌ Экспорт {table} не удался: {e}")
+    finally:
+        if not keep and os.path.exists(path):
+            os.remove(path)
+
+# =======================
+# ---- ДОВЕРИЕ -----------
+# =======================
+# trust_dirty ставится при публикации/отклонении и когда автор перешагивает порог возраста
+# (mark_trust_aged); пересчёт идёт пачками одним набором запросов, без цикла по пользователям в Python
+_trust_aged_upto: Optional[str] = None
+
+@db_scope
+def mark_trust_aged() -> int:
+    # verified требует возраста аккаунта: без новых постов автор сам по себе в пересчёт не попадёт.
+    # Окно — с прошлого прохода (после рестарта — сутки назад), в нём только кандидаты по числу постов.
+    global _trust_aged_upto
+    cutoff = (datetime.now() - timedelta(days=TRUST_VERIFIED_MIN_AGE_DAYS)).isoformat()
+    prev = _trust_aged_upto or (datetime.now() - timedelta(days=TRUST_VERIFIED_MIN_AGE_DAYS + 1)).isoformat()
+    with db() as conn:
+        n = conn.execute("""
+            UPDATE users SET trust_dirty=1
+            WHERE joined_at > ? AND joined_at <= ? AND trust_dirty=0 AND trust_locked=0
+              AND trust_status='neutral' AND posts_total >= ?
+        """, (prev, cutoff, TRUST_VERIFIED_MIN_POSTS)).rowcount
+    _trust_aged_upto = cutoff
+    return n
+
+@db_scope
+def recompute_trust_batch(uid: Optional[int] = None) -> int:
+    # uid — пересчитать одного пользователя (ручной сброс в админке), иначе — пачку помеченных
+    with history_db() as conn:
+        conn.execute("DROP TABLE IF EXISTS temp.trust_calc")
+        conn.execute(f"""
+            CREATE TEMP TABLE trust_calc AS
+            SELECT u.tg_id,
+                   COALESCE(julianday('now', 'localtime') - julianday(u.joined_at), 0) AS age_days,
+                   (SELECT COUNT(*) FROM all_posts p WHERE p.author_tg=u.tg_id
+                      AND p.status IN ('approved','sold','expired')) AS ok,
+                   (SELECT COUNT(*) FROM all_posts p WHERE p.author_tg=u.tg_id AND p.status='rejected') AS bad,
+                   (SELECT COUNT(*) FROM all_posts p JOIN all_complaints c ON c.post_id=p.id
+                     WHERE p.author_tg=u.tg_id) AS compl
+            FROM users u WHERE {"u.tg_id=?" if uid else "u.trust_dirty=1"} LIMIT ?
+        """, (uid, 1) if uid else (TRUST_BATCH,))
+        n = conn.execute("SELECT COUNT(*) FROM trust_calc").fetchone()[0]
+        if n:
+            conn.execute("""
+                UPDATE users SET
+                    trust_score = t.ok - 2 * t.bad - 3 * t.compl,
+                    trust_status = CASE
+                        WHEN users.trust_locked THEN users.trust_status
+                        WHEN t.compl >= :scam_c
+                          OR (t.ok + t.bad >= :scam_n AND t.bad >= :scam_r * (t.ok + t.bad)) THEN 'scammer'
+                        WHEN t.ok >= :ver_n AND t.ok >= :ver_r * (t.ok + t.bad)
+                          AND t.compl <= :ver_c AND t.age_days >= :ver_age THEN 'verified'
+                        ELSE 'neutral' END,
+                    trust_dirty = 0
+                FROM trust_calc t WHERE users.tg_id = t.tg_id
+            """, {"scam_c": TRUST_SCAMMER_COMPLAINTS, "scam_n": TRUST_SCAMMER_MIN_POSTS,
+                  "scam_r": TRUST_SCAMMER_REJECT_RATIO, "ver_n": TRUST_VERIFIED_MIN_POSTS,
+                  "ver_r": TRUST_VERIFIED_MIN_RATIO, "ver_c": TRUST_VERIFIED_MAX_COMPLAINTS,
+                  "ver_age": TRUST_VERIFIED_MIN_AGE_DAYS})
+        conn.execute("DROP TABLE temp.trust_calc")
+    return n
+
+@db_scope
+def set_trust(admin_tg: int, uid: int, status: Optional[str]):
+    # status=None — вернуть автоматический расчёт
+    with db() as conn:
+        if status:
+            conn.execute("UPDATE users SET trust_status=?, trust_locked=1 WHERE tg_id=?", (status, uid))
+        else:
+            conn.execute("UPDATE users SET trust_locked=0, trust_dirty=1 WHERE tg_id=?", (uid,))
+        conn.execute("INSERT INTO admin_logs(admin_tg,action,target_id,extra,created_at) VALUES(?,?,?,?,?)",
+                     (admin_tg, "trust_set", uid, status or "auto", datetime.now().isoformat()))
+        journal(conn, "trust_set", uid, admin_tg, status=status)
+
+async def trust_loop():
+    while True:
+        try:
+            total = 0
+            mark_trust_aged()
+            while (n := recompute_trust_batch()):
+                total += n
+                await asyncio.sleep(0)
+            if total:
+                log.info("trust recomputed for %s users", total)
+        except Exception as e:
+            log.warning("trust job error: %s", e)
+        await asyncio.sleep(TRUST_EVERY_SEC)
 
 # =======================
 # ---- АДМИНКА -----------
@@ -1026,7 +3437,8 @@ async def admin_menu(m: Message):
     await m.answer("Админ-меню:", reply_markup=admin_kb(is_owner(m.from_user.id)))
 
 @r_owner.message(F.text == "🗝 Выдать/Снять админа")
-async def owner_admins(m: Message):
+async def owner_admins(m: Message, state: FSMContext):
+    await state.clear()   # иначе @ник уйдёт в поиск по справочнику
     rows = list_admins()
     txt = "Админы:\n" + ("\n".join([f"• @{r['username'] or 'ID'+str(r['tg_id'])}" for r in rows]) if rows else "нет")
     await m.answer(txt + "\n\nВыдать: @user или ID\nСнять: <code>remove ID</code>")
@@ -1038,14 +3450,14 @@ async def owner_remove_admin(m: Message):
         await m.answer("Нельзя снять владельца."); return
     set_admin(uid, 0); await m.answer("Снял.")
 
-@r_owner.message()
+@r_owner.message(F.text.regexp(r"^(@\w+|\d+)$"))
 async def owner_add_admin(m: Message):
     text = (m.text or "").strip()
     if not text.startswith("@") and not text.isdigit(): return
     if not is_owner(m.from_user.id): return
     if text.startswith("@"):
         with db() as conn:
-            r = conn.execute("SELECT tg_id FROM users WHERE username=?", (text[1:],)).fetchone()
+            r = conn.execute("SELECT tg_id FROM users WHERE username=? COLLATE NOCASE", (text[1:],)).fetchone()
         if not r: await m.answer("Нет такого в базе."); return
         uid = r["tg_id"]
     else:
@@ -1057,6 +3469,173 @@ async def owner_add_admin(m: Message):
     except: pass
     await m.answer("Выдал.")
 
+# ---- справочник пользователей ----
+USERS_PAGE_SIZE = 10
+TRUST_STATUSES = ("verified", "neutral", "scammer")
+SUB_TITLES = {SUB_FREE: "Free", SUB_VIP: "VIP", SUB_PLAT: "Platinum", SUB_EXTRA: "Extra"}
+
+def parse_user_query(q: str) -> dict:
+    # "@pref vip verified" / "123456" — токены в любом порядке
+    f = {}
+    for tok in (q or "").lower().split():
+        if tok.startswith("@") and len(tok) > 1: f["prefix"] = tok[1:]
+        elif tok.isdigit(): f["tg_id"] = int(tok)
+        elif tok in SUB_TITLES: f["sub"] = tok
+        elif tok in TRUST_STATUSES: f["trust"] = tok
+    return f
+
+@db_scope
+def user_directory(f: dict, after: Optional[list] = None) -> tuple[list[sqlite3.Row], Optional[list]]:
+    # keyset: по нику (username NOCASE, id) при поиске по префиксу, иначе по id
+    where, args = [], []
+    if "tg_id" in f: where.append("tg_id=?"); args.append(f["tg_id"])
+    if "sub" in f: where.append("subscription=?"); args.append(f["sub"])
+    if "trust" in f: where.append("trust_status=?"); args.append(f["trust"])
+    if "prefix" in f:
+        # диапазон по индексу вместо LIKE: ники — ASCII, '\x7f' больше любого символа в них
+        where.append("username COLLATE NOCASE >= ? AND username COLLATE NOCASE < ?")
+        args += [f["prefix"], f["prefix"] + "\x7f"]
+        if after:
+            where.append("(username COLLATE NOCASE > ? OR (username COLLATE NOCASE = ? AND id > ?))")
+            args += [after[0], after[0], after[1]]
+        order = "username COLLATE NOCASE, id"
+    else:
+        if after: where.append("id > ?"); args.append(after[1])
+        order = "id"
+    sql = ("SELECT id, tg_id, username, subscription, trust_status, is_admin FROM users"
+           + (" WHERE " + " AND ".join(where) if where else "") + f" ORDER BY {order} LIMIT ?")
+    with db() as conn:
+        rows = conn.execute(sql, (*args, USERS_PAGE_SIZE + 1)).fetchall()
+    if len(rows) <= USERS_PAGE_SIZE:
+        return rows, None
+    rows = rows[:USERS_PAGE_SIZE]
+    return rows, [rows[-1]["username"], rows[-1]["id"]]
+
+def user_label(r) -> str:
+    return f"@{r['username']}" if r["username"] else f"ID{r['tg_id']}"
+
+async def show_user_directory(target: Message, state: FSMContext, page: int, edit: bool):
+    data = await state.get_data()
+    cursors = data.get("ud_cursors") or [None]   # начала уже открытых страниц — для «назад»
+    page = min(page, len(cursors) - 1)           # кнопка со старого сообщения, данные уже сброшены
+    f = parse_user_query(data.get("ud_query", ""))
+    rows, nxt = user_directory(f, cursors[page])
+    if nxt is not None:
+        cursors = cursors[:page + 1] + [nxt]
+    await state.update_data(ud_cursors=cursors)
+    if rows:
+        lines = [f"👥 Пользователи{' — ' + data['ud_query'] if data.get('ud_query') else ''} (стр. {page + 1}):"]
+        lines += [f"• {user_label(r)} · {SUB_TITLES.get(r['subscription'], r['subscription'])} · "
+                  f"{r['trust_status']}{' · 🛠' if r['is_admin'] else ''}" for r in rows]
+    else:
+        lines = ["Никого не нашлось."]
+    lines.append("\n🔎 Поиск: <code>@префикс</code>, ID, free/vip/platinum/extra, verified/neutral/scammer")
+    kb = InlineKeyboardBuilder()
+    for r in rows:
+        kb.button(text=user_label(r), callback_data=f"ud:u:{r['tg_id']}")
+    nav = 0
+    if page: kb.button(text="⬅️", callback_data=f"ud:p:{page - 1}"); nav += 1
+    if nxt is not None: kb.button(text="➡️", callback_data=f"ud:p:{page + 1}"); nav += 1
+    kb.button(text="🔎 Поиск", callback_data="ud:s:0")
+    kb.adjust(*([2] * ((len(rows) + 1) // 2)), *([nav] if nav else []), 1)
+    if edit:
+        try: await target.edit_text("\n".join(lines), reply_markup=kb.as_markup())
+        except TelegramBadRequest: pass
+    else:
+        await target.answer("\n".join(lines), reply_markup=kb.as_markup())
+
+@db_scope
+def user_dossier(tg_id: int) -> Optional[str]:
+    with history_db() as conn:
+        u = conn.execute("SELECT * FROM users WHERE tg_id=?", (tg_id,)).fetchone()
+        if not u: return None
+        by_status = conn.execute("SELECT status, COUNT(*) AS n FROM all_posts WHERE author_tg=? GROUP BY status",
+                                 (tg_id,)).fetchall()
+        posts = conn.execute("SELECT id, status, category, text FROM all_posts WHERE author_tg=? ORDER BY id DESC LIMIT 5",
+                             (tg_id,)).fetchall()
+        complaints = conn.execute("""
+            SELECT c.post_id, c.reason, c.created_at FROM all_posts p JOIN all_complaints c ON c.post_id=p.id
+            WHERE p.author_tg=? ORDER BY c.id DESC LIMIT 5
+        """, (tg_id,)).fetchall()
+        logs = conn.execute("SELECT admin_tg, action, extra, created_at FROM admin_logs WHERE target_id=? "
+                            "ORDER BY id DESC LIMIT 5", (tg_id,)).fetchall()
+    lines = [
+        f"👤 {user_label(u)} | ID <code>{u['tg_id']}</code>{' | 🛠 админ' if u['is_admin'] else ''}",
+        f"💳 {sub_string(u)}",
+        f"🛡 Доверие: {u['trust_status']} ({'вручную' if u['trust_locked'] else 'авто'}, счёт {u['trust_score'] or 0})",
+        f"📅 С нами с: {(u['joined_at'] or '—')[:10]}",
+        f"👥 Подписчиков: {u['followers_count'] or 0}",
+        "📊 Посты: " + (", ".join(f"{r['status']}={r['n']}" for r in by_status) or "нет"),
+    ]
+    if posts:
+        lines += ["", "<b>Последние посты:</b>"]
+        lines += [f"#{p['id']} [{p['status']}] {cfg().category_titles.get(p['category'], p['category'] or '—')}: "
+                  f"{html.escape((p['text'] or '')[:40])}" for p in posts]
+    if complaints:
+        lines += ["", "<b>Жалобы на посты:</b>"]
+        lines += [f"#{c['post_id']} {(c['created_at'] or '')[:10]}: {html.escape(c['reason'] or '')[:60]}" for c in complaints]
+    if logs:
+        lines += ["", "<b>Действия админов:</b>"]
+        lines += [f"{(r['created_at'] or '')[:16]} {r['action']} (ID{r['admin_tg']}) {html.escape(r['extra'] or '')}" for r in logs]
+    return "\n".join(lines)
+
+@r_admin.message(F.text == "👥 Пользователи")
+async def users_menu(m: Message, state: FSMContext):
+    if not is_admin(m.from_user.id): return
+    await state.set_state(None)
+    await state.update_data(ud_query="", ud_cursors=None)
+    await show_user_directory(m, state, 0, edit=False)
+
+@r_admin.message(F.text == "🧑‍💻 Админы")
+async def admins_list(m: Message):
+    if not is_admin(m.from_user.id): return
+    rows = list_admins()
+    kb = InlineKeyboardBuilder()
+    for r in rows:
+        kb.button(text=("👑 " if r["tg_id"] == OWNER_ID else "") + user_label(r), callback_data=f"ud:u:{r['tg_id']}")
+    kb.adjust(2)
+    await m.answer(f"🧑‍💻 Админов: {len(rows)}", reply_markup=kb.as_markup())
+
+@r_admin.callback_query(F.data.startswith("ud:"))
+async def users_action(c: CallbackQuery, state: FSMContext):
+    if not is_admin(c.from_user.id): return
+    _, kind, arg = c.data.split(":")
+    if kind == "p":
+        await show_user_directory(c.message, state, int(arg), edit=True)
+    elif kind == "s":
+        # ввод запроса — отдельным шагом: состояние живёт до первого ответа, а не всё время в справочнике
+        await state.set_state(AdminSG.user_search)
+        await c.message.answer("Запрос: <code>@префикс</code>, ID, тариф, статус доверия — можно несколько через пробел.")
+    else:
+        txt = user_dossier(int(arg))
+        await c.message.answer(txt or "Пользователь не найден.", reply_markup=trust_kb(int(arg)) if txt else None)
+    await c.answer()
+
+def trust_kb(uid: int):
+    kb = InlineKeyboardBuilder()
+    kb.button(text="✅ verified", callback_data=f"trust:{uid}:verified")
+    kb.button(text="➖ neutral", callback_data=f"trust:{uid}:neutral")
+    kb.button(text="⛔ scammer", callback_data=f"trust:{uid}:scammer")
+    kb.button(text="🤖 Авто", callback_data=f"trust:{uid}:auto")
+    kb.adjust(3, 1)
+    return kb.as_markup()
+
+@r_admin.callback_query(F.data.startswith("trust:"))
+async def trust_override(c: CallbackQuery):
+    if not is_admin(c.from_user.id): return
+    _, uid, status = c.data.split(":")
+    uid = int(uid)
+    if status == "auto":
+        set_trust(c.from_user.id, uid, None)
+        recompute_trust_batch(uid)
+    elif status in TRUST_STATUSES:
+        set_trust(c.from_user.id, uid, status)
+    else:
+        await c.answer(); return
+    try: await c.message.edit_text(user_dossier(uid), reply_markup=trust_kb(uid))
+    except TelegramBadRequest: pass
+    await c.answer("Статус доверия обновлён.")
+
 @r_admin.message(F.text == "📨 Рассылка")
 async def bc_menu(m: Message, state: FSMContext):
     if not is_admin(m.from_user.id): return
@@ -1072,31 +3651,74 @@ async def bc_pick(c: CallbackQuery, state: FSMContext):
     await c.message.edit_text("Отправьте текст рассылки одним сообщением.")
     await state.set_state(AdminSG.bc_text); await c.answer()
 
+# Рассылка идёт фоновой задачей супервизора: курсор по tg_id сохраняется после каждой пачки
+# и при остановке, недошедшая рассылка продолжается после рестарта.
+@db_scope
+def broadcast_recipients(b: sqlite3.Row, cursor: int) -> list[int]:
+    with db() as conn:
+        if b["target"] == "active7":
+            rows = conn.execute("SELECT DISTINCT author_tg AS tg_id FROM posts WHERE published_at>=? AND author_tg>? "
+                                "ORDER BY author_tg LIMIT ?", (b["since"], cursor, BROADCAST_CHUNK)).fetchall()
+        elif b["target"] in (SUB_VIP, SUB_PLAT, SUB_EXTRA):
+            rows = conn.execute("SELECT tg_id FROM users WHERE subscription=? AND tg_id>? ORDER BY tg_id LIMIT ?",
+                                (b["target"], cursor, BROADCAST_CHUNK)).fetchall()
+        else:
+            rows = conn.execute("SELECT tg_id FROM users WHERE tg_id>? ORDER BY tg_id LIMIT ?",
+                                (cursor, BROADCAST_CHUNK)).fetchall()
+    return [r["tg_id"] for r in rows]
+
+async def run_broadcast(bid: int):
+    with db() as conn:
+        b = conn.execute("SELECT * FROM broadcasts WHERE id=?", (bid,)).fetchone()
+    cursor = b["cursor"]
+    while not supervisor.stopping:
+        ids = broadcast_recipients(b, cursor)
+        if not ids: break
+        ok = done = 0
+        for tg in ids:
+            if supervisor.stopping: break
+            for _ in range(2):
+                await bot_limiter.acquire()
+                try:
+                    await bot.send_message(tg, b["text"]); ok += 1
+                    break
+                except TelegramRetryAfter as e: await asyncio.sleep(e.retry_after)
+                except Exception: break
+            done, cursor = done + 1, tg
+        with db() as conn:
+            conn.execute("UPDATE broadcasts SET cursor=?, sent=sent+?, failed=failed+? WHERE id=?",
+                         (cursor, ok, done - ok, bid))
+    if supervisor.stopping: return
+    with db() as conn:
+        conn.execute("UPDATE broadcasts SET status='done', finished_at=? WHERE id=?", (datetime.now().isoformat(), bid))
+        r = conn.execute("SELECT sent, failed FROM broadcasts WHERE id=?", (bid,)).fetchone()
+    try: await bot.send_message(b["admin_tg"], f"✅ Рассылка #{bid} завершена. Отправлено: {r['sent']}, ошибок: {r['failed']}")
+    except Exception: pass
+
+def resume_broadcasts() -> int:
+    with db() as conn:
+        ids = [r["id"] for r in conn.execute("SELECT id FROM broadcasts WHERE status='running' ORDER BY id")]
+    for bid in ids:
+        supervisor.submit(f"broadcast#{bid}", run_broadcast(bid))
+    return len(ids)
+
 @r_admin.message(AdminSG.bc_text)
 async def bc_send(m: Message, state: FSMContext):
     data = await state.get_data(); target = data.get("bc_target","all")
-    text = m.text or ""
+    since = (datetime.now()-timedelta(days=7)).isoformat()
     with db() as conn:
-        if target == "all": rows = conn.execute("SELECT tg_id FROM users").fetchall()
-        elif target in (SUB_VIP,SUB_PLAT,SUB_EXTRA):
-            rows = conn.execute("SELECT tg_id FROM users WHERE subscription=?", (target,)).fetchall()
-        else:
-            since = (datetime.now()-timedelta(days=7)).isoformat()
-            rows = conn.execute("SELECT DISTINCT author_tg as tg_id FROM posts WHERE published_at>=?", (since,)).fetchall()
-    sent = 0
-    for r in rows:
-        try: await bot.send_message(r["tg_id"], text); sent += 1
-        except: pass
-        await asyncio.sleep(0.01)
-    await m.answer(f"Отправлено: {sent}")
+        bid = conn.execute("INSERT INTO broadcasts(admin_tg,target,since,text,created_at) VALUES(?,?,?,?,?)",
+                           (m.from_user.id, target, since, m.text or "", datetime.now().isoformat())).lastrowid
+    supervisor.submit(f"broadcast#{bid}", run_broadcast(bid))
+    await m.answer(f"📨 Рассылка #{bid} запущена ({target}). Ход — в «🩺 Задачи», по окончании пришлю итог.")
     await state.clear()
 
 @r_admin.message(F.text == "📊 Глобальная статистика")
 async def gstats(m: Message):
     if not is_admin(m.from_user.id): return
-    with db() as conn:
+    with history_db() as conn:
         users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
-        posts = conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+        posts = conn.execute("SELECT COUNT(*) FROM all_posts").fetchone()[0]
         vip = conn.execute("SELECT COUNT(*) FROM users WHERE subscription='vip'").fetchone()[0]
         plat = conn.execute("SELECT COUNT(*) FROM users WHERE subscription='platinum'").fetchone()[0]
         extra = conn.execute("SELECT COUNT(*) FROM users WHERE subscription='extra'").fetchone()[0]
@@ -1105,8 +3727,8 @@ async def gstats(m: Message):
 @r_admin.message(F.text == "🔥 Heatmap")
 async def heatmap(m: Message):
     if not is_admin(m.from_user.id): return
-    with db() as conn:
-        rows = conn.execute("SELECT published_at FROM posts WHERE published_at IS NOT NULL").fetchall()
+    with history_db() as conn:
+        rows = conn.execute("SELECT published_at FROM all_posts WHERE published_at IS NOT NULL").fetchall()
     dow, hours = [0]*7, [0]*24
     for r in rows:
         try:
@@ -1116,6 +3738,224 @@ async def heatmap(m: Message):
     await m.answer("🗓 По дням:\n" + "\n".join(f"{days[i]}: {'█'*max(1,d//5)} {d}" for i,d in enumerate(dow)))
     await m.answer("⏰ По часам:\n" + "\n".join(f"{i:02d}: {'█'*max(1,h//3)} {h}" for i,h in enumerate(hours)))
 
+@r_admin.message(F.text == "💹 Цены")
+async def price_trends(m: Message):
+    if not is_admin(m.from_user.id): return
+    # медиана по неделям, старые слева; «·» — мало данных за неделю
+    now, weeks = datetime.now(), 6
+    lines = [f"💹 Медиана цены по неделям (последние {weeks}, справа — текущая)"]
+    for title, code in cfg().categories:
+        cells = []
+        for i in reversed(range(weeks)):
+            h = price_stats.merged(code, [price_week(now - timedelta(weeks=i))])
+            cells.append(fmt_price(price_stats.quantile(h, .5)) if sum(h) >= 3 else "·")
+        st = price_stats.summary(code)
+        tail = (f"\n   {PRICE_WINDOW_WEEKS} нед.: {fmt_price(st['p25'])} – {fmt_price(st['p75'])}, n={st['n']}"
+                if st else "")
+        lines.append(f"<b>{html.escape(title)}</b>: " + " → ".join(cells) + tail)
+    await m.answer("\n".join(lines))
+
+@r_admin.message(F.text == "📈 Метрики")
+async def metrics_summary(m: Message):
+    if not is_admin(m.from_user.id): return
+    def top(name: str, title: str, n: int = 8) -> list[str]:
+        rows = sorted(metrics.series(name).items(), key=lambda kv: kv[1].sum, reverse=True)[:n]
+        lines = [f"<b>{title}</b> (вызовов · сред · p95 · макс, мс)"]
+        for label, h in rows:
+            lines.append(f"• {label}: {h.count} · {h.sum/h.count*1000:.1f} · "
+                         f"{h.quantile(.95)*1000:.0f} · {h.max*1000:.0f}")
+        return lines if rows else []
+    queries = {dict(lb).get("scope", ""): v for (n, lb), v in metrics.counters.items() if n == "db_queries_total"}
+    errors = [(dict(lb), v) for (n, lb), v in metrics.counters.items() if n in ("handler_errors_total", "tg_api_errors_total")]
+    lines = top("handler_seconds", "Хендлеры") + [""] + top("db_seconds", "БД по хелперам") + [""] + top("tg_api_seconds", "Telegram API")
+    if queries:
+        lines += ["", "<b>Запросов к БД:</b> " + ", ".join(f"{k}={int(v)}" for k, v in sorted(queries.items(), key=lambda kv: -kv[1])[:8])]
+    if errors:
+        lines += ["", "<b>Ошибки:</b> " + ", ".join(f"{d.get('handler') or d.get('method')}/{d.get('error', 'exc')}={int(v)}" for d, v in errors[:8])]
+    lines += ["", f"Очереди: планировщик {len(scheduler)}, правки канала {len(channel_queue)}, "
+                  f"в работе хендлеров {HandlerMetricsMiddleware.inflight}"]
+    await m.answer("\n".join(lines))
+
+TASK_ICONS = {"running": "🟢", "backoff": "🟡", "failed": "🔴", "done": "⚪", "stopped": "⚫", "new": "⚪"}
+
+def tasks_text() -> str:
+    now = time.time()
+    lines = ["🩺 <b>Фоновые задачи</b>"]
+    for i in supervisor.tasks.values():
+        since = f", {fmt_age(now - i.started_at)}" if i.state == "running" else ""
+        line = f"{TASK_ICONS.get(i.state, '⚪')} {i.name}: {i.state}{since}"
+        if i.restarts: line += f", перезапусков {i.restarts}"
+        if i.last_error:
+            line += f"\n    ⤷ {fmt_age(now - i.last_error_at)} назад: {html.escape(i.last_error[:200])}"
+        lines.append(line)
+    lines += ["", f"<b>Разовые</b> ({len(supervisor.jobs_running)}/{supervisor.max_jobs} идут):"]
+    lines += [f"• {name} — {'идёт' if name in supervisor.jobs_running else 'в очереди'}" for name in supervisor.jobs] or ["• нет"]
+    with db() as conn:
+        bcs = conn.execute("SELECT id, target, sent, failed FROM broadcasts WHERE status='running' ORDER BY id").fetchall()
+    lines += [f"📨 Рассылка #{b['id']} ({b['target']}): отправлено {b['sent']}, ошибок {b['failed']}" for b in bcs]
+    lag = journal_lag()
+    lines += ["", f"Хендлеров в работе: {HandlerMetricsMiddleware.inflight}, правок канала в очереди: {len(channel_queue)}, "
+                  f"задач планировщика: {len(scheduler)}, fan-out: {fanout.active()}",
+              "Отставание журнала: " + (", ".join(f"{k}={v}" for k, v in lag.items()) or "—")]
+    return "\n".join(lines)
+
+@r_admin.message(F.text == "🩺 Задачи")
+async def tasks_health(m: Message):
+    if not is_admin(m.from_user.id): return
+    kb = InlineKeyboardBuilder(); kb.button(text="🔄 Обновить", callback_data="tasks:refresh")
+    await m.answer(tasks_text(), reply_markup=kb.as_markup())
+
+@r_admin.callback_query(F.data == "tasks:refresh")
+async def tasks_refresh(c: CallbackQuery):
+    if not is_admin(c.from_user.id): return
+    try: await c.message.edit_text(tasks_text(), reply_markup=c.message.reply_markup)
+    except TelegramBadRequest: pass
+    await c.answer()
+
+def profiler_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="⏸ Выключить" if profiler.enabled else "▶️ Включить", callback_data="prof:toggle")
+    kb.button(text="🔄 Обновить", callback_data="prof:show")
+    kb.button(text="🧹 Сбросить", callback_data="prof:reset")
+    kb.adjust(3)
+    return kb.as_markup()
+
+def profiler_text() -> str:
+    state = "включён" if profiler.enabled else "выключен"
+    head = f"🐢 Профайлер запросов: {state}\n\n"
+    return head + profiler.report(markup=True, limit=TG_TEXT_LIMIT - len(head))
+
+@r_admin.message(F.text == "🐢 Запросы БД")
+async def profiler_menu(m: Message):
+    if not is_admin(m.from_user.id): return
+    await m.answer(profiler_text(), reply_markup=profiler_kb())
+
+@r_admin.callback_query(F.data.startswith("prof:"))
+async def profiler_action(c: CallbackQuery):
+    if not is_admin(c.from_user.id): return
+    action = c.data.split(":", 1)[1]
+    if action == "toggle":
+        profiler.enabled = not profiler.enabled
+    elif action == "reset":
+        profiler.reset()
+    try: await c.message.edit_text(profiler_text(), reply_markup=profiler_kb())
+    except Exception: pass  # текст не изменился
+    await c.answer()
+
+@r_admin.message(F.text == "📤 Экспорт")
+async def export_menu(m: Message):
+    if not is_admin(m.from_user.id): return
+    kb = InlineKeyboardBuilder()
+    for table in EXPORT_SOURCES:
+        for fmt in EXPORT_FORMATS:
+            kb.button(text=f"{table} · {fmt.upper()}", callback_data=f"exp:{table}:{fmt}")
+    kb.adjust(2)
+    await m.answer("Что выгрузить? Файл придёт архивом .gz.", reply_markup=kb.as_markup())
+
+@r_admin.callback_query(F.data.startswith("exp:"))
+async def export_start(c: CallbackQuery):
+    if not is_admin(c.from_user.id): return
+    _, table, fmt = c.data.split(":")
+    if table not in EXPORT_SOURCES or fmt not in EXPORT_FORMATS: return await c.answer()
+    # одна выгрузка на админа: имя задачи занято — предыдущая ещё идёт
+    if not supervisor.submit(f"export:{c.from_user.id}", run_export(c.message.chat.id, c.from_user.id, table, fmt)):
+        return await c.answer("Предыдущая выгрузка ещё идёт", show_alert=True)
+    await c.answer("Выгрузка запущена")
+
+# ---- настройки (только владелец) ----
+async def bot_admin_error(ch: str) -> Optional[str]:
+    try:
+        member = await bot.get_chat_member(ch, (await bot.get_me()).id)
+    except (TelegramBadRequest, TelegramForbiddenError) as e:
+        return f"Канал {ch} недоступен: {e.message}"
+    if member.status not in ("administrator", "creator"):
+        return f"Бот не админ в {ch} — сначала добавьте его администратором."
+    return None
+
+def settings_text() -> str:
+    cur = cfg()
+    lines = ["⚙️ Настройки (✏️ — изменено, остальное по умолчанию):"]
+    for k in SETTING_KEYS:
+        v = getattr(cur, k)
+        mark = "✏️ " if v != getattr(SETTINGS_DEFAULT, k) else ""
+        lines.append(f"{mark}<code>{k}</code> = {html.escape(json.dumps(v, ensure_ascii=False))}")
+    lines += ["", "Изменить: <code>set ключ значение</code> (JSON, строки можно без кавычек)",
+              "Сбросить: <code>reset ключ</code>",
+              "Перечитать из БД можно и сигналом SIGHUP."]
+    return "\n".join(lines)
+
+def settings_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="🔄 Перечитать", callback_data="cfg:reload")
+    return kb.as_markup()
+
+@r_admin.message(F.text == "⚙️ Настройки")
+async def settings_menu(m: Message, state: FSMContext):
+    if not is_owner(m.from_user.id): return
+    await state.clear()
+    await m.answer(settings_text(), reply_markup=settings_kb())
+
+@r_admin.callback_query(F.data == "cfg:reload")
+async def settings_reload(c: CallbackQuery):
+    if not is_owner(c.from_user.id): return
+    load_settings()
+    try: await c.message.edit_text(settings_text(), reply_markup=settings_kb())
+    except TelegramBadRequest: pass
+    await c.answer("Перечитано.")
+
+@r_admin.message(F.text.regexp(r"^(set|reset)\s+\w+"))
+async def settings_set(m: Message):
+    if not is_owner(m.from_user.id): return
+    parts = m.text.split(maxsplit=2)
+    cmd, key = parts[0], parts[1]
+    try:
+        if cmd == "reset":
+            if key not in SETTING_KEYS: raise ValueError(f"нет такой настройки: {key}")
+            save_setting(key, None, m.from_user.id)
+        else:
+            if len(parts) < 3: raise ValueError("не указано значение")
+            try: value = json.loads(parts[2])
+            except json.JSONDecodeError: value = parts[2]
+            value = coerce_setting(key, value)
+            if key.endswith("_channels"):
+                for ch in set(value.values()) - {""}:
+                    if (err := await bot_admin_error(ch)): raise ValueError(err)
+            save_setting(key, value, m.from_user.id)
+    except ValueError as e:
+        await m.answer(f"❌ {e}"); return
+    await m.answer(f"✅ {key} = {html.escape(json.dumps(getattr(cfg(), key), ensure_ascii=False))}")
+
+@r_admin.message(F.text == "📡 Канал: установить")
+async def channel_menu(m: Message, state: FSMContext):
+    if not is_owner(m.from_user.id): return
+    await state.set_state(SettingsSG.channel)
+    await m.answer(f"Текущий канал: {cfg().channel or 'не задан (публикации в ЛС владельцу)'}\n"
+                   "Отправьте <code>@username</code> или <code>-100...</code>, либо <code>-</code> — публиковать в ЛС.")
+
+@r_admin.message(SettingsSG.channel)
+async def channel_set(m: Message, state: FSMContext):
+    if not is_owner(m.from_user.id): return
+    ch = (m.text or "").strip()
+    if ch == "-":
+        ch = ""
+    elif not ch or not valid_channel(ch):
+        await m.answer("Нужен @username канала или числовой ID вида -100..."); return
+    elif (err := await bot_admin_error(ch)):
+        await m.answer(err); return
+    await state.clear()
+    save_setting("channel", ch, m.from_user.id)
+    await m.answer(f"✅ Канал публикаций: {ch or 'ЛС владельца'}")
+
+# после всех кнопок админки: в состоянии поиска они должны срабатывать как обычно
+@r_admin.message(AdminSG.user_search, F.text.regexp(r"^[@\w\s]+$"))
+async def users_search(m: Message, state: FSMContext):
+    if not is_admin(m.from_user.id): return
+    if not parse_user_query(m.text):
+        await m.answer("Не понял запрос. Пример: <code>@ivan vip</code> или <code>123456</code>"); return
+    await state.set_state(None)
+    await state.update_data(ud_query=m.text.strip()[:64], ud_cursors=None)
+    await show_user_directory(m, state, 0, edit=False)
+
 # =======================
 # ---- ИНФО/НАЗАД/ФОЛЛБЕК
 # =======================
@@ -1124,12 +3964,13 @@ async def info(m: Message):
     uname = await bot_username()
     u = get_user(m.from_user.id)
     shop = shop_link_for(m.from_user.id, uname)
+    cd = cfg().pin_cooldown_extra_sec
     await m.answer(
         f"{PROJECT_NAME}\n"
-        f"• Free — модерация, 30 постов/день\n"
+        f"• Free — модерация, {cfg().daily_post_limits[SUB_FREE] or '∞'} постов/день\n"
         f"• VIP/Platinum/Extra — мгновенная публикация\n"
-        f"• Extra: витрина магазина ({shop}), закреп профиля (безлимит, КД 1ч)\n"
-        f"• Platinum: закреп профиля (1/сутки)\n"
+        f"• Extra: витрина магазина ({shop}), закреп профиля (безлимит, {f'КД {fmt_age(cd)}' if cd else 'без КД'})\n"
+        f"• Platinum: закреп профиля ({cfg().pin_daily_plat}/сутки)\n"
         f"• Рекомендации — персональная подборка\n"
         f"• Для подписки/продления: @Andrew_Allen2810"
     )
@@ -1140,7 +3981,7 @@ async def back(m: Message, state: FSMContext):
     u = get_user(m.from_user.id)
     await m.answer("Главное меню", reply_markup=main_kb(bool(u["is_admin"]) if u else False))
 
-@r_public.message()
+@r_fallback.message()
 async def fallback(m: Message):
     u = get_user(m.from_user.id)
     await m.answer("Главное меню", reply_markup=main_kb(bool(u["is_admin"]) if u else False))
@@ -1151,12 +3992,60 @@ async def fallback(m: Message):
 async def on_startup():
     init_db()
     backup_db()
+    load_settings()
+    init_archive()
+    price_stats.load()
+    scheduler.load()
+    schedule_hof_post(force=True)
+    if (n := recover_publishing()):
+        log.warning("%s posts were left in 'publishing', returned to queue/schedule or marked failed", n)
     me = await bot.get_me()
     log.info("Bot started as @%s", me.username)
 
+def reload_settings_on_sighup():
+    # kill -HUP <pid> — перечитать настройки из БД без рестарта
+    if not hasattr(signal, "SIGHUP"): return
+    def _reload():
+        try: log.info("settings reloaded: %s", load_settings())
+        except Exception as e: log.warning("settings reload error: %s", e)
+    try: asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, _reload)
+    except (NotImplementedError, RuntimeError): pass
+
+async def shutdown(metrics_runner: Optional[web.AppRunner]):
+    # сюда попадаем после SIGTERM/SIGINT: aiogram уже не берёт новые апдейты. Ждём хендлеры,
+    # очередь правок канала, планировщик, fan-out и разовые задачи до SHUTDOWN_DEADLINE_SEC,
+    # остальное отменяем — курсоры и статусы уже в БД, после рестарта продолжим с них.
+    t0 = time.monotonic()
+    export_stop.set()
+    left = await supervisor.shutdown(
+        SHUTDOWN_DEADLINE_SEC, drained=lambda: HandlerMetricsMiddleware.inflight == 0 and not len(channel_queue))
+    await bot.session.close()
+    if metrics_runner: await metrics_runner.cleanup()
+    if left: log.warning("not drained in %.0fs, cancelled: %s", SHUTDOWN_DEADLINE_SEC, ", ".join(left))
+    log.info("shutdown done in %.1fs", time.monotonic() - t0)
+
 async def main():
     await on_startup()
-    await dp.start_polling(bot)
+    reload_settings_on_sighup()
+    metrics_runner = await start_metrics_server()
+    supervisor.register("scheduler", scheduler.run, stop=scheduler.stop)
+    supervisor.register("channel_queue", channel_queue.run, restart="on_failure")   # запускает воркеров и выходит
+    supervisor.register("fanout", fanout.run, stop=fanout.stop)
+    supervisor.register("expire_posts", expire_posts_loop)
+    supervisor.register("trust", trust_loop)
+    supervisor.register("archive", archive_loop)
+    supervisor.register("leaderboards", leaderboard_loop)
+    supervisor.register("journal", journal_loop)
+    supervisor.register("moderation_notify", moderation_notify_loop)
+    supervisor.start()
+    if (n := resume_broadcasts()):
+        log.info("resumed %s broadcasts", n)
+    try:
+        await dp.start_polling(bot, close_bot_session=False)   # сессию закрывает shutdown после дренажа
+    finally:
+        await shutdown(metrics_runner)
+        if profiler.stats:
+            log.info("DB profile:\n%s", profiler.report(n=20))
 
 if __name__ == "__main__":
     try:
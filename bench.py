@@ -0,0 +1,332 @@
+# bench.py — микробенчмарки @toweringsale
+# Запуск: python bench.py [имя ...]   (без имён — все по очереди)
+# Работает во временной папке: data/bot.db создаётся там, рабочая база не трогается.
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(tempfile.mkdtemp(prefix="toweringsale_bench_"))
+
+import app  # noqa: E402
+
+BENCHES = {}
+
+def bench(fn):
+    BENCHES[fn.__name__] = fn
+    return fn
+
+def clear_posts():
+    # каждый бенч начинает с пустых постов — и в живой базе, и в архиве, если его создал предыдущий бенч
+    with app.history_db() as conn:
+        for table in app.ARCHIVE_TABLES:
+            conn.execute(f"DELETE FROM main.{table}")
+            if app._archive_cols: conn.execute(f"DELETE FROM arch.{table}")
+
+def pct(values: list[float], q: float) -> float:
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+# =======================
+# ---- ПЛАНИРОВЩИК -------
+# =======================
+@bench
+def scheduler_100k():
+    # 100k задач в куче: 99k на завтра, 1k — через 5..10 сек (запас на вставку и load).
+    # Меряем память кучи и опоздание выдачи относительно run_at.
+    total, soon, spread = 100_000, 1_000, 5.0
+    now = datetime.now()
+    due: dict[int, float] = {}
+    rows = []
+    for i in range(total):
+        run_at = now + (timedelta(seconds=5 + spread * i / soon) if i < soon else timedelta(days=1, seconds=i))
+        rows.append(("bench", i, run_at.isoformat(), "pending", now.isoformat()))
+        if i < soon: due[i] = run_at.timestamp()
+    with app.db() as conn:
+        conn.execute("DELETE FROM scheduled_jobs")
+        conn.executemany("INSERT INTO scheduled_jobs(kind,ref_id,run_at,status,created_at) VALUES(?,?,?,?,?)", rows)
+
+    sched = app.Scheduler(app.RateLimiter(rate=1e9, burst=10**9), app.SCHEDULER_CONCURRENCY)
+    jitter: list[float] = []
+    done = asyncio.Event()
+
+    @sched.handler("bench")
+    async def _job(ref_id: int):
+        jitter.append(time.time() - due[ref_id])
+        if len(jitter) == soon: done.set()
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    sched.load()
+    load_s = time.perf_counter() - t0
+    heap_mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    async def _run():
+        task = asyncio.create_task(sched.run())
+        await asyncio.wait_for(done.wait(), spread + 30)
+        task.cancel()
+    asyncio.run(_run())
+
+    print(f"jobs={total} load={load_s*1000:.0f}ms heap_mem={heap_mem/2**20:.1f}MiB ({heap_mem/total:.0f} B/job)")
+    print(f"dispatched={len(jitter)} jitter p50={pct(jitter,.5)*1000:.1f}ms "
+          f"p99={pct(jitter,.99)*1000:.1f}ms max={max(jitter)*1000:.1f}ms left_in_heap={len(sched)}")
+
+# =======================
+# ---- МЕТРИКИ -----------
+# =======================
+@bench
+def metrics_overhead():
+    # цена middleware на вызов хендлера и trace-callback на запрос к БД
+    n = 200_000
+    mw = app.HandlerMetricsMiddleware()
+
+    class _H:
+        async def callback(self): pass
+    data = {"handler": _H()}
+
+    async def handler(event, data): return None
+
+    async def plain():
+        for _ in range(n): await handler(None, data)
+    async def wrapped():
+        for _ in range(n): await mw(handler, None, data)
+    t0 = time.perf_counter(); asyncio.run(plain()); base = time.perf_counter() - t0
+    t0 = time.perf_counter(); asyncio.run(wrapped()); inst = time.perf_counter() - t0
+    print(f"handler middleware: +{(inst - base) / n * 1e6:.2f} µs/call")
+
+    q = 50_000
+    conn = app._connect()
+    conn.execute("INSERT OR IGNORE INTO users(tg_id, username) VALUES(1, 'bench')")
+    def run():
+        t0 = time.perf_counter()
+        for _ in range(q): conn.execute("SELECT * FROM users WHERE tg_id=?", (1,)).fetchone()
+        return time.perf_counter() - t0
+    traced = run(); conn.set_trace_callback(None); bare = run(); conn.close()
+    print(f"db trace callback: +{(traced - bare) / q * 1e6:.2f} µs/query ({bare / q * 1e6:.1f} µs base)")
+
+    t0 = time.perf_counter()
+    for i in range(n): app.metrics.observe("bench_seconds", 0.003, handler="x")
+    print(f"metrics.observe: {(time.perf_counter() - t0) / n * 1e6:.2f} µs/call")
+
+# =======================
+# ---- РЕНДЕР ПОСТА ------
+# =======================
+async def _legacy_publish_text_for(author, cat: str, text: str) -> str:
+    # publish_text_for до кэша — эталон для побайтовой сверки
+    badge = app.BADGE.get(author["subscription"] or app.SUB_FREE, "")
+    inc = bool(author["incognito"]) and (author["subscription"] in (app.SUB_VIP, app.SUB_PLAT, app.SUB_EXTRA) or author["sub_forever"])
+    uname = await app.bot_username()
+    follow = app.follow_link_for(author["tg_id"], uname)
+    shop = app.shop_link_for(author["tg_id"], uname)
+    author_line = f"👤 Автор: {'Аноним ID'+str(author['tg_id']) if inc else ('@'+author['username'] if author['username'] else 'ID'+str(author['tg_id']))}"
+    cat_title = next((t for t,c in app.CATEGORIES if c==cat), cat)
+    lines = [f"🏷 Категория: {cat_title}", text.strip(), ""]
+    if badge: lines.append(badge)
+    lines.append(author_line)
+    lines.append(f"🛡 Статус: {author['trust_status']}")
+    if not inc:
+        lines.append(f"📩 Подписаться на автора: {follow}")
+        lines.append(f"🛒 Магазин автора: {shop}")
+    lines.append(f"— опубликовано через {app.PROJECT_NAME}")
+    return "\n".join(lines)
+
+@bench
+def publish_render():
+    app._bot_username = "bench_bot"   # без getMe
+    subs = [app.SUB_FREE, app.SUB_VIP, app.SUB_PLAT, app.SUB_EXTRA]
+    with app.db() as conn:
+        conn.execute("DELETE FROM users WHERE tg_id >= 500000")
+        for i in range(64):
+            conn.execute("INSERT INTO users(tg_id, username, subscription, sub_forever, incognito, trust_status) "
+                         "VALUES(?,?,?,?,?,?)",
+                         (500_000 + i, None if i % 7 == 0 else f"seller{i}", subs[i % 4], int(i % 9 == 0),
+                          i % 2, ("verified", "neutral", "scammer")[i % 3]))
+        authors = conn.execute("SELECT * FROM users WHERE tg_id >= 500000").fetchall()
+    cats = [c for _, c in app.CATEGORIES] + ["unknown", None]
+    texts = ["  Продам велосипед, 12 000 руб @seller  ", "iPhone 13\n\nторг\n", ""]
+    cases = [(a, c, t) for a in authors for c in cats for t in texts]
+
+    async def check():
+        for a, c, t in cases:
+            new, old = await app.publish_text_for(a, c, t), await _legacy_publish_text_for(a, c, t)
+            assert new.encode() == old.encode(), (dict(a), c, t)
+    asyncio.run(check())
+    print(f"byte-identical: {len(cases)} комбинаций")
+
+    n = 100_000
+    async def speed(fn):
+        t0 = time.perf_counter()
+        for i in range(n):
+            a, c, t = cases[i % len(cases)]
+            await fn(a, c, t)
+        return n / (time.perf_counter() - t0)
+    old_rps, new_rps = asyncio.run(speed(_legacy_publish_text_for)), asyncio.run(speed(app.publish_text_for))
+    print(f"renders/sec: было {old_rps:,.0f}, стало {new_rps:,.0f} (x{new_rps / old_rps:.1f})")
+
+# =======================
+# ---- FAN-OUT -----------
+# =======================
+@bench
+def fanout_100k():
+    # автор со 100k подписчиков: проход курсора + чекпоинты, отправка — заглушка без сети
+    author, followers = 900_000, 100_000
+    with app.db() as conn:
+        conn.execute("DELETE FROM follows WHERE author_tg=?", (author,))
+        conn.execute("DELETE FROM fanout_jobs WHERE author_tg=?", (author,))
+        conn.execute("INSERT OR IGNORE INTO users(tg_id, username) VALUES(?, 'popular')", (author,))
+        conn.executemany("INSERT INTO follows(follower_tg, author_tg, created_at) VALUES(?,?,?)",
+                         [(1_000_000 + i, author, "") for i in range(followers)])
+        pids = [conn.execute("INSERT INTO posts(author_tg, status, published_msg_id) VALUES(?, 'approved', ?)",
+                             (author, i)).lastrowid for i in (1, 2)]
+    sent = 0
+    async def fake_send(chat_id, text):
+        nonlocal sent
+        sent += 1
+        await asyncio.sleep(0)
+
+    svc = app.FanoutService(app.RateLimiter(rate=1e9, burst=10**9), send=fake_send)
+    svc.notify(author, pids[0], delay=0)
+    svc.notify(author, pids[1], delay=0)   # второй пост в окне — склеится с первым
+    job, _ = svc._next_job()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    asyncio.run(svc.deliver(job))
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    with app.db() as conn:
+        row = conn.execute("SELECT post_ids, sent, status FROM fanout_jobs WHERE id=?", (job["id"],)).fetchone()
+    print(f"followers={followers} sent={sent} jobs_coalesced={row['post_ids']!r} status={row['status']}")
+    print(f"{elapsed:.2f}s, {sent / elapsed:,.0f} msg/s без лимита, peak mem {peak / 2**20:.1f}MiB "
+          f"(реально упирается в BOT_RATE_PER_SEC={app.BOT_RATE_PER_SEC}/s -> {followers / app.BOT_RATE_PER_SEC / 60:.0f} мин)")
+
+# =======================
+# ---- АРХИВ -------------
+# =======================
+def _hot_queries() -> dict:
+    # запросы, которые бот делает постоянно: лента рекомендаций, рассылка активным, очередь, пересчёт досок
+    week = (datetime.now() - timedelta(days=7)).isoformat()
+    def recs():
+        with app.db() as conn:
+            return conn.execute("""
+                SELECT p.id FROM posts p WHERE p.status='approved' AND p.published_msg_id IS NOT NULL
+                ORDER BY p.id DESC LIMIT ?""", (app.cfg().recs_window,)).fetchall()
+    def active7():
+        with app.db() as conn:
+            return conn.execute("SELECT DISTINCT author_tg FROM posts WHERE published_at>=?", (week,)).fetchall()
+    return {"recs": recs, "active7": active7,
+            "mod_queue": app.moderation_queue_stats, "leaderboards": app.refresh_leaderboards}
+
+def _time_queries(runs: int = 20) -> dict[str, float]:
+    out = {}
+    for name, fn in _hot_queries().items():
+        samples = []
+        for _ in range(runs):
+            t0 = time.perf_counter(); fn(); samples.append(time.perf_counter() - t0)
+        out[name] = pct(samples, .5)
+    return out
+
+@bench
+def archive_10m():
+    # BENCH_POSTS постов (по умолчанию 10M): ~97% закрытых старше ARCHIVE_AFTER_DAYS, остальное живое за месяц
+    n = int(os.getenv("BENCH_POSTS", "10000000"))
+    app.load_settings(); app.init_archive()
+    now = datetime.now()
+    t0 = time.perf_counter()
+    clear_posts()
+    with app.db() as conn:
+        conn.execute("""
+            WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i + 1 < 100000)
+            INSERT OR IGNORE INTO users(tg_id, username, subscription)
+            SELECT 1000000 + i, 'seller' || i, CASE WHEN i % 100 = 0 THEN 'extra' ELSE 'free' END FROM seq""")
+        conn.execute("""
+            WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i + 1 < ?)
+            INSERT INTO posts(author_tg, category, text, status, published_msg_id, published_at, created_at)
+            SELECT 1000000 + i % 100000, 'misc', 'bench',
+                   CASE WHEN i % 100 >= 3 THEN (CASE i % 3 WHEN 0 THEN 'sold' WHEN 1 THEN 'expired' ELSE 'rejected' END)
+                        WHEN i % 100 = 2 THEN 'pending' ELSE 'approved' END,
+                   i, datetime(?, '-' || CASE WHEN i % 100 >= 3 THEN 120 + i % 900 ELSE i % 30 END || ' days'),
+                   datetime(?, '-' || CASE WHEN i % 100 >= 3 THEN 120 + i % 900 ELSE i % 30 END || ' days')
+            FROM seq""", (n, now.isoformat(), now.isoformat()))
+        conn.execute("""
+            INSERT INTO complaints(post_id, from_tg, reason, created_at)
+            SELECT id, 1, 'bench', created_at FROM posts WHERE id % 50 = 0""")
+    print(f"posts={n:,} сгенерировано за {time.perf_counter() - t0:.0f}s")
+    conn = app._connect(); conn.execute("ANALYZE"); conn.close()
+
+    before = _time_queries()
+    cutoff = (now - timedelta(days=app.ARCHIVE_AFTER_DAYS)).isoformat()
+    t0 = time.perf_counter(); moved = 0; worst = 0.0
+    while True:
+        tb = time.perf_counter()
+        k = app.archive_batch(cutoff)
+        worst = max(worst, time.perf_counter() - tb)
+        if not k: break
+        moved += k
+    elapsed = time.perf_counter() - t0
+    print(f"archived={moved:,} за {elapsed:.0f}s ({moved / max(elapsed, 1e-9):,.0f} posts/s, "
+          f"пачка {app.ARCHIVE_BATCH} держит запись до {worst * 1000:.0f}ms)")
+    conn = app._connect(); conn.execute("ANALYZE"); conn.close()
+    after = _time_queries()
+    for name in before:
+        print(f"{name:>10}: p50 {before[name] * 1000:8.2f}ms -> {after[name] * 1000:8.2f}ms (x{before[name] / max(after[name], 1e-9):.1f})")
+    with app.history_db() as conn:
+        t0 = time.perf_counter()
+        total = conn.execute("SELECT COUNT(*) FROM all_posts WHERE author_tg=1000007").fetchone()[0]
+        print(f"история автора через all_posts: {total} постов за {(time.perf_counter() - t0) * 1000:.1f}ms")
+
+# =======================
+# ---- ЭКСПОРТ -----------
+# =======================
+@bench
+def export_flat_mem():
+    # пик памяти выгрузки не должен расти с размером таблицы: 10% и 100% от BENCH_EXPORT_ROWS (2M).
+    # Скорость печатается под tracemalloc — без него в несколько раз быстрее.
+    n = int(os.getenv("BENCH_EXPORT_ROWS", "2000000"))
+    def fill(rows: int):
+        clear_posts()
+        with app.db() as conn:
+            conn.execute("""
+                WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i + 1 < ?)
+                INSERT INTO posts(author_tg, category, text, price, status, created_at)
+                SELECT 1000000 + i % 100000, 'misc', 'Продам «вещь» №' || i || ', торг, пишите в ЛС', i % 50000,
+                       'sold', datetime('now', '-' || (i % 900) || ' days')
+                FROM seq""", (rows,))
+    peaks = {}
+    for rows in (n // 10, n):
+        fill(rows)
+        for fmt in app.EXPORT_FORMATS:
+            path = f"bench_export.{fmt}.gz"
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            done = app.write_export("posts", fmt, path, {"rows": 0})
+            elapsed = time.perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            assert done == rows, (done, rows)
+            peaks[(rows, fmt)] = peak
+            print(f"{fmt:>5} rows={rows:>9,} {elapsed:5.1f}s ({rows / elapsed:,.0f} rows/s) "
+                  f"file={os.path.getsize(path) / 2**20:6.1f}MiB peak={peak / 2**20:.2f}MiB")
+            os.remove(path)
+    for fmt in app.EXPORT_FORMATS:
+        small, big = peaks[(n // 10, fmt)], peaks[(n, fmt)]
+        assert big < small * 1.5 + 2**20, f"{fmt}: память растёт с таблицей ({small} -> {big})"
+    print("память плоская: пик не зависит от числа строк")
+
+def main(argv: list[str]):
+    app.init_db()
+    for name in argv or list(BENCHES):
+        if name not in BENCHES:
+            print(f"нет такого бенчмарка: {name} (есть: {', '.join(BENCHES)})"); continue
+        print(f"== {name}")
+        BENCHES[name]()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
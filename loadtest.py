@@ -0,0 +1,419 @@
+# loadtest.py — нагрузочный прогон app.py без настоящего Telegram
+# Поднимает фейковый Bot API (aiohttp), запускает app.py с BOT_API_URL на него и гоняет сценарии:
+#   /start -> размещение поста -> модерация владельцем -> рекомендации, в конце рассылка от владельца.
+# Запуск:
+#   python loadtest.py --users 200 --concurrency 50 --latency-ms 30 --p429 0.01 --out run.json
+#   python loadtest.py --users 200 --out new.json --compare run.json   # сравнить с прошлым прогоном
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import signal
+import socket
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Callable, Optional
+
+import aiohttp
+from aiohttp import web
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOKEN = "123456:LOADTEST"
+OWNER_ID = 1
+MODERATOR_ID = 2     # второй админ: разбирает очередь модерации
+CHANNEL = "@loadtest"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Toweringsale", "username": "toweringsale_load_bot"}
+SEND_METHODS = {"sendMessage", "sendPhoto", "sendVideo", "sendVoice", "sendMediaGroup", "sendDocument"}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def pct(values: list[float], q: float) -> float:
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+# =======================
+# ---- ФЕЙКОВЫЙ BOT API --
+# =======================
+class FakeBotAPI:
+    # Принимает вызовы Bot API, отвечает правдоподобными объектами и складывает исходящие
+    # сообщения в очереди по чатам.
+    def __init__(self, latency: float, p429: float, rnd: random.Random):
+        self.latency, self.p429, self.rnd = latency, p429, rnd
+        self.updates: list[dict] = []
+        self._update_seq = 0
+        self._msg_seq = 0
+        self._new_update = asyncio.Event()
+        self.chats: dict[int | str, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self.calls: dict[str, int] = defaultdict(int)
+        self.throttled = 0
+        self.ready = asyncio.Event()
+
+    # ---- входящие апдейты (их «присылает Telegram») ----
+    def push_update(self, kind: str, payload: dict):
+        self._update_seq += 1
+        self.updates.append({"update_id": self._update_seq, kind: payload})
+        self._new_update.set()
+
+    def next_msg_id(self) -> int:
+        self._msg_seq += 1
+        return self._msg_seq
+
+    # ---- HTTP ----
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        form = await request.post()
+        self.calls[method] += 1
+        if method != "getUpdates" and self.latency:
+            await asyncio.sleep(self.latency * self.rnd.uniform(0.5, 1.5))
+        if method in SEND_METHODS and self.p429 and self.rnd.random() < self.p429:
+            self.throttled += 1
+            return web.json_response({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                      "parameters": {"retry_after": 1}})
+        fn = getattr(self, "m_" + method, None)
+        result = await fn(form) if fn else True
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def _chat_id(raw: str):
+        return int(raw) if raw.lstrip("-").isdigit() else raw
+
+    @staticmethod
+    def _chat(cid) -> dict:
+        if isinstance(cid, str):
+            return {"id": -1001000000001, "type": "channel", "title": cid, "username": cid.lstrip("@")}
+        return {"id": cid, "type": "private", "first_name": f"U{cid}"}
+
+    def _emit(self, method: str, cid, msg: dict, markup: Optional[dict]):
+        event = {"method": method, "chat_id": cid, "text": msg.get("text") or msg.get("caption") or "",
+                 "markup": markup, "message": msg, "ts": time.perf_counter()}
+        self.chats[cid].put_nowait(event)
+
+    def _send(self, method: str, form, body_key: str, extra: Optional[dict] = None) -> dict:
+        cid = self._chat_id(form["chat_id"])
+        markup = json.loads(form["reply_markup"]) if "reply_markup" in form else None
+        msg = {"message_id": self.next_msg_id(), "date": int(time.time()), "chat": self._chat(cid), "from": BOT_USER}
+        if form.get(body_key): msg[body_key] = form[body_key]
+        if markup and "inline_keyboard" in markup: msg["reply_markup"] = markup
+        msg.update(extra or {})
+        self._emit(method, cid, msg, markup)
+        return msg
+
+    async def m_getMe(self, form):
+        self.ready.set()
+        return BOT_USER
+
+    async def m_getUpdates(self, form):
+        offset = int(form.get("offset", 0) or 0)
+        timeout = float(form.get("timeout", 0) or 0)
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates and timeout:
+            self._new_update.clear()
+            try: await asyncio.wait_for(self._new_update.wait(), timeout)
+            except asyncio.TimeoutError: pass
+        return self.updates[:int(form.get("limit", 100) or 100)]
+
+    async def m_sendMessage(self, form):
+        return self._send("sendMessage", form, "text")
+
+    async def m_sendPhoto(self, form):
+        photo = [{"file_id": form["photo"], "file_unique_id": "p", "width": 1, "height": 1}]
+        return self._send("sendPhoto", form, "caption", {"photo": photo})
+
+    async def m_sendVideo(self, form):
+        video = {"file_id": form["video"], "file_unique_id": "v", "width": 1, "height": 1, "duration": 1}
+        return self._send("sendVideo", form, "caption", {"video": video})
+
+    async def m_sendVoice(self, form):
+        return self._send("sendVoice", form, "caption", {"voice": {"file_id": form["voice"], "file_unique_id": "a", "duration": 1}})
+
+    async def m_sendDocument(self, form):
+        return self._send("sendDocument", form, "caption", {"document": {"file_id": "doc", "file_unique_id": "d"}})
+
+    async def m_sendMediaGroup(self, form):
+        cid = self._chat_id(form["chat_id"])
+        out = []
+        for item in json.loads(form["media"]):
+            msg = {"message_id": self.next_msg_id(), "date": int(time.time()), "chat": self._chat(cid),
+                   "from": BOT_USER, "media_group_id": "g"}
+            if item.get("caption"): msg["caption"] = item["caption"]
+            out.append(msg)
+        self._emit("sendMediaGroup", cid, out[0], None)
+        return out
+
+    async def _edit(self, method: str, form, body_key: str):
+        cid = self._chat_id(form["chat_id"])
+        markup = json.loads(form["reply_markup"]) if "reply_markup" in form else None
+        msg = {"message_id": int(form["message_id"]), "date": int(time.time()), "chat": self._chat(cid),
+               "from": BOT_USER, "edit_date": int(time.time())}
+        if form.get(body_key): msg[body_key] = form[body_key]
+        if markup and "inline_keyboard" in markup: msg["reply_markup"] = markup
+        self._emit(method, cid, msg, markup)
+        return msg
+
+    async def m_editMessageText(self, form):
+        return await self._edit("editMessageText", form, "text")
+
+    async def m_editMessageCaption(self, form):
+        return await self._edit("editMessageCaption", form, "caption")
+
+    async def m_getChatMember(self, form):
+        return {"status": "member", "user": {"id": int(form["user_id"]), "is_bot": False, "first_name": "U"}}
+
+# =======================
+# ---- ГЕНЕРАТОР ---------
+# =======================
+class Client:
+    # Пользователь Telegram: шлёт сообщения/нажимает кнопки и ждёт ответа бота в своём чате
+    def __init__(self, api: FakeBotAPI, uid: int, stats: dict[str, list[float]], timeout: float):
+        self.api, self.uid, self.stats, self.timeout = api, uid, stats, timeout
+        self.user = {"id": uid, "is_bot": False, "first_name": f"U{uid}", "username": f"load_user{uid}"}
+        self._msg_seq = 0
+
+    def _message(self, text: str) -> dict:
+        self._msg_seq += 1
+        msg = {"message_id": self._msg_seq, "date": int(time.time()), "chat": FakeBotAPI._chat(self.uid),
+               "from": self.user, "text": text}
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return msg
+
+    async def expect(self, action: str, t0: float, pred: Callable[[dict], bool]) -> dict:
+        q = self.api.chats[self.uid]
+        deadline = time.perf_counter() + self.timeout
+        while True:
+            left = deadline - time.perf_counter()
+            if left <= 0:
+                self.stats["timeout:" + action].append(self.timeout)
+                raise TimeoutError(f"{self.uid}: нет ответа на «{action}»")
+            event = await asyncio.wait_for(q.get(), left)
+            if pred(event):
+                self.stats[action].append(event["ts"] - t0)
+                return event
+
+    async def say(self, action: str, text: str, pred: Callable[[dict], bool]) -> dict:
+        t0 = time.perf_counter()
+        self.api.push_update("message", self._message(text))
+        return await self.expect(action, t0, pred)
+
+    async def click(self, action: str, message: dict, data: str, pred: Callable[[dict], bool]) -> dict:
+        t0 = time.perf_counter()
+        self.api.push_update("callback_query", {"id": f"{self.uid}-{time.time_ns()}", "from": self.user,
+                                                "chat_instance": str(self.uid), "data": data, "message": message})
+        return await self.expect(action, t0, pred)
+
+def has(substr: str) -> Callable[[dict], bool]:
+    return lambda e: substr in e["text"]
+
+async def user_session(api: FakeBotAPI, uid: int, rnd: random.Random, stats, timeout: float, think: float):
+    c = Client(api, uid, stats, timeout)
+    pause = lambda: asyncio.sleep(rnd.uniform(0, think))
+    await c.say("start", "/start", has("Добро пожаловать")); await pause()
+    await c.say("post_start", "➕ Разместить объявление", has("категорию")); await pause()
+    await c.say("post_cat", rnd.choice(["Продам", "Куплю", "Обмен", "Услуги"]), has("Отправьте текст")); await pause()
+    item = rnd.choice(["велосипед", "ноутбук", "диван", "iPhone", "репетитор", "коляску"])
+    preview = await c.say("post_collect", f"{item}, {rnd.randint(5, 900) * 100} руб, пишите @load_user{uid}",
+                          has("Превью"))
+    await pause()
+    await c.click("post_submit", preview["message"], "post:ok", has("модерацию"))
+    t0 = time.perf_counter()
+    await c.expect("moderation_roundtrip", t0, has("одобрен"))
+    await pause()
+    await c.say("recommendations", "🔮 Рекомендации", lambda e: "Рекомендации" in e["text"] or "нечего" in e["text"])
+
+def buttons(event: dict) -> list[str]:
+    return [b.get("callback_data", "") for row in (event["markup"] or {}).get("inline_keyboard", []) for b in row]
+
+async def moderator(api: FakeBotAPI, stats, stop: asyncio.Event, timeout: float):
+    # тянет посты из очереди модерации пачками и одобряет взятое
+    mod = Client(api, MODERATOR_ID, stats, timeout)
+    while not stop.is_set():
+        view = await mod.say("mod_queue", "🗂 Очередь модерации", has("Очередь модерации"))
+        if "mq:take:0" not in buttons(view):
+            await asyncio.sleep(0.3); continue
+        taken = await mod.click("mod_take", view["message"], "mq:take:0", lambda e: "Взято" in e["text"] or "пуста" in e["text"])
+        if "mq:ba:0" in buttons(taken):
+            await mod.click("mod_approve", taken["message"], "mq:ba:0", has("Одобрено"))
+
+async def broadcast(api: FakeBotAPI, stats, timeout: float):
+    owner = Client(api, OWNER_ID, stats, timeout)
+    menu = await owner.say("bc_menu", "📨 Рассылка", has("Аудитория"))
+    await owner.click("bc_pick", menu["message"], "bc:all", has("текст рассылки"))
+    await owner.say("broadcast", "Нагрузочный тест: рассылка", has("Отправлено"))
+
+# =======================
+# ---- МЕТРИКИ app.py ----
+# =======================
+_RE_SAMPLE = re.compile(r'^(\w+?)(?:\{(.*)\})?\s+([-+\deE.naifNI]+)$')
+
+def parse_prometheus(text: str) -> list[tuple[str, dict, float]]:
+    out = []
+    for line in text.splitlines():
+        m = _RE_SAMPLE.match(line)
+        if not m: continue
+        labels = dict(re.findall(r'(\w+)="([^"]*)"', m.group(2) or ""))
+        out.append((m.group(1), labels, float(m.group(3))))
+    return out
+
+def server_summary(samples: list[tuple[str, dict, float]]) -> dict:
+    # квантили задержки хендлеров по сумме корзин всех хендлеров + время БД
+    buckets: dict[float, float] = defaultdict(float)
+    per_handler: dict[str, dict] = defaultdict(lambda: {"count": 0, "sum": 0.0})
+    db_total = queries = 0.0
+    for name, labels, v in samples:
+        if name == "toweringsale_handler_seconds_bucket":
+            buckets[float("inf") if labels["le"] == "+Inf" else float(labels["le"])] += v
+        elif name == "toweringsale_handler_seconds_sum":
+            per_handler[labels["handler"]]["sum"] += v
+        elif name == "toweringsale_handler_seconds_count":
+            per_handler[labels["handler"]]["count"] += v
+        elif name == "toweringsale_db_seconds_sum":
+            db_total += v
+        elif name == "toweringsale_db_queries_total":
+            queries += v
+    total = buckets.get(float("inf"), 0)
+    def q(p):
+        for le in sorted(buckets):
+            if buckets[le] >= p * total: return le
+        return 0.0
+    return {
+        "handler_p50_ms": q(.5) * 1000, "handler_p95_ms": q(.95) * 1000, "handler_p99_ms": q(.99) * 1000,
+        "handlers": {h: {"count": int(d["count"]), "avg_ms": d["sum"] / d["count"] * 1000}
+                     for h, d in per_handler.items() if d["count"]},
+        "db_seconds_total": db_total, "db_queries_total": int(queries),
+    }
+
+# =======================
+# ---- ПРОГОН ------------
+# =======================
+async def run(args) -> dict:
+    rnd = random.Random(args.seed)
+    api = FakeBotAPI(args.latency_ms / 1000, args.p429, rnd)
+    api_port, metrics_port = free_port(), free_port()
+    wapp = web.Application(client_max_size=64 * 2**20)
+    wapp.router.add_post("/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(wapp, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", api_port).start()
+
+    workdir = tempfile.mkdtemp(prefix="toweringsale_load_")
+    env = dict(os.environ, BOT_TOKEN=TOKEN, OWNER_ID=str(OWNER_ID), CHANNEL=CHANNEL,
+               BOT_API_URL=f"http://127.0.0.1:{api_port}", METRICS_PORT=str(metrics_port),
+               CHANNEL_RATE_PER_MIN="60000",   # у фейкового API нет лимита канала
+               DB_PROFILE="1" if args.profile else "0")
+    log = open(os.path.join(workdir, "app.log"), "w")
+    proc = await asyncio.create_subprocess_exec(sys.executable, os.path.join(HERE, "app.py"),
+                                                cwd=workdir, env=env, stdout=log, stderr=log)
+    stats: dict[str, list[float]] = defaultdict(list)
+    errors: list[str] = []
+    try:
+        await asyncio.wait_for(api.ready.wait(), 30)
+        owner = Client(api, OWNER_ID, stats, args.timeout)
+        await owner.say("owner_start", "/start", has("Добро пожаловать"))
+        mod = Client(api, MODERATOR_ID, stats, args.timeout)
+        await mod.say("mod_start", "/start", has("Добро пожаловать"))
+        await owner.say("grant_menu", "🗝 Выдать/Снять админа", has("Выдать"))
+        await owner.say("grant_admin", str(MODERATOR_ID), has("Выдал"))
+
+        stop = asyncio.Event()
+        mod_task = asyncio.create_task(moderator(api, stats, stop, args.timeout))
+        sem = asyncio.Semaphore(args.concurrency)
+        calls_before = sum(api.calls.values())
+
+        async def one(i: int):
+            async with sem:
+                try:
+                    await user_session(api, 10_000 + i, random.Random(args.seed * 1_000_003 + i), stats,
+                                       args.timeout, args.think_ms / 1000)
+                except Exception as e:
+                    errors.append(str(e) or type(e).__name__)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.users)))
+        sessions_s = time.perf_counter() - t0
+        if args.broadcast:
+            try: await broadcast(api, stats, args.timeout + args.users * 0.05)
+            except Exception as e: errors.append(f"broadcast: {e}")
+        elapsed = time.perf_counter() - t0
+        stop.set(); await mod_task
+
+        async with aiohttp.ClientSession() as http:
+            async with http.get(f"http://127.0.0.1:{metrics_port}/metrics") as r:
+                server = server_summary(parse_prometheus(await r.text()))
+    finally:
+        if proc.returncode is None:
+            proc.send_signal(signal.SIGINT)
+            try: await asyncio.wait_for(proc.wait(), 15)
+            except asyncio.TimeoutError: proc.kill()
+        log.close()
+        await runner.cleanup()
+
+    updates = sum(len(v) for k, v in stats.items() if not k.startswith("timeout:"))
+    return {
+        "params": {k: getattr(args, k) for k in ("users", "concurrency", "latency_ms", "p429", "think_ms", "seed")},
+        "elapsed_s": elapsed, "sessions_s": sessions_s,
+        "throughput_actions_per_s": updates / elapsed if elapsed else 0.0,
+        "api_calls": sum(api.calls.values()) - calls_before, "api_throttled": api.throttled,
+        "errors": len(errors), "error_samples": errors[:5],
+        "actions": {k: {"count": len(v), "p50_ms": pct(v, .5) * 1000, "p95_ms": pct(v, .95) * 1000,
+                        "p99_ms": pct(v, .99) * 1000} for k, v in sorted(stats.items())},
+        "server": server, "workdir": workdir,
+    }
+
+def print_report(res: dict, prev: Optional[dict]):
+    def delta(cur: float, old: Optional[float]) -> str:
+        if old in (None, 0): return ""
+        return f" ({(cur - old) / old * 100:+.0f}%)"
+    p = (prev or {})
+    print(f"Пользователей: {res['params']['users']}, конкуренция {res['params']['concurrency']}, "
+          f"latency {res['params']['latency_ms']} мс, 429: {res['params']['p429']}")
+    print(f"Время: {res['elapsed_s']:.1f} с, пропускная способность: {res['throughput_actions_per_s']:.1f} действий/с"
+          f"{delta(res['throughput_actions_per_s'], p.get('throughput_actions_per_s'))}")
+    print(f"Вызовов API: {res['api_calls']}, из них 429: {res['api_throttled']}, ошибок сценария: {res['errors']}")
+    print(f"{'действие':<24}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}   (мс, от апдейта до ответа)")
+    for name, a in res["actions"].items():
+        old = p.get("actions", {}).get(name, {})
+        print(f"{name:<24}{a['count']:>6}{a['p50_ms']:>10.1f}{a['p95_ms']:>10.1f}{a['p99_ms']:>10.1f}"
+              f"{delta(a['p95_ms'], old.get('p95_ms'))}")
+    s, ps = res["server"], p.get("server", {})
+    print(f"Хендлеры (сервер): p50 ≤{s['handler_p50_ms']:.1f} p95 ≤{s['handler_p95_ms']:.1f} "
+          f"p99 ≤{s['handler_p99_ms']:.1f} мс{delta(s['handler_p95_ms'], ps.get('handler_p95_ms'))}")
+    print(f"БД: {s['db_seconds_total']*1000:.0f} мс суммарно, {s['db_queries_total']} запросов"
+          f"{delta(s['db_seconds_total'], ps.get('db_seconds_total'))}")
+    for h, d in sorted(s["handlers"].items(), key=lambda kv: -kv[1]["avg_ms"])[:8]:
+        print(f"  {h:<28}{d['count']:>6} × {d['avg_ms']:.2f} мс")
+    if res["error_samples"]:
+        print("Примеры ошибок:", *res["error_samples"], sep="\n  ")
+    print(f"Логи app.py: {res['workdir']}/app.log")
+
+def main():
+    ap = argparse.ArgumentParser(description="Нагрузочный прогон app.py против фейкового Bot API")
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--latency-ms", type=float, default=20.0, help="задержка ответа фейкового API")
+    ap.add_argument("--p429", type=float, default=0.0, help="доля send*-вызовов, отвечающих 429")
+    ap.add_argument("--think-ms", type=float, default=50.0, help="пауза «пользователя» между шагами (макс)")
+    ap.add_argument("--timeout", type=float, default=30.0, help="ожидание ответа на одно действие, с")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--no-broadcast", dest="broadcast", action="store_false")
+    ap.add_argument("--profile", action="store_true", help="включить профайлер запросов в app.py")
+    ap.add_argument("--out", help="сохранить результат в JSON")
+    ap.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = ap.parse_args()
+    res = asyncio.run(run(args))
+    prev = json.load(open(args.compare)) if args.compare else None
+    print_report(res, prev)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(res, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()